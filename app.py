@@ -1,83 +1,2184 @@
-from flask import Flask, render_template, request, jsonify, session
+from flask import Flask, render_template, request, jsonify, session, Response, stream_with_context
+from flask_sock import Sock, ConnectionClosed
+import click
 import psycopg2
-from psycopg2.extras import RealDictCursor
+from psycopg2 import sql
+from psycopg2.extras import RealDictCursor, execute_values
 import os
 import uuid
 import re
 import random
 import json
-from datetime import datetime
-import nltk
-from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.metrics.pairwise import cosine_similarity
-import numpy as np
+import csv
+import array
+import fcntl
+import mmap
+import struct
+import math
+import hashlib
+import hmac
+import io
+import base64
+import importlib.util
+from datetime import datetime, timezone
 import logging
+import logging.handlers
 import sys
-import pandas as pd
-from textblob import TextBlob
-try:
-    from janome.tokenizer import Tokenizer
-    JANOME_AVAILABLE = True
-except ImportError:
-    JANOME_AVAILABLE = False
-
-# NLTK データダウンロード（初回のみ）
-try:
-    nltk.data.find('tokenizers/punkt')
-except LookupError:
-    nltk.download('punkt')
-
-try:
-    nltk.data.find('corpora/stopwords')
-except LookupError:
-    nltk.download('stopwords')
-
-# ログ設定を追加
-logging.basicConfig(
-    level=logging.DEBUG,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.StreamHandler(sys.stdout),
-    ],
-    force=True
-)
+import time
+import atexit
+import gc
+import select
+import threading
+import multiprocessing
+import queue
+from collections import deque, Counter, OrderedDict
+from functools import lru_cache, wraps
+from contextlib import contextmanager, closing
+from concurrent.futures import ProcessPoolExecutor
+
+# 重いNLPライブラリ（scikit-learn / NumPy / Janome）は起動時には読み込まず、
+# 初回使用時または warm_up() で読み込む。起動時にネットワークアクセスはしない
+JANOME_AVAILABLE = importlib.util.find_spec('janome') is not None
+PYARROW_AVAILABLE = importlib.util.find_spec('pyarrow') is not None
+
+# ログ設定（環境変数で上書き可能）
+LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO').upper()
+LOG_WERKZEUG_LEVEL = os.environ.get('LOG_WERKZEUG_LEVEL', 'WARNING').upper()
+LOG_FORMAT = os.environ.get('LOG_FORMAT', 'json')  # json | text
+LOG_QUEUE_SIZE = int(os.environ.get('LOG_QUEUE_SIZE', '10000'))
+LOG_TURN_SAMPLE_RATE = float(os.environ.get('LOG_TURN_SAMPLE_RATE', '1.0'))
+
+
+class JsonLogFormatter(logging.Formatter):
+    """1レコードを1行のJSONに整形（extra={'fields': {...}} の項目も出力）"""
+    
+    def format(self, record):
+        entry = {
+            'time': datetime.fromtimestamp(record.created).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'pid': record.process,
+            'message': record.getMessage()
+        }
+        entry.update(getattr(record, 'fields', None) or {})
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class TextLogFormatter(logging.Formatter):
+    """従来のテキスト形式（extraの項目は key=value で末尾に付ける）"""
+    
+    def __init__(self):
+        super().__init__('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    
+    def format(self, record):
+        text = super().format(record)
+        fields = getattr(record, 'fields', None)
+        if fields:
+            text += ' ' + ' '.join(f"{key}={value!r}" for key, value in fields.items())
+        return text
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """キューが満杯ならリクエストを待たせずにレコードを破棄するハンドラ"""
+    
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+    
+    def prepare(self, record):
+        # 同一プロセス内のスレッドに渡すだけなので、メッセージの整形も書き出し側で行う
+        return record
+    
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class SampleFilter(logging.Filter):
+    """DEBUGレコードを一定の割合だけ通す（1メッセージごとのログ量を抑える）"""
+    
+    def __init__(self, rate):
+        super().__init__()
+        self.rate = rate
+    
+    def filter(self, record):
+        return record.levelno > logging.DEBUG or random.random() < self.rate
+
+
+def _start_log_listener():
+    """キューからレコードを取り出して標準出力へ書く専用スレッドを開始"""
+    global _log_listener
+    _log_handler.queue = queue.Queue(maxsize=LOG_QUEUE_SIZE)
+    stream_handler = logging.StreamHandler(sys.stdout)
+    stream_handler.setFormatter(JsonLogFormatter() if LOG_FORMAT == 'json' else TextLogFormatter())
+    _log_listener = logging.handlers.QueueListener(_log_handler.queue, stream_handler)
+    _log_listener.start()
+
+
+def _stop_log_listener():
+    """残っているレコードを書き出してから専用スレッドを停止"""
+    if _log_listener is not None and _log_listener._thread is not None:
+        _log_listener.stop()
+
+
+def get_logging_stats():
+    """ログキューの統計"""
+    return {
+        'level': LOG_LEVEL,
+        'format': LOG_FORMAT,
+        'queued': _log_handler.queue.qsize(),
+        'dropped': _log_handler.dropped,
+        'turn_sample_rate': LOG_TURN_SAMPLE_RATE
+    }
+
+
+# リクエスト処理中のスレッドはキューに積むだけで、標準出力への書き込みは専用スレッドが行う
+_log_handler = DroppingQueueHandler(None)
+_log_listener = None
+_start_log_listener()
+logging.basicConfig(level=LOG_LEVEL, handlers=[_log_handler], force=True)
+logging.getLogger('werkzeug').setLevel(LOG_WERKZEUG_LEVEL)
+# フォーク先（バッチ解析のワーカーなど）では書き出しスレッドを作り直す
+os.register_at_fork(after_in_child=_start_log_listener)
+atexit.register(_stop_log_listener)
+
+logger = logging.getLogger('chatbot')
+# 1メッセージごとのデバッグログ（LOG_TURN_SAMPLE_RATE の割合だけ出力）
+turn_logger = logging.getLogger('chatbot.turn')
+turn_logger.addFilter(SampleFilter(LOG_TURN_SAMPLE_RATE))
 
 app = Flask(__name__)
 app.secret_key = 'your-secret-key-change-this-in-production'
 
-# Flaskのログレベルも設定
-app.logger.setLevel(logging.DEBUG)
-logging.getLogger('werkzeug').setLevel(logging.DEBUG)
+# コネクションプール設定（環境変数で上書き可能）
+DB_POOL_MIN_SIZE = int(os.environ.get('DB_POOL_MIN_SIZE', '1'))
+DB_POOL_MAX_SIZE = int(os.environ.get('DB_POOL_MAX_SIZE', '10'))
+DB_POOL_TIMEOUT = float(os.environ.get('DB_POOL_TIMEOUT', '5'))
+DB_POOL_HEALTHCHECK_INTERVAL = float(os.environ.get('DB_POOL_HEALTHCHECK_INTERVAL', '30'))
+
+# 接続先（DATABASE_URL が未設定なら docker-compose の postgres サービス）
+# 読み取り専用の処理は DATABASE_REPLICA_URLS（カンマ区切り）のレプリカへ振り分け、使えなければプライマリで実行する
+DATABASE_URL = os.environ.get('DATABASE_URL', '')
+DATABASE_REPLICA_URLS = [url.strip() for url in os.environ.get('DATABASE_REPLICA_URLS', '').split(',') if url.strip()]
+DB_REPLICA_RETRY_INTERVAL = float(os.environ.get('DB_REPLICA_RETRY_INTERVAL', '30'))
+# レプリカに自分の最新の会話がまだ反映されていなければプライマリから読む
+DB_READ_YOUR_WRITES = os.environ.get('DB_READ_YOUR_WRITES', '1') == '1'
+
+# エンドポイントごとの同時実行数と待ち行列の上限（ワーカー単位、0なら制限しない）
+# 同時実行数の合計を DB_POOL_MAX_SIZE 以下にしておくと、分析や履歴が詰まってもチャットの接続は残る
+ADMISSION_CHAT_CONCURRENCY = int(os.environ.get('ADMISSION_CHAT_CONCURRENCY', '6'))
+ADMISSION_CHAT_QUEUE = int(os.environ.get('ADMISSION_CHAT_QUEUE', '32'))
+ADMISSION_HISTORY_CONCURRENCY = int(os.environ.get('ADMISSION_HISTORY_CONCURRENCY', '2'))
+ADMISSION_HISTORY_QUEUE = int(os.environ.get('ADMISSION_HISTORY_QUEUE', '16'))
+ADMISSION_ANALYTICS_CONCURRENCY = int(os.environ.get('ADMISSION_ANALYTICS_CONCURRENCY', '1'))
+ADMISSION_ANALYTICS_QUEUE = int(os.environ.get('ADMISSION_ANALYTICS_QUEUE', '4'))
+ADMISSION_EXPORT_CONCURRENCY = int(os.environ.get('ADMISSION_EXPORT_CONCURRENCY', '1'))
+ADMISSION_EXPORT_QUEUE = int(os.environ.get('ADMISSION_EXPORT_QUEUE', '0'))
+ADMISSION_BATCH_CONCURRENCY = int(os.environ.get('ADMISSION_BATCH_CONCURRENCY', '1'))
+ADMISSION_BATCH_QUEUE = int(os.environ.get('ADMISSION_BATCH_QUEUE', '2'))
+ADMISSION_QUEUE_TIMEOUT = float(os.environ.get('ADMISSION_QUEUE_TIMEOUT', '1'))
+ADMISSION_RETRY_AFTER = int(os.environ.get('ADMISSION_RETRY_AFTER', '1'))
+
+# インテント・知識ベースのカタログキャッシュ設定
+CATALOG_TTL = float(os.environ.get('CATALOG_TTL', '300'))
+CATALOG_LISTEN = os.environ.get('CATALOG_LISTEN', '1') == '1'
+CATALOG_CHANNEL = 'catalog_changed'
+
+# 一括解析設定（gunicorn のワーカーごとにプロセスプールを持つため、既定ではプロセス数を4までに抑える）
+ANALYZE_BATCH_WORKERS = int(os.environ.get('ANALYZE_BATCH_WORKERS', str(min(4, os.cpu_count() or 1))))
+ANALYZE_BATCH_CHUNK_SIZE = int(os.environ.get('ANALYZE_BATCH_CHUNK_SIZE', '500'))
+
+# 感情分析の方式（keyword: 従来の単語リストを部分一致で照合 / lexicon: 重み付き感情辞書を形態素単位で照合）
+# lexicon は否定や強調を考慮するため判定結果が変わる（切り替えたら make db-reanalyze で保存済みの会話も更新する）
+SENTIMENT_ENGINE = os.environ.get('SENTIMENT_ENGINE', 'keyword')
+SENTIMENT_ENGINES = ('keyword', 'lexicon')
+# 追加の感情辞書（TSV: 見出し語<TAB>重み[<TAB>種別]。組み込みの辞書に上書きで追加、空なら組み込みのみ）
+SENTIMENT_LEXICON_PATH = os.environ.get('SENTIMENT_LEXICON_PATH', '')
+# 否定語（「ない」「ぬ」など）が打ち消す直前の語数
+SENTIMENT_NEGATION_WINDOW = int(os.environ.get('SENTIMENT_NEGATION_WINDOW', '3'))
+
+# TF-IDF類似検索（インテント・キーワードに一致しないメッセージ用）
+RETRIEVAL_MODEL_PATH = os.environ.get('RETRIEVAL_MODEL_PATH', 'models/retrieval.joblib')
+RETRIEVAL_TOP_K = int(os.environ.get('RETRIEVAL_TOP_K', '3'))
+RETRIEVAL_MIN_SCORE = float(os.environ.get('RETRIEVAL_MIN_SCORE', '0.2'))
+# ベクトライザの設定や文書の作り方、保存形式を変えたら更新する（保存済みモデルを無効化）
+RETRIEVAL_MODEL_VERSION = 2
+
+# コンパイル済みの読み取り専用データ（パターン照合のオートマトン・知識ベースの索引）の保存先
+# 同じノードのワーカーは同じファイルをmmapして物理メモリを共有する（空ならワーカーごとにメモリ上に作成）
+ARTIFACT_DIR = os.environ.get('ARTIFACT_DIR', 'models')
+
+# 形態素解析結果のキャッシュ件数（ワーカープロセス単位）
+TOKENIZE_CACHE_SIZE = int(os.environ.get('TOKENIZE_CACHE_SIZE', '4096'))
+
+# 解析結果（キーワード・感情・意図）のキャッシュ件数（ワーカープロセス単位、0で無効）
+ANALYSIS_CACHE_SIZE = int(os.environ.get('ANALYSIS_CACHE_SIZE', '10000'))
+
+# ユーザー別会話プロフィールのキャッシュ設定（ワーカープロセス単位）
+PROFILE_CACHE_MAX_USERS = int(os.environ.get('PROFILE_CACHE_MAX_USERS', '10000'))
+PROFILE_CACHE_TTL = float(os.environ.get('PROFILE_CACHE_TTL', '1800'))
+PROFILE_WINDOW = int(os.environ.get('PROFILE_WINDOW', '20'))
+
+# 会話履歴APIのページサイズ
+HISTORY_PAGE_SIZE = int(os.environ.get('HISTORY_PAGE_SIZE', '10'))
+HISTORY_MAX_PAGE_SIZE = int(os.environ.get('HISTORY_MAX_PAGE_SIZE', '100'))
+
+# 会話ログの書き込み設定（sync: リクエスト内で保存 / async: バックグラウンドで一括保存）
+CONVERSATION_WRITE_MODE = os.environ.get('CONVERSATION_WRITE_MODE', 'sync')
+CONVERSATION_QUEUE_SIZE = int(os.environ.get('CONVERSATION_QUEUE_SIZE', '10000'))
+CONVERSATION_BATCH_SIZE = int(os.environ.get('CONVERSATION_BATCH_SIZE', '200'))
+CONVERSATION_FLUSH_INTERVAL = float(os.environ.get('CONVERSATION_FLUSH_INTERVAL', '0.5'))
+CONVERSATION_WRITE_RETRIES = int(os.environ.get('CONVERSATION_WRITE_RETRIES', '3'))
+
+# 会話履歴の月別パーティション（何か月先まで作っておくか、何か月分を残すか）
+CONVERSATION_PARTITION_MONTHS_AHEAD = int(os.environ.get('CONVERSATION_PARTITION_MONTHS_AHEAD', '3'))
+CONVERSATION_RETENTION_MONTHS = int(os.environ.get('CONVERSATION_RETENTION_MONTHS', '12'))
+# 先の月のパーティションを確認・作成する間隔（秒、ワーカーごと。0で起動時のみ）
+CONVERSATION_PARTITION_CHECK_INTERVAL = float(os.environ.get('CONVERSATION_PARTITION_CHECK_INTERVAL', '3600'))
+
+# 会話のエクスポート（CSV / Parquet）
+EXPORT_CHUNK_ROWS = int(os.environ.get('EXPORT_CHUNK_ROWS', '10000'))  # 1回に読む行数（Parquet の行グループの大きさ）
+EXPORT_FILE_ROWS = int(os.environ.get('EXPORT_FILE_ROWS', '1000000'))  # 1ファイルあたりの行数（コマンドのみ）
+EXPORT_TOKEN = os.environ.get('EXPORT_TOKEN', '')  # /export/conversations に必要なトークン（空ならエンドポイントを無効化）
+
+# 常時接続チャット（WebSocket）の設定
+CHAT_WS_PING_INTERVAL = float(os.environ.get('CHAT_WS_PING_INTERVAL', '25'))
+CHAT_WS_MAX_MESSAGE_SIZE = int(os.environ.get('CHAT_WS_MAX_MESSAGE_SIZE', '16384'))
+
+app.config['SOCK_SERVER_OPTIONS'] = {
+    'ping_interval': CHAT_WS_PING_INTERVAL,
+    'max_message_size': CHAT_WS_MAX_MESSAGE_SIZE
+}
+sock = Sock(app)
+
+
+class PoolTimeoutError(Exception):
+    """プールから時間内に接続を取得できなかった"""
+
+
+class OverloadedError(Exception):
+    """同時実行数の上限と待ち行列が埋まっていて要求を受け付けられない"""
+
+    def __init__(self, name, reason, retry_after):
+        super().__init__(f"{name} が混雑しています（{reason}）")
+        self.name = name
+        self.reason = reason  # queue_full | timeout
+        self.retry_after = retry_after
+
+
+class CatalogValidationError(Exception):
+    """一括読み込みするインテント・知識ベースのファイルに不正な行がある"""
+
+    def __init__(self, errors, count):
+        super().__init__(f"{count} 件の不正な行があります")
+        self.errors = errors  # 先頭 CATALOG_LOAD_MAX_ERRORS 件のメッセージ
+        self.count = count
+
+
+class ConnectionPool:
+    """スレッドセーフなPostgreSQLコネクションプール（ワーカープロセス単位）"""
+
+    def __init__(self, db_params, min_size=1, max_size=10, timeout=5.0, healthcheck_interval=30.0):
+        self.db_params = db_params
+        self.min_size = max(0, min(min_size, max_size))
+        self.max_size = max(1, max_size)
+        self.timeout = timeout
+        self.healthcheck_interval = healthcheck_interval
+        self._cond = threading.Condition()
+        self._reset_state()
+
+    def _reset_state(self):
+        """プロセス固有の状態を初期化"""
+        self._pid = os.getpid()
+        self._idle = deque()  # (conn, 最終返却時刻)
+        self._size = 0  # 作成済み接続数（使用中 + 待機中）
+        self._prefilled = False
+        self._stats = {
+            'acquired': 0,
+            'created': 0,
+            'discarded': 0,
+            'waits': 0,
+            'timeouts': 0,
+            'healthcheck_failures': 0,
+            'total_wait_ms': 0.0,
+            'max_wait_ms': 0.0,
+        }
+
+    def _check_fork(self):
+        """fork後の子プロセスでは親の接続を使わず新しいプールを作る"""
+        if self._pid == os.getpid():
+            return
+        with self._cond:
+            if self._pid == os.getpid():
+                return
+            # 親プロセスの接続はソケットを共有しているため、close()せず参照だけ保持する
+            inherited = getattr(self, '_inherited', [])
+            inherited.extend(conn for conn, _ in self._idle)
+            self._inherited = inherited
+            self._reset_state()
+
+    def _connect(self):
+        conn = psycopg2.connect(**self.db_params)
+        with self._cond:
+            self._stats['created'] += 1
+        return conn
+
+    def _prefill(self):
+        """最小接続数まで事前に接続を作成"""
+        while True:
+            with self._cond:
+                if self._prefilled or self._size >= self.min_size:
+                    self._prefilled = True
+                    return
+                self._size += 1
+            try:
+                conn = self._connect()
+            except Exception:
+                with self._cond:
+                    self._size -= 1
+                    self._cond.notify()
+                raise
+            with self._cond:
+                self._idle.append((conn, time.monotonic()))
+                self._cond.notify()
+
+    def _is_healthy(self, conn, last_used):
+        """チェックアウト時のヘルスチェック"""
+        if conn.closed or conn.status != psycopg2.extensions.STATUS_READY:
+            return False
+        if time.monotonic() - last_used < self.healthcheck_interval:
+            return True
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute("SELECT 1")
+            conn.rollback()
+            return True
+        except Exception:
+            return False
+
+    def _close(self, conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
+        with self._cond:
+            self._size -= 1
+            self._stats['discarded'] += 1
+            self._cond.notify()
+
+    def getconn(self):
+        """接続を取得（上限に達している場合はtimeout秒まで待機）"""
+        self._check_fork()
+        if not self._prefilled:
+            self._prefill()
+
+        start = time.monotonic()
+        deadline = start + self.timeout
+        waited = False
+        while True:
+            conn = None
+            last_used = None
+            with self._cond:
+                while True:
+                    if self._idle:
+                        conn, last_used = self._idle.pop()
+                        break
+                    if self._size < self.max_size:
+                        self._size += 1
+                        break
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._stats['timeouts'] += 1
+                        raise PoolTimeoutError(
+                            f"{self.timeout}秒以内にDB接続を取得できませんでした（max_size={self.max_size}）"
+                        )
+                    if not waited:
+                        waited = True
+                        self._stats['waits'] += 1
+                    self._cond.wait(remaining)
+
+            if conn is None:
+                try:
+                    conn = self._connect()
+                except Exception:
+                    with self._cond:
+                        self._size -= 1
+                        self._cond.notify()
+                    raise
+            elif not self._is_healthy(conn, last_used):
+                with self._cond:
+                    self._stats['healthcheck_failures'] += 1
+                self._close(conn)
+                continue
+
+            wait_ms = (time.monotonic() - start) * 1000
+            with self._cond:
+                self._stats['acquired'] += 1
+                self._stats['total_wait_ms'] += wait_ms
+                self._stats['max_wait_ms'] = max(self._stats['max_wait_ms'], wait_ms)
+            return conn
+
+    def putconn(self, conn, discard=False):
+        """接続をプールに返却（壊れた接続は破棄）"""
+        if self._pid != os.getpid():
+            return
+        if not discard and not conn.closed:
+            try:
+                if conn.status != psycopg2.extensions.STATUS_READY:
+                    conn.rollback()
+            except Exception:
+                discard = True
+        if discard or conn.closed:
+            self._close(conn)
+            return
+        with self._cond:
+            self._idle.append((conn, time.monotonic()))
+            self._cond.notify()
+
+    @contextmanager
+    def connection(self, autocommit=False):
+        """with文で接続を借りてトランザクションを実行し、終了後に返却
+
+        autocommit=True では BEGIN/COMMIT を送らず文ごとに確定する（1文で済む書き込みを1往復にする）
+        """
+        conn = self.getconn()
+        try:
+            if autocommit:
+                conn.autocommit = True
+                try:
+                    yield conn
+                finally:
+                    conn.autocommit = False
+            else:
+                with conn:
+                    yield conn
+        finally:
+            self.putconn(conn)
+
+    def closeall(self):
+        """待機中の接続をすべて閉じる"""
+        if self._pid != os.getpid():
+            return
+        with self._cond:
+            idle = list(self._idle)
+            self._idle.clear()
+        for conn, _ in idle:
+            self._close(conn)
+
+    def get_stats(self):
+        """プールの統計情報"""
+        with self._cond:
+            stats = dict(self._stats)
+            stats.update({
+                'pid': self._pid,
+                'min_size': self.min_size,
+                'max_size': self.max_size,
+                'size': self._size,
+                'idle': len(self._idle),
+                'in_use': self._size - len(self._idle),
+            })
+        acquired = stats['acquired']
+        stats['avg_wait_ms'] = round(stats.pop('total_wait_ms') / acquired, 3) if acquired else 0.0
+        stats['max_wait_ms'] = round(stats['max_wait_ms'], 3)
+        return stats
+
+
+class ReadRouter:
+    """読み取り専用の処理をレプリカへ振り分ける（ワーカープロセス単位）
+
+    レプリカを順番に使い、接続できないレプリカは retry_interval 秒のあいだ外す。
+    レプリカが使えない・必要な変更がまだ反映されていない・実行中に接続が切れた場合は
+    プライマリで実行し直す。レプリカがなければ常にプライマリで実行する。
+    """
+
+    def __init__(self, primary, replicas=(), retry_interval=30.0):
+        self.primary = primary
+        self.replicas = list(replicas)  # ConnectionPool のリスト
+        self.retry_interval = retry_interval
+        self._lock = threading.Lock()
+        self._down_until = {}
+        self._next = 0
+        self._stats = {
+            'primary_reads': 0,
+            'replica_reads': 0,
+            'fallback_unavailable': 0,
+            'fallback_lagging': 0,
+            'fallback_error': 0,
+        }
+
+    def _count(self, name):
+        with self._lock:
+            self._stats[name] += 1
+
+    def _candidates(self):
+        """使えるレプリカを順番をずらして返す"""
+        now = time.monotonic()
+        with self._lock:
+            start = self._next
+            self._next += 1
+            replicas = [
+                pool for pool in self.replicas
+                if self._down_until.get(id(pool), 0.0) <= now
+            ]
+        if not replicas:
+            return []
+        start %= len(replicas)
+        return replicas[start:] + replicas[:start]
+
+    def _mark_down(self, pool, error):
+        with self._lock:
+            self._down_until[id(pool)] = time.monotonic() + self.retry_interval
+        logger.warning("レプリカ %s を %.0f 秒間使いません: %s", _describe_db(pool.db_params), self.retry_interval, error)
+
+    @staticmethod
+    def _is_behind(conn, min_lsn, user_id, min_turn_id):
+        """min_lsn までのWAL、または user_id の会話 min_turn_id がまだ反映されていなければTrue"""
+        with conn.cursor() as cursor:
+            if min_lsn:
+                cursor.execute(
+                    "SELECT NOT pg_is_in_recovery() OR pg_last_wal_replay_lsn() >= %s::pg_lsn", (min_lsn,)
+                )
+                if not cursor.fetchone()[0]:
+                    return True
+            if min_turn_id:
+                cursor.execute("""
+                    SELECT id
+                    FROM conversations
+                    WHERE user_id = %s
+                    ORDER BY timestamp DESC, id DESC
+                    LIMIT 1
+                """, (user_id,))
+                row = cursor.fetchone()
+                if row is None or row[0] < min_turn_id:
+                    return True
+        return False
+
+    def read(self, query, min_lsn=None, user_id=None, min_turn_id=None):
+        """query(conn) をレプリカで実行して結果を返す（使えなければプライマリで実行）
+
+        min_lsn: このWAL位置まで再生済みのレプリカだけを使う（カタログの変更通知後など）
+        user_id / min_turn_id: そのユーザーの会話 min_turn_id が見えるレプリカだけを使う
+        """
+        for pool in self._candidates():
+            conn = None
+            try:
+                conn = pool.getconn()
+                with conn:
+                    behind = self._is_behind(conn, min_lsn, user_id, min_turn_id)
+                    if not behind:
+                        result = query(conn)
+            except (PoolTimeoutError, psycopg2.Error) as e:
+                if conn is None or conn.closed:
+                    self._count('fallback_unavailable')
+                    self._mark_down(pool, e)
+                else:
+                    # 復旧との競合によるキャンセルなど。レプリカは外さずにプライマリで読み直す
+                    self._count('fallback_error')
+                    logger.warning("レプリカでの読み取りに失敗しました: %s", e)
+                continue
+            finally:
+                if conn is not None:
+                    pool.putconn(conn)
+            if behind:
+                self._count('fallback_lagging')
+                continue
+            self._count('replica_reads')
+            return result
+        self._count('primary_reads')
+        with self.primary.connection() as conn:
+            return query(conn)
+
+    @contextmanager
+    def connection(self):
+        """長時間の読み取り（エクスポートなど）用に接続を1つ借りる（使えるレプリカ、なければプライマリ）
+
+        read() と違い、途中で失敗してもプライマリで読み直さない。
+        """
+        for pool in self._candidates():
+            try:
+                conn = pool.getconn()
+            except (PoolTimeoutError, psycopg2.Error) as e:
+                self._count('fallback_unavailable')
+                self._mark_down(pool, e)
+                continue
+            self._count('replica_reads')
+            try:
+                with conn:
+                    yield conn
+            finally:
+                pool.putconn(conn)
+            return
+        self._count('primary_reads')
+        with self.primary.connection() as conn:
+            yield conn
+
+    def get_stats(self):
+        """振り分けの統計情報（レプリカごとのプールの状態を含む）"""
+        now = time.monotonic()
+        with self._lock:
+            stats = dict(self._stats)
+            down_until = dict(self._down_until)
+        stats['replicas'] = [
+            dict(
+                pool.get_stats(),
+                target=_describe_db(pool.db_params),
+                available=down_until.get(id(pool), 0.0) <= now
+            )
+            for pool in self.replicas
+        ]
+        return stats
+
+
+def _describe_db(db_params):
+    """ログ・統計用の接続先の表記（パスワードを含めない）"""
+    return f"{db_params.get('host', '')}:{db_params.get('port', 5432)}/{db_params.get('dbname') or db_params.get('database', '')}"
+
+
+class AdmissionLimiter:
+    """同時実行数の上限と上限付きの待ち行列による流入制御（ワーカープロセス単位）
+
+    実行中が max_concurrency 件に達していれば max_queue 件まで順番待ちさせ、
+    待ち行列が埋まっているか queue_timeout 秒待っても空かなければ OverloadedError で
+    すぐに断る。DBが遅いときに要求を溜め込んで全員がタイムアウトするのを防ぐ。
+    """
+
+    def __init__(self, name, max_concurrency, max_queue, queue_timeout=1.0, retry_after=1):
+        self.name = name
+        self.max_concurrency = max(0, max_concurrency)  # 0なら制限しない
+        self.max_queue = max(0, max_queue)
+        self.queue_timeout = queue_timeout
+        self.retry_after = retry_after
+        self._cond = threading.Condition()
+        self._active = 0
+        self._queued = 0
+        self._stats = {
+            'admitted': 0,
+            'waits': 0,
+            'shed_queue_full': 0,
+            'shed_timeout': 0,
+            'peak_queue_depth': 0,
+            'total_wait_ms': 0.0,
+            'max_wait_ms': 0.0,
+        }
+
+    def acquire(self):
+        """実行枠を取得（空きがなければ待ち行列に並び、受け付けられなければ OverloadedError）"""
+        if not self.max_concurrency:
+            return
+        start = time.monotonic()
+        with self._cond:
+            # 順番待ちがいる間は後から来た要求に追い越させない
+            if self._active < self.max_concurrency and not self._queued:
+                self._active += 1
+                self._stats['admitted'] += 1
+                return
+            if self._queued >= self.max_queue:
+                self._stats['shed_queue_full'] += 1
+                raise OverloadedError(self.name, 'queue_full', self.retry_after)
+            self._queued += 1
+            self._stats['waits'] += 1
+            self._stats['peak_queue_depth'] = max(self._stats['peak_queue_depth'], self._queued)
+            deadline = start + self.queue_timeout
+            try:
+                while self._active >= self.max_concurrency:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._stats['shed_timeout'] += 1
+                        # 受け取った通知を他の待ち手に回す
+                        self._cond.notify()
+                        raise OverloadedError(self.name, 'timeout', self.retry_after)
+                    self._cond.wait(remaining)
+                self._active += 1
+                self._stats['admitted'] += 1
+            finally:
+                self._queued -= 1
+                wait_ms = (time.monotonic() - start) * 1000
+                self._stats['total_wait_ms'] += wait_ms
+                self._stats['max_wait_ms'] = max(self._stats['max_wait_ms'], wait_ms)
+
+    def release(self):
+        """実行枠を返却して待ち行列の先頭を起こす"""
+        if not self.max_concurrency:
+            return
+        with self._cond:
+            self._active -= 1
+            self._cond.notify()
+
+    @contextmanager
+    def slot(self):
+        """with文で実行枠を借りる"""
+        self.acquire()
+        try:
+            yield
+        finally:
+            self.release()
+
+    def get_stats(self):
+        """流入制御の統計情報"""
+        with self._cond:
+            stats = dict(self._stats)
+            stats.update({
+                'max_concurrency': self.max_concurrency,
+                'max_queue': self.max_queue,
+                'active': self._active,
+                'queue_depth': self._queued,
+            })
+        waits = stats['waits'] - stats['queue_depth']  # 待ち終えた件数
+        total_wait_ms = stats.pop('total_wait_ms')
+        stats['shed'] = stats['shed_queue_full'] + stats['shed_timeout']
+        stats['avg_wait_ms'] = round(total_wait_ms / waits, 3) if waits else 0.0
+        stats['max_wait_ms'] = round(stats['max_wait_ms'], 3)
+        return stats
+
+_ARTIFACT_MAGIC = b'CHATBOT-ARTIFACT\x01'
+
+
+def _write_artifact(path, arrays):
+    """名前付きの配列（array.array）を1ファイルに書き出す（一時ファイルに書いてから置き換え）
+
+    先頭にマジックと各配列の (型, 位置, 要素数) を記したJSONヘッダーを置き、
+    配列本体は8バイト境界に揃えてそのまま並べる。
+    """
+    header, offset = {}, 0
+    for name, values in arrays.items():
+        offset += -offset % 8
+        header[name] = [values.typecode, offset, len(values)]
+        offset += len(values) * values.itemsize
+    header_bytes = json.dumps(header).encode('utf-8')
+    prefix = _ARTIFACT_MAGIC + struct.pack('<I', len(header_bytes)) + header_bytes
+    prefix += b'\0' * (-len(prefix) % 8)
+
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(prefix)
+        position = 0
+        for name, values in arrays.items():
+            f.write(b'\0' * (header[name][1] - position))
+            f.write(values.tobytes())
+            position = header[name][1] + len(values) * values.itemsize
+    os.replace(tmp_path, path)
+
+
+def _map_artifact(path):
+    """_write_artifact で書いたファイルをmmapし、配列ごとのmemoryviewを返す"""
+    with open(path, 'rb') as f:
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    view = memoryview(mapped)
+    magic_end = len(_ARTIFACT_MAGIC)
+    if bytes(view[:magic_end]) != _ARTIFACT_MAGIC:
+        raise ValueError(f"形式が異なります: {path}")
+    (header_size,) = struct.unpack('<I', view[magic_end:magic_end + 4])
+    header_end = magic_end + 4 + header_size
+    base = header_end + (-header_end % 8)
+    header = json.loads(bytes(view[magic_end + 4:header_end]))
+    return {
+        name: view[base + offset:base + offset + count * array.array(typecode).itemsize].cast(typecode)
+        for name, (typecode, offset, count) in header.items()
+    }
+
+
+@contextmanager
+def _file_lock(path):
+    """ワーカー間の排他ロック（同じデータを複数のワーカーが同時に作らないようにする）"""
+    with open(path, 'a') as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def load_artifact(kind, fingerprint, build):
+    """コンパイル済みデータを ARTIFACT_DIR のファイルからmmapで読み込む（無ければ build() で作成して保存）
+
+    内容のフィンガープリントをファイル名に含めるため、同じカタログなら全ワーカーが
+    同じファイルを参照し、物理メモリ上は1つのコピーを共有する。保存できない環境では
+    build() の結果（array.array）をそのまま使う。
+    """
+    if not ARTIFACT_DIR:
+        return build()
+    path = os.path.join(ARTIFACT_DIR, f"{kind}-{fingerprint[:16]}.bin")
+    try:
+        os.makedirs(ARTIFACT_DIR, exist_ok=True)
+        with _file_lock(os.path.join(ARTIFACT_DIR, f"{kind}.lock")):
+            if not os.path.exists(path):
+                _write_artifact(path, build())
+                # 古い版を削除（mmap済みのワーカーは削除後も読み続けられる）
+                for name in os.listdir(ARTIFACT_DIR):
+                    if name.startswith(f"{kind}-") and name.endswith('.bin') and name != os.path.basename(path):
+                        os.unlink(os.path.join(ARTIFACT_DIR, name))
+            return _map_artifact(path)
+    except (OSError, ValueError) as e:
+        logger.warning("共有データ %s を使えないためメモリ上に作成します: %s", kind, e)
+        return build()
+
+
+# ハッシュ表の位置を決める乗数（フィボナッチハッシュ。連続したキーも表全体に散らばる）
+_HASH_MULTIPLIER = 0x9E3779B97F4A7C15
+
+
+def _build_hash_table(items):
+    """(整数キー, 値) からオープンアドレス法のハッシュ表（キー配列と値配列、大きさは2の冪）を作る"""
+    size = 2
+    while size < 2 * len(items):
+        size *= 2
+    mask = size - 1
+    keys = array.array('q', [-1]) * size
+    values = array.array('i', [0]) * size
+    for key, value in items:
+        i = (key * _HASH_MULTIPLIER >> 32) & mask
+        while keys[i] != -1:
+            i = (i + 1) & mask
+        keys[i] = key
+        values[i] = value
+    return keys, values
+
+
+def _hash_lookup(keys, values, key, default):
+    """_build_hash_table の表からキーを引く（無ければ default）"""
+    mask = len(keys) - 1
+    i = (key * _HASH_MULTIPLIER >> 32) & mask
+    while True:
+        found = keys[i]
+        if found == key:
+            return values[i]
+        if found == -1:
+            return default
+        i = (i + 1) & mask
+
+
+def _fingerprint(value):
+    return hashlib.sha256(json.dumps(value, ensure_ascii=False).encode('utf-8')).hexdigest()
+
+
+class KnowledgeIndex:
+    """知識ベースのキーワードに対する文字n-gram転置インデックス
+    
+    ILIKE '%keyword%' ORDER BY confidence DESC と同じ優先順位で、
+    部分一致する行をメモリ上で検索する。転置リストは整数配列にまとめて
+    load_artifact で全ワーカーと共有する。
+    """
+
+    def __init__(self, rows):
+        # rowsはconfidence降順（同順位はid順）に並んでいる前提。位置がそのまま優先順位になる
+        self.rows = rows
+        keys = [row['keyword'].lower() for row in rows]
+        arrays = load_artifact('knowledge', _fingerprint(keys), lambda: self._compile(keys))
+        self._gram_keys = arrays['gram_keys']
+        self._gram_index = arrays['gram_index']
+        self._starts = arrays['starts']
+        self._postings = arrays['postings']
+
+    @staticmethod
+    def _grams(text):
+        """1文字と2文字のn-gram（重複あり）"""
+        for i, ch in enumerate(text):
+            yield ch
+            if i + 1 < len(text):
+                yield text[i:i + 2]
+
+    @staticmethod
+    def _gram_key(gram):
+        """n-gramを整数キーに変換（2文字は1文字のコード範囲と重ならない）"""
+        if len(gram) == 1:
+            return ord(gram)
+        return ((ord(gram[0]) + 1) << 21) | ord(gram[1])
+
+    @classmethod
+    def _compile(cls, keys):
+        postings = {}
+        for rank, key in enumerate(keys):
+            for gram in cls._grams(key):
+                ranks = postings.setdefault(cls._gram_key(gram), [])
+                if not ranks or ranks[-1] != rank:
+                    ranks.append(rank)
+        starts = array.array('i', [0])
+        flat = array.array('i')
+        for ranks in postings.values():
+            flat.extend(ranks)
+            starts.append(len(flat))
+        gram_keys, gram_index = _build_hash_table([(key, i) for i, key in enumerate(postings)])
+        return {'gram_keys': gram_keys, 'gram_index': gram_index, 'starts': starts, 'postings': flat}
+
+    def best_match(self, keyword):
+        """キーワードを部分一致で含む行のうち最も優先度の高いものを返す"""
+        keyword = keyword.lower()
+        if not keyword:
+            return self.rows[0] if self.rows else None
+        grams = [keyword] if len(keyword) == 1 else [keyword[i:i + 2] for i in range(len(keyword) - 1)]
+        candidates = None
+        for gram in grams:
+            index = _hash_lookup(self._gram_keys, self._gram_index, self._gram_key(gram), -1)
+            if index < 0:
+                return None
+            postings = self._postings[self._starts[index]:self._starts[index + 1]]
+            if candidates is None or len(postings) < len(candidates):
+                candidates = postings
+        # 最も短い転置リストを優先順位順に走査し、実際に部分一致するか確認
+        for rank in candidates:
+            if keyword in self.rows[rank]['keyword'].lower():
+                return self.rows[rank]
+        return None
+
+    def lookup(self, keywords):
+        """キーワードを順に検索し、最初に見つかった行を返す"""
+        for keyword in keywords:
+            row = self.best_match(keyword)
+            if row is not None:
+                return row
+        return None
+
+
+class CatalogSnapshot:
+    """intents / knowledge_base の読み取り専用スナップショット"""
+
+    def __init__(self, version, intents, knowledge):
+        self.version = version
+        self.intents = intents
+        self.knowledge = knowledge  # confidence降順
+        self.knowledge_index = KnowledgeIndex(knowledge)
+        self.responses = {}
+        for row in intents:
+            self.responses.setdefault(row['intent_name'], row['responses'])
+
+
+def _run_off_hub(func, *args):
+    """CPU負荷の高い処理を実行（geventワーカーではネイティブスレッドで動かし、他のリクエストを止めない）"""
+    if 'gevent.monkey' in sys.modules:
+        from gevent import get_hub, monkey
+        if monkey.is_module_patched('threading'):
+            return get_hub().threadpool.apply(func, args)
+    return func(*args)
+
+
+class IntentCatalog:
+    """intents / knowledge_base のワーカー内キャッシュ（LISTEN/NOTIFYで更新、TTLで保険）"""
+
+    def __init__(self, router, db_params, ttl=300.0, listen=True):
+        self.router = router
+        self.db_params = db_params
+        self.ttl = ttl
+        self.listen = listen
+        self._lock = threading.Lock()
+        self._reload_lock = threading.Lock()
+        self._callbacks = []
+        self._snapshot = None
+        self._loaded_at = 0.0
+        self._dirty = False
+        self._refreshing = False
+        self._version = 0
+        self._listener_pid = None
+        self._listening = False
+        self._min_lsn = None  # 変更通知を受けた時点のプライマリのWAL位置（レプリカから読むときの条件）
+        self._stats = {'reloads': 0, 'reload_errors': 0, 'notifications': 0, 'listener_errors': 0}
+
+    def add_listener(self, callback):
+        """カタログ更新時に新しいスナップショットを受け取るコールバックを登録"""
+        self._callbacks.append(callback)
+
+    def get(self):
+        """最新のスナップショットを取得（DBへの問い合わせは更新時のみ）"""
+        self._ensure_listener()
+        snapshot = self._snapshot
+        if snapshot is None:
+            self.reload()
+            return self._snapshot or CatalogSnapshot(0, [], [])
+        if self._dirty or time.monotonic() - self._loaded_at >= self.ttl:
+            # 再読み込みはバックグラウンドで行い、完了までは古いスナップショットをそのまま使う
+            self._refresh_in_background()
+        return snapshot
+
+    def _refresh_in_background(self):
+        with self._lock:
+            if self._refreshing:
+                return
+            self._refreshing = True
+
+        def run():
+            try:
+                self.reload(blocking=False)
+            finally:
+                self._refreshing = False
+
+        threading.Thread(target=run, name='catalog-refresh', daemon=True).start()
+
+    def invalidate(self):
+        """次回アクセス時に再読み込みさせる"""
+        self._dirty = True
+
+    def reload(self, blocking=True):
+        """DBからカタログを読み込み、スナップショットを差し替える"""
+        if not self._reload_lock.acquire(blocking=blocking):
+            return False
+        try:
+            self._dirty = False
+            try:
+                intents, knowledge = self.router.read(self._load, min_lsn=self._min_lsn)
+            except Exception as e:
+                self._dirty = True
+                self._stats['reload_errors'] += 1
+                # 失敗時は古いスナップショットを使い続け、数秒後に再試行
+                self._loaded_at = time.monotonic() - self.ttl + min(self.ttl, 5.0)
+                logger.error("カタログ読み込みエラー: %s", e)
+                return False
+
+            self._version += 1
+            # 索引・マッチャーを作り終えてから公開し、リクエスト側に構築コストを払わせない
+            snapshot = _run_off_hub(self._build_snapshot, self._version, intents, knowledge)
+            self._snapshot = snapshot
+            self._loaded_at = time.monotonic()
+            self._stats['reloads'] += 1
+            return True
+        finally:
+            self._reload_lock.release()
+
+    @staticmethod
+    def _load(conn):
+        cursor = conn.cursor(cursor_factory=RealDictCursor)
+        cursor.execute("SELECT intent_name, patterns, responses FROM intents ORDER BY id")
+        intents = [dict(row) for row in cursor.fetchall()]
+        cursor.execute("""
+            SELECT id, keyword, response, confidence, category
+            FROM knowledge_base
+            ORDER BY confidence DESC, id
+        """)
+        knowledge = [dict(row) for row in cursor.fetchall()]
+        return intents, knowledge
+
+    def _build_snapshot(self, version, intents, knowledge):
+        snapshot = CatalogSnapshot(version, intents, knowledge)
+        for callback in self._callbacks:
+            try:
+                callback(snapshot)
+            except Exception as e:
+                logger.exception("カタログ更新コールバックエラー: %s", e)
+        return snapshot
+
+    def _ensure_listener(self):
+        """ワーカープロセスごとに変更通知の受信スレッドを起動"""
+        if not self.listen or self._listener_pid == os.getpid():
+            return
+        with self._lock:
+            if self._listener_pid == os.getpid():
+                return
+            self._listener_pid = os.getpid()
+            thread = threading.Thread(target=self._listen_loop, name='catalog-listener', daemon=True)
+            thread.start()
+
+    def _listen_loop(self):
+        """LISTEN専用の接続で変更通知を待ち受ける（切断時は再接続）"""
+        backoff = 1.0
+        while True:
+            conn = None
+            try:
+                conn = psycopg2.connect(**self.db_params)
+                conn.autocommit = True
+                with conn.cursor() as cursor:
+                    cursor.execute(f"LISTEN {CATALOG_CHANNEL}")
+                self._listening = True
+                backoff = 1.0
+                # 接続していない間の変更を取りこぼさないよう読み直す
+                if self._snapshot is not None:
+                    self.reload()
+                while True:
+                    if not select.select([conn], [], [], 60.0)[0]:
+                        continue
+                    conn.poll()
+                    if conn.notifies:
+                        self._stats['notifications'] += len(conn.notifies)
+                        conn.notifies.clear()
+                        if self.router.replicas:
+                            # NOTIFY はレプリカに届かないため、変更が反映済みのレプリカからだけ読む
+                            with conn.cursor() as cursor:
+                                cursor.execute("SELECT pg_current_wal_lsn()")
+                                self._min_lsn = cursor.fetchone()[0]
+                        self._dirty = True
+                        self.reload()
+            except Exception as e:
+                self._stats['listener_errors'] += 1
+                logger.warning("カタログ変更通知の受信エラー: %s", e)
+            finally:
+                self._listening = False
+                if conn is not None:
+                    try:
+                        conn.close()
+                    except Exception:
+                        pass
+            time.sleep(backoff)
+            backoff = min(backoff * 2, 60.0)
+
+    def get_stats(self):
+        """カタログの統計情報"""
+        snapshot = self._snapshot
+        stats = dict(self._stats)
+        stats.update({
+            'version': snapshot.version if snapshot else 0,
+            'intents': len(snapshot.intents) if snapshot else 0,
+            'knowledge': len(snapshot.knowledge) if snapshot else 0,
+            'age_seconds': round(time.monotonic() - self._loaded_at, 1) if snapshot else None,
+            'ttl': self.ttl,
+            'listening': self._listening,
+        })
+        return stats
+
+
+class PatternAutomaton:
+    """Aho-Corasick法による複数パターンの一括検索
+
+    状態遷移は (状態 << 21 | 文字コード) をキーにしたハッシュ表として整数配列に持ち、
+    artifact を指定すると load_artifact で全ワーカーと共有する。
+    失敗遷移のたびに引く根からの遷移だけは辞書で持つ。
+    """
+
+    def __init__(self, needles, artifact=None):
+        # needles: パターン文字列のリスト（インデックスがパターンID）
+        self._always = frozenset(i for i, needle in enumerate(needles) if not needle)
+        if artifact:
+            arrays = load_artifact(artifact, _fingerprint(needles), lambda: self._compile(needles))
+        else:
+            arrays = self._compile(needles)
+        self._root = {chr(ch): nxt for ch, nxt in zip(arrays['root_chars'], arrays['root_next'])}
+        self._edge_keys = arrays['edge_keys']
+        self._edge_next = arrays['edge_next']
+        self._fail = arrays['fail']
+        self._out_starts = arrays['out_starts']
+        self._out_ids = arrays['out_ids']
+
+    @staticmethod
+    def _compile(needles):
+        goto = [{}]
+        fail = [0]
+        out = [()]
+        for needle_id, needle in enumerate(needles):
+            if not needle:
+                continue
+            node = 0
+            for ch in needle:
+                nxt = goto[node].get(ch)
+                if nxt is None:
+                    nxt = len(goto)
+                    goto[node][ch] = nxt
+                    goto.append({})
+                    fail.append(0)
+                    out.append(())
+                node = nxt
+            out[node] = out[node] + (needle_id,)
+
+        # 幅優先で失敗遷移を構築し、出力を失敗先から継承
+        queue = deque(goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for ch, nxt in goto[node].items():
+                queue.append(nxt)
+                target = fail[node]
+                while target and ch not in goto[target]:
+                    target = fail[target]
+                target = goto[target].get(ch, 0)
+                fail[nxt] = target if target != nxt else 0
+                out[nxt] = out[nxt] + out[fail[nxt]]
+
+        out_starts = array.array('i', [0])
+        out_ids = array.array('i')
+        for ids in out:
+            out_ids.extend(ids)
+            out_starts.append(len(out_ids))
+        edge_keys, edge_next = _build_hash_table([
+            ((node << 21) | ord(ch), nxt)
+            for node in range(1, len(goto))
+            for ch, nxt in goto[node].items()
+        ])
+        return {
+            'root_chars': array.array('i', [ord(ch) for ch in goto[0]]),
+            'root_next': array.array('i', goto[0].values()),
+            'edge_keys': edge_keys,
+            'edge_next': edge_next,
+            'fail': array.array('i', fail),
+            'out_starts': out_starts,
+            'out_ids': out_ids,
+        }
+
+    def find_all(self, text):
+        """テキストに含まれるパターンIDの集合を返す（1回の走査）"""
+        root = self._root
+        edge_keys = self._edge_keys
+        edge_next = self._edge_next
+        fail = self._fail
+        out_starts = self._out_starts
+        out_ids = self._out_ids
+        mask = len(edge_keys) - 1
+        found = set(self._always)
+        node = 0
+        for ch in text:
+            if node:
+                # _hash_lookup と同じ探索（文字ごとに呼ぶため関数呼び出しを省いて展開）
+                code = ord(ch)
+                while True:
+                    key = (node << 21) | code
+                    i = (key * _HASH_MULTIPLIER >> 32) & mask
+                    stored = edge_keys[i]
+                    while stored != key and stored != -1:
+                        i = (i + 1) & mask
+                        stored = edge_keys[i]
+                    if stored == key:
+                        node = edge_next[i]
+                        break
+                    node = fail[node]
+                    if not node:
+                        node = root.get(ch, 0)
+                        break
+            else:
+                node = root.get(ch, 0)
+            if node:
+                start, end = out_starts[node], out_starts[node + 1]
+                if start != end:
+                    found.update(out_ids[start:end])
+        return found
+
+
+class MessageMatcher:
+    """インテント・感情・質問パターンを1回の走査で判定するコンパイル済みマッチャー"""
+
+    def __init__(self, intents_data, positive_words, negative_words, specific_patterns, question_indicators):
+        self.source = intents_data
+        needle_ids = {}
+
+        def needle_id(needle):
+            return needle_ids.setdefault(needle, len(needle_ids))
+
+        self.intent_names = []
+        self._weights = {}  # パターンID -> [(インテント番号, 加点)]
+        self._specific = {}  # パターンID -> [インテント番号]
+        for index, intent_data in enumerate(intents_data or []):
+            intent_name = intent_data['intent_name']
+            patterns = intent_data['patterns']
+            self.intent_names.append(intent_name)
+
+            # 完全一致 +10
+            for pattern in patterns:
+                self._weights.setdefault(needle_id(pattern.lower()), []).append((index, 10))
+            # 部分一致 +2
+            for pattern in patterns:
+                for word in pattern.lower().split():
+                    self._weights.setdefault(needle_id(word), []).append((index, 2))
+            # 特定パターン +15（いずれか1つ以上）
+            for pattern in specific_patterns.get(intent_name, ()):
+                self._specific.setdefault(needle_id(pattern), []).append(index)
+
+        self._positive = {}
+        for word in positive_words:
+            key = needle_id(word)
+            self._positive[key] = self._positive.get(key, 0) + 1
+        self._negative = {}
+        for word in negative_words:
+            key = needle_id(word)
+            self._negative[key] = self._negative.get(key, 0) + 1
+
+        self._questions = [
+            (intent_name, frozenset(needle_id(indicator) for indicator in indicators))
+            for intent_name, indicators in question_indicators
+        ]
+
+        needles = [None] * len(needle_ids)
+        for needle, key in needle_ids.items():
+            needles[key] = needle
+        # 感情辞書だけの小さなマッチャーはワーカーごとに持ち、インテントを含むものだけ共有する
+        self.automaton = PatternAutomaton(needles, artifact='matcher' if intents_data else None)
+
+    def scan(self, text_lower):
+        """小文字化済みテキストを走査してヒットしたパターンIDを返す"""
+        return self.automaton.find_all(text_lower)
+
+    def sentiment(self, found):
+        """ヒット結果から感情を判定"""
+        positive_score = sum(count for key, count in self._positive.items() if key in found)
+        negative_score = sum(count for key, count in self._negative.items() if key in found)
+
+        if positive_score > negative_score:
+            return 'positive'
+        elif negative_score > positive_score:
+            return 'negative'
+        else:
+            return 'neutral'
+
+    def intent(self, found):
+        """ヒット結果からインテントを判定"""
+        if not self.intent_names:
+            return 'unknown'
+
+        scores = [0] * len(self.intent_names)
+        specific_hits = set()
+        for key in found:
+            for index, weight in self._weights.get(key, ()):
+                scores[index] += weight
+            specific_hits.update(self._specific.get(key, ()))
+        for index in specific_hits:
+            scores[index] += 15
+
+        best_intent = 'unknown'
+        highest_score = 0
+        for index, score in enumerate(scores):
+            if score > highest_score:
+                highest_score = score
+                best_intent = self.intent_names[index]
+
+        # 明確な質問パターンを優先
+        for intent_name, keys in self._questions:
+            if not keys.isdisjoint(found):
+                return intent_name
+
+        return best_intent if highest_score > 0 else 'unknown'
+
+
+class SentimentLexicon:
+    """重み付き感情辞書をトークンIDの索引にコンパイルし、複数メッセージのスコアをNumPyでまとめて計算する
+
+    見出し語はそのままの形と、形態素解析した基本形（複数の語になる場合は先頭の語）で登録する。
+    評価語の重みを合計し、強調語は直後 INTENSIFIER_WINDOW 語以内の評価語に倍率を掛け、
+    否定語は直前 negation_window 語以内の評価語の符号を反転する（二重否定は元に戻る）。
+    1件あたりの計算量はトークン数に比例し、辞書の大きさには依存しない。
+    """
+
+    INTENSIFIER_WINDOW = 2
+    KINDS = ('polarity', 'intensifier', 'negator')
+    LABELS = ('negative', 'neutral', 'positive')
+    # スコアがこれ以下なら中立（浮動小数点の誤差で判定が揺れないようにする）
+    NEUTRAL_EPSILON = 1e-9
+
+    def __init__(self, weights, intensifiers, negators, lemmatize, negation_window=SENTIMENT_NEGATION_WINDOW):
+        import numpy as np
+
+        self.index = {}  # 基本形 -> トークンID（0は辞書にない語）
+        polarity = [0.0]
+        multiplier = [1.0]
+        negator = [False]
+
+        def lemma_id(lemma):
+            key = self.index.get(lemma)
+            if key is None:
+                key = self.index[lemma] = len(polarity)
+                polarity.append(0.0)
+                multiplier.append(1.0)
+                negator.append(False)
+            return key
+
+        def term_ids(term):
+            # 単独では別の語に解析される見出し語（「嫌い」→「嫌う」）もあるため、そのままの形でも登録する
+            lemmas = lemmatize(term)
+            keys = {term.lower()} | ({lemmas[0]} if lemmas else set())
+            return [lemma_id(key) for key in sorted(keys)]
+
+        for term, weight in weights.items():
+            for key in term_ids(term):
+                polarity[key] = float(weight)
+        for term, factor in intensifiers.items():
+            for key in term_ids(term):
+                multiplier[key] = float(factor)
+        # 否定語は助動詞の基本形（「ない」「ぬ」「ん」）で指定するため形態素解析しない
+        for term in negators:
+            negator[lemma_id(term)] = True
+
+        self.polarity = np.array(polarity, dtype=np.float64)
+        self.multiplier = np.array(multiplier, dtype=np.float64)
+        self.negator = np.array(negator, dtype=bool)
+        self.negation_window = max(0, negation_window)
+
+    @classmethod
+    def read_file(cls, path):
+        """TSVの感情辞書を読み込んで (weights, intensifiers, negators) を返す
+
+        1行に「見出し語<TAB>重み[<TAB>種別]」。種別は polarity（省略時。正で肯定・負で否定）、
+        intensifier（重みは倍率）、negator（重みは無視）。空行と # で始まる行は読み飛ばす。
+        """
+        weights, intensifiers, negators = {}, {}, []
+        with open(path, encoding='utf-8') as f:
+            for line_number, line in enumerate(f, 1):
+                line = line.rstrip('\r\n')
+                if not line.strip() or line.startswith('#'):
+                    continue
+                fields = [field.strip() for field in line.split('\t')]
+                term = fields[0]
+                kind = fields[2] if len(fields) > 2 and fields[2] else 'polarity'
+                try:
+                    if not term or kind not in cls.KINDS:
+                        raise ValueError
+                    weight = float(fields[1]) if kind != 'negator' else 0.0
+                except (IndexError, ValueError):
+                    raise ValueError(f"{path}:{line_number}: 不正な行です: {line!r}") from None
+                if kind == 'polarity':
+                    weights[term] = weight
+                elif kind == 'intensifier':
+                    intensifiers[term] = weight
+                else:
+                    negators.append(term)
+        return weights, intensifiers, negators
+
+    def encode(self, token_lists):
+        """基本形の列のリストを、連結したトークンIDの配列と各トークンのメッセージ番号の配列に変換"""
+        import numpy as np
+
+        lookup = self.index.get
+        lengths = np.fromiter(map(len, token_lists), dtype=np.int64, count=len(token_lists))
+        ids = np.fromiter(
+            (lookup(token, 0) for tokens in token_lists for token in tokens),
+            dtype=np.int64, count=int(lengths.sum())
+        )
+        owners = np.repeat(np.arange(len(token_lists)), lengths)
+        return ids, owners
+
+    def score(self, token_lists):
+        """メッセージごとの感情スコア（正なら肯定、負なら否定）をまとめて計算"""
+        import numpy as np
+
+        ids, owners = self.encode(token_lists)
+        weights = self.polarity[ids]
+        if weights.any():
+            factors = self.multiplier[ids]
+            # k語前の強調語の倍率を掛ける（別のメッセージのトークンは対象外）
+            for k in range(1, self.INTENSIFIER_WINDOW + 1):
+                weights[k:] *= np.where(owners[k:] == owners[:-k], factors[:-k], 1.0)
+            # k語後に否定語があれば反転（偶数回なら元に戻る）
+            negators = self.negator[ids]
+            negated = np.zeros(len(ids), dtype=bool)
+            for k in range(1, self.negation_window + 1):
+                negated[:-k] ^= negators[k:] & (owners[k:] == owners[:-k])
+            weights[negated] *= -1
+        return np.bincount(owners, weights=weights, minlength=len(token_lists))
+
+    def classify(self, token_lists):
+        """メッセージごとに 'positive' / 'negative' / 'neutral' を判定"""
+        scores = self.score(token_lists)
+        labels = (scores > self.NEUTRAL_EPSILON).astype(int) - (scores < -self.NEUTRAL_EPSILON) + 1
+        return [self.LABELS[label] for label in labels.tolist()]
+
+
+class ConversationWriter:
+    """会話ログの書き込みを後回しにしてまとめてINSERTするライター（ワーカープロセス単位）"""
+
+    _STOP = object()
+
+    def __init__(self, pool, queue_size=10000, batch_size=200, flush_interval=0.5, retries=3):
+        self.pool = pool
+        self.queue_size = queue_size
+        self.batch_size = max(1, batch_size)
+        self.flush_interval = flush_interval
+        self.retries = retries
+        self._lock = threading.Lock()
+        self._pid = None
+        self._queue = None
+        self._thread = None
+        self._stats = {
+            'enqueued': 0, 'written': 0, 'dropped': 0, 'failed': 0,
+            'flushes': 0, 'flush_errors': 0, 'last_flush_ms': 0.0, 'last_batch_size': 0
+        }
+
+    def _ensure_started(self):
+        """ワーカープロセスごとにキューと書き込みスレッドを用意"""
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._queue = queue.Queue(maxsize=self.queue_size)
+            self._thread = threading.Thread(target=self._run, name='conversation-writer', daemon=True)
+            self._thread.start()
+            self._pid = os.getpid()
+
+    def enqueue(self, user_id, user_message, bot_response, session_id, sentiment=None, intent=None):
+        """会話をキューに積む（キューが満杯なら破棄してFalseを返す）"""
+        self._ensure_started()
+        row = (user_id, user_message, bot_response, session_id, sentiment, intent, datetime.now())
+        try:
+            self._queue.put_nowait(row)
+        except queue.Full:
+            with self._lock:
+                self._stats['dropped'] += 1
+            return False
+        with self._lock:
+            self._stats['enqueued'] += 1
+        return True
+
+    def _run(self):
+        stopping = False
+        while not stopping:
+            item = self._queue.get()
+            if item is self._STOP:
+                self._queue.task_done()
+                break
+            batch = [item]
+            deadline = time.monotonic() + self.flush_interval
+            # バッチサイズに達するか一定時間経過するまで集める
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if item is self._STOP:
+                    self._queue.task_done()
+                    stopping = True
+                    break
+                batch.append(item)
+            self._write(batch)
+
+        # 停止時は残りをすべて書き出す
+        batch = []
+        while True:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is self._STOP:
+                self._queue.task_done()
+                continue
+            batch.append(item)
+            if len(batch) >= self.batch_size:
+                self._write(batch)
+                batch = []
+        if batch:
+            self._write(batch)
+
+    def _write(self, batch):
+        """バッチを1回のINSERTで保存（失敗時はリトライ）"""
+        start = time.monotonic()
+        try:
+            for attempt in range(self.retries + 1):
+                try:
+                    with self.pool.connection() as conn:
+                        with conn.cursor() as cursor:
+                            execute_values(cursor, """
+                                INSERT INTO conversations
+                                    (user_id, user_message, bot_response, session_id, sentiment, intent, timestamp)
+                                VALUES %s
+                            """, batch, page_size=len(batch))
+                    with self._lock:
+                        self._stats['written'] += len(batch)
+                        self._stats['flushes'] += 1
+                        self._stats['last_batch_size'] = len(batch)
+                        self._stats['last_flush_ms'] = round((time.monotonic() - start) * 1000, 3)
+                    return
+                except Exception as e:
+                    with self._lock:
+                        self._stats['flush_errors'] += 1
+                    logger.error("会話ログの一括保存に失敗しました（%d回目）: %s", attempt + 1, e)
+                    if attempt < self.retries:
+                        time.sleep(min(2 ** attempt, 10))
+            with self._lock:
+                self._stats['failed'] += len(batch)
+        finally:
+            for _ in batch:
+                self._queue.task_done()
+
+    def flush(self, timeout=None):
+        """キューに積まれた会話がすべて保存されるまで待つ"""
+        if self._pid != os.getpid():
+            return True
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._queue.all_tasks_done:
+            while self._queue.unfinished_tasks:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._queue.all_tasks_done.wait(remaining)
+        return True
+
+    def close(self, timeout=10.0):
+        """書き込みスレッドを停止（残りの会話は書き出してから終了）"""
+        if self._pid != os.getpid() or not self._thread.is_alive():
+            return
+        try:
+            self._queue.put(self._STOP, timeout=timeout)
+        except queue.Full:
+            pass
+        self._thread.join(timeout)
+
+    def get_stats(self):
+        """書き込みの統計情報"""
+        with self._lock:
+            stats = dict(self._stats)
+        stats['pending'] = self._queue.unfinished_tasks if self._pid == os.getpid() else 0
+        stats['queue_size'] = self.queue_size
+        return stats
+
+
+class UserProfile:
+    """直近の会話（最大window件）の感情・インテント・時間帯の集計"""
+
+    __slots__ = ('turns', 'sentiments', 'intents', 'hours', 'expires_at')
+
+    def __init__(self, window, expires_at):
+        self.turns = deque(maxlen=window)
+        self.sentiments = Counter()
+        self.intents = Counter()
+        self.hours = Counter()
+        self.expires_at = expires_at
+
+    def add(self, sentiment, intent, hour):
+        """会話を1件追加（あふれた古い会話はカウンターから差し引く）"""
+        if len(self.turns) == self.turns.maxlen:
+            self._discount(self.turns[0])
+        turn = (sentiment, intent, hour)
+        self.turns.append(turn)
+        if sentiment:
+            self.sentiments[sentiment] += 1
+        if intent:
+            self.intents[intent] += 1
+        if hour is not None:
+            self.hours[hour] += 1
+
+    def _discount(self, turn):
+        for counter, value in zip((self.sentiments, self.intents, self.hours), turn):
+            if value is None or value == '':
+                continue
+            counter[value] -= 1
+            if counter[value] <= 0:
+                del counter[value]
+
+    def pattern(self):
+        """会話パターン（analyze_conversation_patternの戻り値）"""
+        if not self.turns:
+            return {}
+        return {
+            'dominant_sentiment': self.sentiments.most_common(1)[0][0] if self.sentiments else 'neutral',
+            'frequent_intents': [intent for intent, _ in self.intents.most_common(3)],
+            'active_hours': [hour for hour, _ in self.hours.most_common(3)],
+            'conversation_count': len(self.turns)
+        }
+
+
+class UserProfileStore:
+    """ユーザーごとの会話プロフィールを保持するLRU/TTLキャッシュ
+
+    上限ユーザー数を超えると最も長く使われていないものから破棄する。
+    プロフィール1件は直近window件の会話しか保持しないため、メモリ使用量は
+    max_users × window で頭打ちになる。キャッシュにないユーザーは
+    loaderで直近の会話を読み込んで作成する。
+    """
+
+    def __init__(self, loader, max_users=10000, ttl=1800.0, window=20):
+        self.loader = loader
+        self.max_users = max(1, max_users)
+        self.ttl = ttl
+        self.window = max(1, window)
+        self._lock = threading.Lock()
+        self._profiles = OrderedDict()
+        self._stats = {'hits': 0, 'misses': 0, 'evictions': 0, 'expirations': 0, 'load_errors': 0}
+
+    def _lookup(self, user_id, now):
+        """キャッシュ上のプロフィールを取得（期限切れは破棄）。ロック内で呼ぶ"""
+        profile = self._profiles.get(user_id)
+        if profile is None:
+            return None
+        if profile.expires_at <= now:
+            del self._profiles[user_id]
+            self._stats['expirations'] += 1
+            return None
+        self._profiles.move_to_end(user_id)
+        return profile
+
+    def get_pattern(self, user_id):
+        """ユーザーの会話パターンを取得（キャッシュにない場合はDBから読み込む）"""
+        now = time.monotonic()
+        with self._lock:
+            profile = self._lookup(user_id, now)
+            if profile is not None:
+                self._stats['hits'] += 1
+                return profile.pattern()
+            self._stats['misses'] += 1
+
+        try:
+            turns = self.loader(user_id, self.window)
+        except Exception as e:
+            with self._lock:
+                self._stats['load_errors'] += 1
+            logger.error("会話プロフィール読み込みエラー: %s", e)
+            return {}
+
+        profile = UserProfile(self.window, now + self.ttl)
+        for sentiment, intent, hour in turns:
+            profile.add(sentiment, intent, hour)
+        with self._lock:
+            # 読み込み中に別スレッドが作成していればそちらを優先
+            existing = self._lookup(user_id, now)
+            if existing is not None:
+                return existing.pattern()
+            self._profiles[user_id] = profile
+            while len(self._profiles) > self.max_users:
+                self._profiles.popitem(last=False)
+                self._stats['evictions'] += 1
+            return profile.pattern()
+
+    def record(self, user_id, sentiment, intent, hour):
+        """会話を反映（キャッシュにないユーザーは次回読み込み時にDBから作成する）"""
+        with self._lock:
+            profile = self._lookup(user_id, time.monotonic())
+            if profile is not None:
+                profile.add(sentiment, intent, hour)
+
+    def get_stats(self):
+        """キャッシュの統計情報"""
+        with self._lock:
+            stats = dict(self._stats)
+            stats['users'] = len(self._profiles)
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_ratio'] = round(stats['hits'] / lookups, 4) if lookups else 0.0
+        stats['max_users'] = self.max_users
+        stats['window'] = self.window
+        return stats
+
+
+class AnalysisCache:
+    """メッセージの解析結果 (keywords, sentiment, intent) のLRUキャッシュ
+
+    結果はマッチャー（インテント一覧と感情辞書から構築）に依存するため、
+    異なるマッチャーで参照された時点で全件破棄する。
+    """
+
+    def __init__(self, max_size=10000):
+        self.max_size = max(0, max_size)
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._matcher = None
+        self._stats = {'hits': 0, 'misses': 0, 'evictions': 0, 'invalidations': 0}
+
+    @staticmethod
+    def make_key(text):
+        """キャッシュキー（解析結果が変わらない範囲で正規化した文面）"""
+        return text.strip().lower()
+
+    def _check_matcher(self, matcher):
+        """マッチャーが変わっていれば全件破棄。ロック内で呼ぶ"""
+        if matcher is not self._matcher:
+            if self._entries:
+                self._entries.clear()
+                self._stats['invalidations'] += 1
+            self._matcher = matcher
+
+    def get(self, matcher, key):
+        """キャッシュ済みの結果を取得（なければNone）"""
+        with self._lock:
+            self._check_matcher(matcher)
+            entry = self._entries.get(key)
+            if entry is None:
+                self._stats['misses'] += 1
+                return None
+            self._entries.move_to_end(key)
+            self._stats['hits'] += 1
+            return entry
+
+    def put(self, matcher, key, entry):
+        """結果を保存（解析中にマッチャーが差し替わっていれば保存しない）"""
+        if not self.max_size:
+            return
+        with self._lock:
+            if matcher is not self._matcher:
+                return
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self._stats['evictions'] += 1
+
+    def clear(self):
+        """全件破棄（感情辞書の変更時など）"""
+        with self._lock:
+            if self._entries:
+                self._entries.clear()
+                self._stats['invalidations'] += 1
+            self._matcher = None
+
+    def get_stats(self):
+        """キャッシュの統計情報"""
+        with self._lock:
+            stats = dict(self._stats)
+            stats['size'] = len(self._entries)
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_ratio'] = round(stats['hits'] / lookups, 4) if lookups else 0.0
+        stats['max_size'] = self.max_size
+        return stats
+
+
+# 日本語トークナイザー（プロセスごとに1つ、初回使用時に辞書を読み込む）
+_tokenizer = None
+_tokenizer_pid = None
+_tokenizer_lock = threading.Lock()
+
+
+def get_tokenizer():
+    """共有のJanomeトークナイザーを取得（利用できない場合はNone）"""
+    global _tokenizer, _tokenizer_pid
+    if not JANOME_AVAILABLE:
+        return None
+    if _tokenizer_pid == os.getpid():
+        return _tokenizer
+    with _tokenizer_lock:
+        if _tokenizer_pid != os.getpid():
+            try:
+                from janome.tokenizer import Tokenizer
+                _tokenizer = Tokenizer()
+            except Exception as e:
+                logger.error("Janome初期化エラー: %s", e)
+                _tokenizer = None
+            _tokenizer_pid = os.getpid()
+    return _tokenizer
+
+
+@lru_cache(maxsize=TOKENIZE_CACHE_SIZE)
+def tokenize(text):
+    """形態素解析して (表層形, 品詞, 基本形) のタプルを返す（Janomeが無い場合は空白区切りで品詞はNone）"""
+    tokenizer = get_tokenizer()
+    if tokenizer is None:
+        return tuple((word, None, word) for word in text.split())
+    return tuple(
+        (token.surface, token.part_of_speech, token.base_form if token.base_form != '*' else token.surface)
+        for token in tokenizer.tokenize(text)
+        if not token.surface.isspace()
+    )
+
+
+def get_tokenizer_stats():
+    """トークナイザーとキャッシュの統計情報"""
+    info = tokenize.cache_info()
+    total = info.hits + info.misses
+    return {
+        'backend': 'janome' if JANOME_AVAILABLE else 'whitespace',
+        'loaded': _tokenizer is not None and _tokenizer_pid == os.getpid(),
+        'hits': info.hits,
+        'misses': info.misses,
+        'hit_ratio': round(info.hits / total, 4) if total else 0.0,
+        'size': info.currsize,
+        'max_size': info.maxsize
+    }
+
+
+def _chunked(iterable, size):
+    """イテラブルをsize件ずつのリストに分割"""
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _prepend(items, iterator):
+    yield from items
+    yield from iterator
+
+
+# 一括解析のワーカープロセス側の状態
+_batch_worker_state = {}
+
+
+def _init_batch_worker(analyzer, matcher):
+    _batch_worker_state['analyzer'] = analyzer
+    _batch_worker_state['matcher'] = matcher
+
+
+def _analyze_batch_chunk(texts):
+    analyzer = _batch_worker_state['analyzer']
+    matcher = _batch_worker_state['matcher']
+    return analyzer._analyze_chunk(matcher, texts)
+
+
+def _reanalyze_rows(analyzer, matcher, rows):
+    """会話の行 (id, timestamp, user_message, sentiment, intent) を再判定し、結果が変わった行だけ返す"""
+    keys = [AnalysisCache.make_key(text) for _, _, text, _, _ in rows]
+    founds = [matcher.scan(key) for key in keys]
+    sentiments = analyzer._sentiments(matcher, keys, founds)
+    changed = []
+    for row, found, new_sentiment in zip(rows, founds, sentiments):
+        conversation_id, timestamp, _, sentiment, intent = row
+        result = (new_sentiment, matcher.intent(found))
+        if result != (sentiment, intent):
+            changed.append((conversation_id, timestamp) + result)
+    return changed
+
+
+def _reanalyze_batch_chunk(rows):
+    return _reanalyze_rows(_batch_worker_state['analyzer'], _batch_worker_state['matcher'], rows)
+
+
+class TfidfRetriever:
+    """TF-IDFの疎行列によるコサイン類似度検索（インテントのパターンと知識ベースが対象）"""
+
+    def __init__(self, vectorizer, matrix, entries, fingerprint):
+        self.vectorizer = vectorizer
+        self.matrix = matrix
+        self.entries = entries
+        self.fingerprint = fingerprint
+
+    @staticmethod
+    def build_documents(snapshot):
+        """カタログから検索対象の文書と応答候補を作成"""
+        documents = []
+        entries = []
+        for row in snapshot.intents:
+            if row['responses']:
+                documents.append(' '.join(row['patterns']))
+                entries.append({'source': 'intent', 'key': row['intent_name'], 'responses': list(row['responses'])})
+        for row in snapshot.knowledge:
+            documents.append(f"{row['keyword']} {row['response']}")
+            entries.append({'source': 'knowledge', 'key': row['keyword'], 'responses': [row['response']]})
+        return documents, entries
+
+    @staticmethod
+    def compute_fingerprint(documents):
+        """文書とモデルのバージョンから保存済みモデルの照合キーを作成"""
+        payload = json.dumps([RETRIEVAL_MODEL_VERSION, documents], ensure_ascii=False)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    @classmethod
+    def fit(cls, prototype, documents, entries, fingerprint):
+        """ベクトライザを学習して疎行列を作成"""
+        from sklearn.base import clone
+        
+        vectorizer = clone(prototype)
+        matrix = vectorizer.fit_transform(documents).tocsr()
+        # max_features で除外した全n-gramの集合。検索には使わず、語彙の数百倍の大きさになる
+        vectorizer.stop_words_ = None
+        return cls(vectorizer, matrix, entries, fingerprint)
+
+    def save(self, path):
+        """学習済みモデルを保存（一時ファイルに書いてから置き換え）"""
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        import joblib
+        
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        # 応答候補はカタログから作り直せるため保存しない。配列は圧縮せずに保存してmmapできるようにする
+        joblib.dump({
+            'vectorizer': self.vectorizer,
+            'matrix': self.matrix,
+            'fingerprint': self.fingerprint
+        }, tmp_path)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path, entries):
+        """保存済みモデルを読み込む（疎行列の配列はmmapし、全ワーカーで共有する）"""
+        import joblib
+        
+        data = joblib.load(path, mmap_mode='r')
+        return cls(data['vectorizer'], data['matrix'], entries, data['fingerprint'])
+
+    def search(self, texts, k=3):
+        """複数のクエリをまとめて検索し、クエリごとに類似度上位k件を返す"""
+        if not texts:
+            return []
+        import numpy as np
+        from sklearn.metrics.pairwise import linear_kernel
+        
+        # TF-IDFの行はL2正規化済みのため内積がコサイン類似度になる（mmapした行列を複製しない）
+        scores = linear_kernel(self.vectorizer.transform(texts), self.matrix)
+        k = min(k, scores.shape[1])
+        results = []
+        for row in scores:
+            top = np.argpartition(-row, k - 1)[:k]
+            top = top[np.argsort(-row[top], kind='stable')]
+            results.append([
+                dict(self.entries[i], score=float(row[i])) for i in top if row[i] > 0
+            ])
+        return results
+
 
 class AIMessageAnalyzer:
     """テキストメッセージの解析と理解を行うクラス"""
     
-    def __init__(self):
-        self.vectorizer = TfidfVectorizer(
-            max_features=1000,
-            stop_words=None,  # 日本語の場合は独自に設定
-            ngram_range=(1, 2)
-        )
+    # インテントごとの特定パターン
+    SPECIFIC_PATTERNS = {
+        'food': ['好きな食べ物', '食べ物', '料理', '美味しい', 'グルメ'],
+        'name': ['名前', '君は誰', 'あなたは', 'あなたの名前', 'ボット'],
+        'weather': ['天気', '雨', '晴れ', '曇り', '雪', '降る', '降らない'],
+        'time': ['時間', '今何時', '何時', '時刻'],
+        'greeting': ['こんにちは', 'おはよう', 'こんばんは', 'はじめまして'],
+        'goodbye': ['さようなら', 'バイバイ', 'また'],
+        'thanks': ['ありがとう', 'サンキュー', '感謝']
+    }
+    
+    # 明確な質問パターン（上から順に優先）
+    QUESTION_INDICATORS = [
+        ('food', ['好きな食べ物', '食べ物', '料理', '何食べる', '美味しい', 'グルメ']),
+        ('name', ['名前', 'あなたは誰', 'あなたの名前', '君は誰', 'ボット', 'bot']),
+        ('weather', ['天気', '雨', '晴れ', '曇り', '雪', '降る', '降らない']),
+        ('time', ['時間', '今何時', '何時', '時刻', '今の時間'])
+    ]
+    
+    # 組み込みの重み付き感情辞書（SENTIMENT_ENGINE=lexicon で使用。見出し語は基本形）
+    SENTIMENT_WEIGHTS = {
+        # 肯定
+        '嬉しい': 1.0, '楽しい': 1.0, '幸せ': 1.0, '良い': 0.8, 'いい': 0.8, '素晴らしい': 1.5,
+        '最高': 1.5, 'ありがとう': 1.0, '感謝': 1.0, '愛': 1.0, '好き': 1.0, '満足': 1.0,
+        '大好き': 1.5, '面白い': 1.0, '美味しい': 1.0, 'おいしい': 1.0, '安心': 0.8, '助かる': 1.0,
+        '便利': 0.8, '快適': 0.8, '素敵': 1.0, '綺麗': 0.8, 'きれい': 0.8, '優しい': 0.8,
+        '喜ぶ': 1.0, '感動': 1.2, '成功': 0.8, '完璧': 1.2, '元気': 0.6, '可愛い': 0.8,
+        'かわいい': 0.8, 'ラッキー': 0.8, 'わくわく': 0.8, '楽しみ': 1.0, 'うまい': 0.8,
+        # 否定
+        '悲しい': -1.0, 'つらい': -1.0, '辛い': -1.0, '疲れる': -0.8, '悪い': -1.0, '嫌い': -1.0,
+        '困る': -1.0, '怒り': -1.0, '不満': -1.0, '心配': -0.8, '不安': -0.8, '問題': -0.6,
+        '大嫌い': -1.5, '最悪': -1.5, '嫌': -1.0, '怒る': -1.0, '寂しい': -1.0, '苦しい': -1.0,
+        '痛い': -0.8, '怖い': -0.8, '残念': -1.0, '失敗': -0.8, '退屈': -0.8, 'つまらない': -1.0,
+        '面倒': -0.8, 'めんどくさい': -0.8, 'うるさい': -0.8, 'イライラ': -1.0, 'ストレス': -0.8,
+        '憂鬱': -1.0, '落ち込む': -1.0, 'がっかり': -1.0, '不便': -0.8, 'むかつく': -1.2,
+        '迷惑': -1.0, '後悔': -1.0, '悩む': -0.8, '大変': -0.6,
+    }
+    # 強調語（直後の評価語に掛ける倍率）
+    SENTIMENT_INTENSIFIERS = {
+        'とても': 1.5, 'すごく': 1.5, '本当に': 1.5, '非常に': 1.5, '超': 1.5, 'めっちゃ': 1.5,
+        'かなり': 1.3, '一番': 1.3, '少し': 0.5, 'ちょっと': 0.5, 'やや': 0.7, 'あまり': 0.5,
+    }
+    # 否定語（助動詞の基本形。直前の評価語を打ち消す）
+    SENTIMENT_NEGATORS = ('ない', 'ぬ', 'ん')
+    # 感情判定のトークン列から除く品詞（「楽しいんです」の「ん」を否定語と取り違えないようにする）
+    LEMMA_EXCLUDED_POS = ('助詞', '記号', '名詞,非自立')
+    
+    def __init__(self, sentiment_engine=None):
+        self._vectorizer = None
+        self.retriever = None
+        self.retrieval_model_path = RETRIEVAL_MODEL_PATH
         self.japanese_stopwords = [
             'の', 'に', 'は', 'を', 'が', 'で', 'て', 'と', 'し', 'れ', 
             'さ', 'ある', 'いる', 'する', 'です', 'ます', 'だ', 'である'
         ]
+        # キーワードとして残す品詞（大分類）と除外する細分類
+        self.keyword_pos = ('名詞', '動詞', '形容詞', '感動詞')
+        self.excluded_pos_details = ('非自立', '代名詞', '数', '接尾')
+        self.positive_words = [
+            '嬉しい', '楽しい', '幸せ', '良い', '素晴らしい', '最高', 
+            'ありがとう', '感謝', '愛', '好き', '満足'
+        ]
+        self.negative_words = [
+            '悲しい', 'つらい', '疲れた', '悪い', '嫌い', '困った', 
+            '怒り', '不満', '心配', '不安', '問題'
+        ]
+        self.sentiment_engine = sentiment_engine or SENTIMENT_ENGINE
+        self.sentiment_weights = dict(self.SENTIMENT_WEIGHTS)
+        self.sentiment_intensifiers = dict(self.SENTIMENT_INTENSIFIERS)
+        self.sentiment_negators = list(self.SENTIMENT_NEGATORS)
+        if SENTIMENT_LEXICON_PATH and self.sentiment_engine == 'lexicon':
+            self._load_sentiment_lexicon(SENTIMENT_LEXICON_PATH)
+        self._sentiment_lexicon = None
+        self._base_matcher = self._build_matcher(None)
+        self._matcher = None
+        self._previous_matcher = None
+        self.analysis_cache = AnalysisCache(ANALYSIS_CACHE_SIZE)
+        self._batch_lock = threading.Lock()
+        self._batch_executor = None
+    
+    def _load_sentiment_lexicon(self, path):
+        """追加の感情辞書を読み込んで組み込みの辞書に上書きする（読めなければ組み込みのみ）"""
+        try:
+            weights, intensifiers, negators = SentimentLexicon.read_file(path)
+        except (OSError, ValueError) as e:
+            logger.error("感情辞書の読み込みに失敗しました（組み込みの辞書を使います）: %s", e)
+            return
+        self.sentiment_weights.update(weights)
+        self.sentiment_intensifiers.update(intensifiers)
+        self.sentiment_negators.extend(negator for negator in negators if negator not in self.sentiment_negators)
+        logger.info("感情辞書を読み込みました: %s（評価語 %d 件）", path, len(weights))
+    
+    @property
+    def vectorizer(self):
+        """TF-IDFベクトライザ（未学習の設定。scikit-learnは初回使用時に読み込む）"""
+        if self._vectorizer is None:
+            from sklearn.feature_extraction.text import TfidfVectorizer
+            
+            self._vectorizer = TfidfVectorizer(
+                analyzer='char_wb',  # 日本語は空白で区切られないため文字n-gram
+                max_features=1000,
+                stop_words=None,  # 日本語の場合は独自に設定
+                ngram_range=(2, 3)
+            )
+        return self._vectorizer
+    
+    @property
+    def sentiment_lexicon(self):
+        """コンパイル済みの重み付き感情辞書（見出し語の形態素解析が必要なため初回使用時に作成）"""
+        if self._sentiment_lexicon is None:
+            self._sentiment_lexicon = SentimentLexicon(
+                self.sentiment_weights, self.sentiment_intensifiers, self.sentiment_negators, self.lemmatize
+            )
+        return self._sentiment_lexicon
+    
+    def _build_matcher(self, intents_data):
+        # 感情辞書を使う場合、単語リストはマッチャーに含めない
+        keyword_sentiment = self.sentiment_engine == 'keyword'
+        return MessageMatcher(
+            intents_data,
+            self.positive_words if keyword_sentiment else (),
+            self.negative_words if keyword_sentiment else (),
+            self.SPECIFIC_PATTERNS, self.QUESTION_INDICATORS
+        )
+    
+    def update_lexicon(self, positive_words=None, negative_words=None, weights=None):
+        """感情辞書を差し替え、マッチャーと解析結果のキャッシュを作り直す
+        
+        positive_words / negative_words は keyword 方式、weights（見出し語 -> 重み）は lexicon 方式の辞書。
+        """
+        if positive_words is not None:
+            self.positive_words = list(positive_words)
+        if negative_words is not None:
+            self.negative_words = list(negative_words)
+        if weights is not None:
+            self.sentiment_weights = dict(weights)
+        self._sentiment_lexicon = None
+        self._base_matcher = self._build_matcher(None)
+        self._matcher = None
+        self._previous_matcher = None
+        self.analysis_cache.clear()
+    
+    def get_matcher(self, intents_data):
+        """インテント一覧に対応するコンパイル済みマッチャーを取得（同じ一覧なら再利用）"""
+        if not intents_data:
+            return self._base_matcher
+        # 差し替え直後は古いスナップショットを持つリクエストも残るため、直前の1つも保持する
+        for matcher in (self._matcher, self._previous_matcher):
+            if matcher is not None and matcher.source is intents_data:
+                return matcher
+        matcher = self._build_matcher(intents_data)
+        self._previous_matcher, self._matcher = self._matcher, matcher
+        return matcher
+    
+    def normalize_text(self, text):
+        """小文字化と特殊文字の除去"""
+        return re.sub(r'[^\w\s]', '', text.lower())
     
     def preprocess_text(self, text):
-        """テキストの前処理"""
-        # 小文字化
-        text = text.lower()
-        # 特殊文字を除去
-        text = re.sub(r'[^\w\s]', '', text)
+        """テキストの前処理（形態素単位に分割し、空白区切りで返す）"""
+        words = [surface for surface, _, _ in tokenize(self.normalize_text(text))]
         # 日本語ストップワードを除去
-        words = text.split()
         words = [word for word in words if word not in self.japanese_stopwords]
         return ' '.join(words)
     
+    def lemmatize(self, text):
+        """感情判定用のトークン列（基本形。助詞・記号・非自立名詞を除く）"""
+        return [
+            base for _, pos, base in tokenize(self.normalize_text(text))
+            if pos is None or not pos.startswith(self.LEMMA_EXCLUDED_POS)
+        ]
+    
+    def _is_keyword_token(self, surface, pos):
+        if surface in self.japanese_stopwords:
+            return False
+        if pos is None:
+            return True
+        parts = pos.split(',')
+        return parts[0] in self.keyword_pos and parts[1] not in self.excluded_pos_details
+    
     def extract_keywords(self, text):
-        """キーワード抽出"""
-        processed_text = self.preprocess_text(text)
-        words = processed_text.split()
+        """キーワード抽出（内容語のみ）"""
+        words = [
+            surface for surface, pos, _ in tokenize(self.normalize_text(text))
+            if self._is_keyword_token(surface, pos)
+        ]
         
         # 単語の頻度を計算
         word_freq = {}
@@ -90,202 +2191,570 @@ class AIMessageAnalyzer:
         return [keyword[0] for keyword in keywords[:5]]  # 上位5つのキーワード
     
     def analyze_sentiment(self, text):
-        """感情分析（簡易版）"""
-        positive_words = [
-            '嬉しい', '楽しい', '幸せ', '良い', '素晴らしい', '最高', 
-            'ありがとう', '感謝', '愛', '好き', '満足'
-        ]
-        negative_words = [
-            '悲しい', 'つらい', '疲れた', '悪い', '嫌い', '困った', 
-            '怒り', '不満', '心配', '不安', '問題'
-        ]
-        
-        text_lower = text.lower()
-        positive_score = sum(1 for word in positive_words if word in text_lower)
-        negative_score = sum(1 for word in negative_words if word in text_lower)
-        
-        if positive_score > negative_score:
-            return 'positive'
-        elif negative_score > positive_score:
-            return 'negative'
-        else:
-            return 'neutral'
+        """感情分析（positive / negative / neutral）"""
+        return self.analyze_sentiments([text])[0]
+    
+    def analyze_sentiments(self, texts):
+        """複数メッセージの感情をまとめて判定（lexicon 方式は1回の配列演算でスコアを計算）"""
+        matcher = self._matcher or self._base_matcher
+        return self._sentiments(matcher, texts)
+    
+    def _sentiments(self, matcher, texts, founds=None):
+        """各メッセージの感情を判定。keyword 方式ではマッチャーの走査結果（founds）を使う"""
+        if self.sentiment_engine == 'keyword':
+            if founds is None:
+                founds = [matcher.scan(text.lower()) for text in texts]
+            return [matcher.sentiment(found) for found in founds]
+        return self.sentiment_lexicon.classify([self.lemmatize(text) for text in texts])
     
     def classify_intent(self, text, intents_data):
         """意図分類（改善版）"""
         if not intents_data:
             return 'unknown'
         
-        text_lower = text.lower()
-        text_processed = self.preprocess_text(text)
-        best_intent = 'unknown'
-        highest_score = 0
+        matcher = self.get_matcher(intents_data)
+        return matcher.intent(matcher.scan(text.lower()))
+    
+    def analyze_message(self, text, intents_data):
+        """感情と意図を1回の走査でまとめて判定"""
+        matcher = self.get_matcher(intents_data)
+        found = matcher.scan(text.lower())
+        return self._sentiments(matcher, [text], [found])[0], matcher.intent(found)
+    
+    def analyze_turn(self, text, intents_data):
+        """チャット1往復分の解析 (keywords, sentiment, intent)。同じ文面はキャッシュから返す"""
+        matcher = self.get_matcher(intents_data)
+        key = AnalysisCache.make_key(text)
+        entry = self.analysis_cache.get(matcher, key)
+        if entry is None:
+            found = matcher.scan(key)
+            sentiment = self._sentiments(matcher, [key], [found])[0]
+            entry = (tuple(self.extract_keywords(key)), sentiment, matcher.intent(found))
+            self.analysis_cache.put(matcher, key, entry)
+        keywords, sentiment, intent = entry
+        return list(keywords), sentiment, intent
+    
+    def analyze(self, text, intents_data=None):
+        """1件のメッセージを解析（キーワード・感情・意図）"""
+        return self._analyze_with(self.get_matcher(intents_data), text)
+    
+    def _analyze_with(self, matcher, text):
+        return self._analyze_chunk(matcher, [text])[0]
+    
+    def _analyze_chunk(self, matcher, texts):
+        """チャンク単位で解析（感情はチャンク全体でまとめて判定）"""
+        valid = [text for text in texts if isinstance(text, str)]
+        founds = [matcher.scan(text.lower()) for text in valid]
+        sentiments = iter(self._sentiments(matcher, valid, founds))
+        founds = iter(founds)
+        results = []
+        for text in texts:
+            if not isinstance(text, str):
+                results.append({'error': 'テキストではありません'})
+                continue
+            results.append({
+                'keywords': self.extract_keywords(text),
+                'sentiment': next(sentiments),
+                'intent': matcher.intent(next(founds))
+            })
+        return results
+    
+    def analyze_batch(self, texts, intents_data=None, chunk_size=ANALYZE_BATCH_CHUNK_SIZE,
+                      workers=ANALYZE_BATCH_WORKERS):
+        """大量メッセージを一括解析（DB書き込みなし）
         
-        # 直接的なキーワードマッチングを優先
-        for intent_data in intents_data:
-            intent_name = intent_data['intent_name']
-            patterns = intent_data['patterns']
-            
-            score = 0
-            
-            # 完全一致チェック（最高優先度）
-            for pattern in patterns:
-                if pattern.lower() in text_lower:
-                    score += 10  # 完全一致には高いスコア
-            
-            # 部分一致チェック
-            for pattern in patterns:
-                pattern_words = pattern.lower().split()
-                for word in pattern_words:
-                    if word in text_lower:
-                        score += 2  # 部分一致には中程度のスコア
-            
-            # 特定の質問パターンをチェック
-            if self.check_specific_patterns(text_lower, intent_name):
-                score += 15  # 特定パターンには最高スコア
-            
-            if score > highest_score:
-                highest_score = score
-                best_intent = intent_name
-        
-        # 特別な処理：明確な質問パターンを識別
-        if self.is_question_about_food(text_lower):
-            return 'food'
-        elif self.is_question_about_name(text_lower):
-            return 'name'
-        elif self.is_question_about_weather(text_lower):
-            return 'weather'
-        elif self.is_question_about_time(text_lower):
-            return 'time'
+        入力順に結果を返すジェネレータ。チャンク単位でプロセスプールに分散し、
+        各ワーカーには同じコンパイル済みマッチャーを一度だけ渡す。
+        テキスト以外の要素には {'error': ...} を返す。
+        """
+        matcher = self.get_matcher(intents_data)
+        chunks = _chunked(texts, max(1, chunk_size))
+        first = next(chunks, None)
+        if first is None:
+            return
+        second = next(chunks, None)
         
-        return best_intent if highest_score > 0 else 'unknown'
+        leading = [chunk for chunk in (first, second) if chunk is not None]
+        
+        # 1チャンクで収まる場合や並列化しない場合はプロセス内で処理
+        if second is None or workers <= 1:
+            for chunk in _prepend(leading, chunks):
+                yield from self._analyze_chunk(matcher, chunk)
+            return
+        
+        executor = self._get_batch_executor(matcher, workers)
+        # 先読みするチャンク数を制限してメモリ使用量を一定に保つ
+        pending = deque()
+        try:
+            for chunk in _prepend(leading, chunks):
+                pending.append(executor.submit(_analyze_batch_chunk, chunk))
+                if len(pending) >= workers * 2:
+                    yield from pending.popleft().result()
+            while pending:
+                yield from pending.popleft().result()
+        finally:
+            # クライアントが途中で切断した場合は未着手のチャンクを取り消す（プールは次の要求で再利用）
+            for future in pending:
+                future.cancel()
     
-    def check_specific_patterns(self, text, intent_name):
-        """特定のパターンをチェック"""
-        patterns = {
-            'food': ['好きな食べ物', '食べ物', '料理', '美味しい', 'グルメ'],
-            'name': ['名前', '君は誰', 'あなたは', 'あなたの名前', 'ボット'],
-            'weather': ['天気', '雨', '晴れ', '曇り', '雪', '降る', '降らない'],
-            'time': ['時間', '今何時', '何時', '時刻'],
-            'greeting': ['こんにちは', 'おはよう', 'こんばんは', 'はじめまして'],
-            'goodbye': ['さようなら', 'バイバイ', 'また'],
-            'thanks': ['ありがとう', 'サンキュー', '感謝']
-        }
+    def reanalyze_batches(self, batches, intents_data=None, workers=ANALYZE_BATCH_WORKERS):
+        """会話の行のバッチを順に再判定（DB書き込みなし）
+        
+        バッチごとに (バッチ, 結果が変わった行 [(id, timestamp, sentiment, intent)]) を
+        入力順に返すジェネレータ。analyze_batch と同じくプロセスプールに分散し、
+        先読みするバッチ数を制限する。
+        """
+        matcher = self.get_matcher(intents_data)
+        if workers <= 1:
+            for batch in batches:
+                yield batch, _reanalyze_rows(self, matcher, batch)
+            return
+        
+        executor = self._get_batch_executor(matcher, workers)
+        pending = deque()
+        try:
+            for batch in batches:
+                pending.append((batch, executor.submit(_reanalyze_batch_chunk, batch)))
+                if len(pending) >= workers * 2:
+                    batch, future = pending.popleft()
+                    yield batch, future.result()
+            while pending:
+                batch, future = pending.popleft()
+                yield batch, future.result()
+        finally:
+            for _, future in pending:
+                future.cancel()
+    
+    def _get_batch_executor(self, matcher, workers):
+        """一括解析用のプロセスプール（ワーカープロセスごとに1つを使い回し、マッチャーかプロセス数が変わったら作り直す）
+        
+        アナライザーとマッチャーは fork でプロセスに引き継ぐ。マッチャーは mmap の memoryview を、
+        アナライザーはロックを持っていて pickle できないため、forkserver（Python 3.14 以降の Linux の既定）や
+        spawn（macOS の既定）では渡せない。そのため開始方式を fork に固定する。
+        """
+        key = (os.getpid(), matcher, workers)
+        with self._batch_lock:
+            if self._batch_executor is not None:
+                current_key, executor = self._batch_executor
+                if current_key == key:
+                    return executor
+                if current_key[0] == os.getpid():
+                    # 実行中の要求のチャンクは処理してから終了する
+                    executor.shutdown(wait=False)
+            self.compile_sentiment_lexicon()
+            executor = ProcessPoolExecutor(
+                max_workers=workers,
+                mp_context=multiprocessing.get_context('fork'),
+                initializer=_init_batch_worker,
+                initargs=(self, matcher)
+            )
+            self._batch_executor = (key, executor)
+            return executor
+    
+    def compile_sentiment_lexicon(self):
+        """感情辞書を事前にコンパイル（プロセスプールに渡す前やウォームアップで呼ぶ）"""
+        if self.sentiment_engine == 'lexicon':
+            self.sentiment_lexicon
+    
+    def update_retriever(self, snapshot):
+        """カタログからTF-IDF検索インデックスを用意（保存済みモデルが使えれば再学習しない）"""
+        documents, entries = TfidfRetriever.build_documents(snapshot)
+        if not documents:
+            self.retriever = None
+            return
+        fingerprint = TfidfRetriever.compute_fingerprint(documents)
+        if self.retriever is not None and self.retriever.fingerprint == fingerprint:
+            return
+        
+        path = self.retrieval_model_path
+        if not path:
+            self.retriever = self._fit_retriever(documents, entries, fingerprint)
+            return
+        try:
+            directory = os.path.dirname(path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            # 学習と保存は1ワーカーだけが行い、他のワーカーは同じファイルを読み込む
+            with _file_lock(f"{path}.lock"):
+                self.retriever = self._load_or_fit_retriever(path, documents, entries, fingerprint)
+        except OSError as e:
+            logger.warning("TF-IDFモデルの保存先を使えません: %s", e)
+            self.retriever = self._fit_retriever(documents, entries, fingerprint)
+    
+    def _load_or_fit_retriever(self, path, documents, entries, fingerprint):
+        if os.path.exists(path):
+            try:
+                retriever = TfidfRetriever.load(path, entries)
+                if retriever.fingerprint == fingerprint:
+                    return retriever
+            except Exception as e:
+                logger.warning("TF-IDFモデル読み込みエラー: %s", e)
+        
+        retriever = self._fit_retriever(documents, entries, fingerprint)
+        if retriever is None:
+            return None
+        try:
+            retriever.save(path)
+            # 保存したファイルを読み直し、このワーカーも他のワーカーと同じ配列をmmapする
+            return TfidfRetriever.load(path, entries)
+        except Exception as e:
+            logger.warning("TF-IDFモデル保存エラー: %s", e)
+            return retriever
+    
+    def _fit_retriever(self, documents, entries, fingerprint):
+        try:
+            return TfidfRetriever.fit(self.vectorizer, documents, entries, fingerprint)
+        except ValueError as e:
+            # 語彙が空の場合など
+            logger.exception("TF-IDFモデル学習エラー: %s", e)
+            return None
+    
+    def retrieve(self, texts, k=RETRIEVAL_TOP_K):
+        """TF-IDFのコサイン類似度で応答候補を検索（クエリごとに上位k件）"""
+        retriever = self.retriever
+        if retriever is None:
+            return [[] for _ in texts]
+        return retriever.search(texts, k)
+
+# 一括読み込みで報告する不正な行の上限
+CATALOG_LOAD_MAX_ERRORS = 20
+
+
+def _iter_catalog_file(path):
+    """CSV（ヘッダー付き）またはJSONL（.jsonl / .ndjson）を (行番号, 辞書) で1行ずつ読む"""
+    with open(path, encoding='utf-8', newline='') as f:
+        if path.endswith(('.jsonl', '.ndjson')):
+            for line_no, line in enumerate(f, start=1):
+                if not line.strip():
+                    continue
+                try:
+                    yield line_no, json.loads(line)
+                except ValueError as e:
+                    yield line_no, ValueError(f"JSONとして読めません: {e}")
+        else:
+            for line_no, row in enumerate(csv.DictReader(f), start=2):
+                yield line_no, row
+
+
+def _catalog_text(row, field, max_length=None, required=True):
+    value = row.get(field)
+    value = value.strip() if isinstance(value, str) else value
+    if value in (None, ''):
+        if required:
+            raise ValueError(f"{field} がありません")
+        return None
+    if not isinstance(value, str):
+        raise ValueError(f"{field} は文字列で指定してください")
+    if max_length and len(value) > max_length:
+        raise ValueError(f"{field} は {max_length} 文字以内で指定してください")
+    return value
+
+
+def _catalog_list(row, field):
+    """文字列のリスト（CSVではJSON配列または | 区切り）"""
+    value = row.get(field)
+    if isinstance(value, str):
+        value = json.loads(value) if value.lstrip().startswith('[') else value.split('|')
+    if not isinstance(value, list) or not all(isinstance(item, str) for item in value):
+        raise ValueError(f"{field} は文字列のリストで指定してください")
+    value = [item.strip() for item in value if item.strip()]
+    if not value:
+        raise ValueError(f"{field} が空です")
+    return value
+
+
+def _validate_intent_row(row):
+    return (
+        _catalog_text(row, 'intent_name', 100),
+        json.dumps(_catalog_list(row, 'patterns'), ensure_ascii=False),
+        json.dumps(_catalog_list(row, 'responses'), ensure_ascii=False)
+    )
+
+
+def _validate_knowledge_row(row):
+    confidence = row.get('confidence')
+    if confidence in (None, ''):
+        confidence = 1.0
+    try:
+        confidence = float(confidence)
+    except (TypeError, ValueError):
+        raise ValueError("confidence は数値で指定してください")
+    if not math.isfinite(confidence):
+        raise ValueError("confidence は有限の数値で指定してください")
+    return (
+        _catalog_text(row, 'keyword', 255),
+        _catalog_text(row, 'response'),
+        confidence,
+        _catalog_text(row, 'category', 100, required=False)
+    )
+
+
+def _copy_escape(value):
+    """COPYのテキスト形式の1項目に変換"""
+    if value is None:
+        return '\\N'
+    return (str(value).replace('\\', '\\\\').replace('\t', '\\t')
+            .replace('\n', '\\n').replace('\r', '\\r'))
+
+
+class _CopyStream:
+    """検証済みの行をCOPYのテキスト形式で少しずつ渡すファイル風オブジェクト
+
+    ファイル全体をメモリに載せずに copy_expert へ流し込む。不正な行は送らずに
+    errors に記録し、件数は rows に数える。
+    """
+
+    def __init__(self, records, validate):
+        self._records = records
+        self._validate = validate
+        self._buffer = b''
+        self.rows = 0
+        self.error_count = 0
+        self.errors = []
+
+    def _next_chunk(self):
+        lines = []
+        for line_no, row in self._records:
+            try:
+                if isinstance(row, Exception):
+                    raise row
+                if not isinstance(row, dict):
+                    raise ValueError("オブジェクトで指定してください")
+                values = self._validate(row)
+            except ValueError as e:
+                self.error_count += 1
+                if len(self.errors) < CATALOG_LOAD_MAX_ERRORS:
+                    self.errors.append(f"{line_no}行目: {e}")
+                continue
+            self.rows += 1
+            lines.append('\t'.join(_copy_escape(v) for v in (line_no,) + values) + '\n')
+            if len(lines) >= 1000:
+                break
+        return ''.join(lines).encode('utf-8')
+
+    def read(self, size=-1):
+        while size < 0 or len(self._buffer) < size:
+            chunk = self._next_chunk()
+            if not chunk:
+                break
+            self._buffer += chunk
+        if size < 0:
+            data, self._buffer = self._buffer, b''
+        else:
+            data, self._buffer = self._buffer[:size], self._buffer[size:]
+        return data
+
+
+# エクスポートする会話の列（この順番で SELECT する）
+EXPORT_COLUMNS = ('id', 'timestamp', 'user_id', 'session_id', 'user_message', 'bot_response', 'sentiment', 'intent')
+EXPORT_FORMATS = ('csv', 'parquet')
+
+
+class _ByteSink(io.RawIOBase):
+    """書き込まれたバイト列を溜めておき drain() で取り出す（Parquet を順次返すための出力先）"""
+
+    def __init__(self):
+        self._chunks = []
+        self._position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+
+class ConversationEncoder:
+    """会話の行のチャンクを CSV / Parquet の1ファイル分のバイト列に順次変換する
+
+    begin()、チャンクごとの write(rows)、finish() の順に呼び、返ったバイト列を
+    そのままファイルやレスポンスに書く。変換中の1チャンクしか保持しないため、
+    行数にかかわらずメモリ使用量は一定。Parquet ではチャンクが1つの行グループになる。
+    """
+
+    EXTENSIONS = {'csv': '.csv', 'parquet': '.parquet'}
+    MIMETYPES = {'csv': 'text/csv', 'parquet': 'application/vnd.apache.parquet'}
+
+    def __init__(self, fmt):
+        if fmt not in EXPORT_FORMATS:
+            raise ValueError(f"未対応の形式です: {fmt}（{' / '.join(EXPORT_FORMATS)}）")
+        if fmt == 'parquet' and not PYARROW_AVAILABLE:
+            raise ValueError('Parquet で書き出すには pyarrow が必要です')
+        self.format = fmt
+        self.extension = self.EXTENSIONS[fmt]
+        self.mimetype = self.MIMETYPES[fmt]
+        self._schema = None
+        self._sink = None
+        self._writer = None
+
+    def begin(self):
+        if self.format == 'csv':
+            return self._encode_csv([EXPORT_COLUMNS])
+        import pyarrow as pa
+        import pyarrow.parquet as pq
         
-        if intent_name in patterns:
-            return any(pattern in text for pattern in patterns[intent_name])
+        self._schema = pa.schema([
+            ('id', pa.int64()),
+            ('timestamp', pa.timestamp('us')),
+            ('user_id', pa.string()),
+            ('session_id', pa.string()),
+            ('user_message', pa.string()),
+            ('bot_response', pa.string()),
+            ('sentiment', pa.string()),
+            ('intent', pa.string()),
+        ])
+        self._sink = _ByteSink()
+        self._writer = pq.ParquetWriter(self._sink, self._schema)
+        return self._sink.drain()
+
+    def write(self, rows):
+        if self.format == 'csv':
+            return self._encode_csv(rows)
+        import pyarrow as pa
         
-        return False
-    
-    def is_question_about_food(self, text):
-        """食べ物に関する質問かチェック"""
-        food_indicators = ['好きな食べ物', '食べ物', '料理', '何食べる', '美味しい', 'グルメ']
-        return any(indicator in text for indicator in food_indicators)
-    
-    def is_question_about_name(self, text):
-        """名前に関する質問かチェック"""
-        name_indicators = ['名前', 'あなたは誰', 'あなたの名前', '君は誰', 'ボット', 'bot']
-        return any(indicator in text for indicator in name_indicators)
-    
-    def is_question_about_weather(self, text):
-        """天気に関する質問かチェック"""
-        weather_indicators = ['天気', '雨', '晴れ', '曇り', '雪', '降る', '降らない']
-        return any(indicator in text for indicator in weather_indicators)
-    
-    def is_question_about_time(self, text):
-        """時間に関する質問かチェック"""
-        time_indicators = ['時間', '今何時', '何時', '時刻', '今の時間']
-        return any(indicator in text for indicator in time_indicators)
+        columns = list(zip(*rows))
+        self._writer.write_table(pa.Table.from_arrays(
+            [pa.array(column, type=field.type) for column, field in zip(columns, self._schema)],
+            schema=self._schema
+        ))
+        return self._sink.drain()
+
+    def finish(self):
+        if self.format == 'csv':
+            return b''
+        self._writer.close()
+        return self._sink.drain()
+
+    @staticmethod
+    def _encode_csv(rows):
+        buffer = io.StringIO()
+        csv.writer(buffer, lineterminator='\n').writerows(rows)
+        return buffer.getvalue().encode('utf-8')
+
 
 class ChatBot:
     def __init__(self):
-        self.db_params = {
+        self.db_params = psycopg2.extensions.parse_dsn(DATABASE_URL) if DATABASE_URL else {
             'host': 'postgres',
             'database': 'chatbot_db',
             'user': 'chatbot_user',
             'password': 'chatbot_pass',
             'port': '5432'
         }
+        self.pool = self._create_pool(self.db_params)
+        # 履歴・分析・カタログなどの読み取りはレプリカへ（書き込みと LISTEN は常にプライマリ）
+        self.router = ReadRouter(
+            self.pool,
+            [self._create_pool(psycopg2.extensions.parse_dsn(url)) for url in DATABASE_REPLICA_URLS],
+            retry_interval=DB_REPLICA_RETRY_INTERVAL
+        )
+        self.write_mode = CONVERSATION_WRITE_MODE
+        self.writer = ConversationWriter(
+            self.pool,
+            queue_size=CONVERSATION_QUEUE_SIZE,
+            batch_size=CONVERSATION_BATCH_SIZE,
+            flush_interval=CONVERSATION_FLUSH_INTERVAL,
+            retries=CONVERSATION_WRITE_RETRIES
+        )
+        # atexitは登録と逆順に実行されるため、接続を閉じる前に未保存の会話を書き出す
+        atexit.register(self.pool.closeall)
+        for replica in self.router.replicas:
+            atexit.register(replica.closeall)
+        atexit.register(self.writer.close)
+        self._partition_lock = threading.Lock()
+        self._partition_pid = None
+        self.catalog = IntentCatalog(self.router, self.db_params, ttl=CATALOG_TTL, listen=CATALOG_LISTEN)
         self.analyzer = AIMessageAnalyzer()
+        # カタログ更新時にマッチャーを事前に再構築（リクエスト側で構築コストを払わない）
+        self.catalog.add_listener(lambda snapshot: self.analyzer.get_matcher(snapshot.intents))
+        self.catalog.add_listener(self.analyzer.update_retriever)
         
-        # 日本語トークナイザーの初期化
-        self.tokenizer = None
-        if JANOME_AVAILABLE:
-            try:
-                self.tokenizer = Tokenizer()
-            except Exception as e:
-                print(f"Janome初期化エラー: {e}")
-        
-        # 動的応答生成のための設定
-        self.conversation_context = {}
+        # 動的応答生成のための設定（ユーザーごとの会話コンテキストは上限付きキャッシュ）
+        self.profiles = UserProfileStore(
+            self._load_recent_turns,
+            max_users=PROFILE_CACHE_MAX_USERS,
+            ttl=PROFILE_CACHE_TTL,
+            window=PROFILE_WINDOW
+        )
         self.personality_settings = {
             'base_personality': 'friendly',
             'energy_level': 'normal',
             'formality': 'casual'
         }
     
-    def get_connection(self):
-        return psycopg2.connect(**self.db_params)
+    @property
+    def tokenizer(self):
+        """日本語トークナイザー（プロセス内で共有、初回使用時に読み込み）"""
+        return get_tokenizer()
+    
+    @staticmethod
+    def _create_pool(db_params):
+        return ConnectionPool(
+            db_params,
+            min_size=DB_POOL_MIN_SIZE,
+            max_size=DB_POOL_MAX_SIZE,
+            timeout=DB_POOL_TIMEOUT,
+            healthcheck_interval=DB_POOL_HEALTHCHECK_INTERVAL
+        )
+    
+    def get_connection(self, autocommit=False):
+        """プールから接続を借りる（with文で使用し、終了時に自動で返却）"""
+        return self.pool.connection(autocommit=autocommit)
     
     def save_conversation(self, user_id, user_message, bot_response, session_id, sentiment=None, intent=None):
-        print(f"🔍 DEBUG: Attempting to save conversation")
-        print(f"   User ID: {user_id}")
-        print(f"   Message: {user_message}")
-        print(f"   Response: {bot_response}")
-        print(f"   Session: {session_id}")
-        print(f"   Sentiment: {sentiment}")
-        print(f"   Intent: {intent}")
+        self.profiles.record(user_id, sentiment, intent, datetime.now().hour)
+        self.start_partition_maintenance()
         
+        # 非同期モードではキューに積むだけで応答を返す（IDは確定しない）
+        if self.write_mode == 'async':
+            self.writer.enqueue(user_id, user_message, bot_response, session_id, sentiment, intent)
+            return None
+        
+        # record_conversation() を autocommit で呼び、BEGIN/INSERT/COMMIT の3往復を1往復にする
         try:
-            with self.get_connection() as conn:
+            with self.get_connection(autocommit=True) as conn:
                 cursor = conn.cursor()
-                cursor.execute("""
-                    INSERT INTO conversations (user_id, user_message, bot_response, session_id, sentiment, intent)
-                    VALUES (%s, %s, %s, %s, %s, %s)
-                    RETURNING id
-                """, (user_id, user_message, bot_response, session_id, sentiment, intent))
+                cursor.execute(
+                    "SELECT record_conversation(%s, %s, %s, %s, %s, %s)",
+                    (user_id, user_message, bot_response, session_id, sentiment, intent)
+                )
                 
                 result = cursor.fetchone()
-                conn.commit()
-                print(f"✅ SUCCESS: Conversation saved with ID: {result[0]}")
+                turn_logger.debug("会話を保存しました", extra={'fields': {
+                    'conversation_id': result[0], 'user_id': user_id, 'session_id': session_id
+                }})
                 return result[0]
                 
         except Exception as e:
-            print(f"❌ ERROR: Failed to save conversation: {e}")
-            import traceback
-            print(traceback.format_exc())
+            logger.exception("会話の保存に失敗しました: %s", e)
             raise
     
     def get_intents_data(self):
-        """インテントデータを取得"""
-        try:
-            with self.get_connection() as conn:
-                cursor = conn.cursor(cursor_factory=RealDictCursor)
-                cursor.execute("SELECT intent_name, patterns, responses FROM intents")
-                return cursor.fetchall()
-        except Exception as e:
-            print(f"インテントデータ取得エラー: {e}")
-            return []
+        """インテントデータを取得（カタログキャッシュから）"""
+        return self.catalog.get().intents
     
     def get_response_by_intent(self, intent, user_message="", sentiment="neutral"):
         """インテントに基づいて応答を取得（コンテキスト考慮）"""
-        try:
-            with self.get_connection() as conn:
-                cursor = conn.cursor(cursor_factory=RealDictCursor)
-                cursor.execute("SELECT responses FROM intents WHERE intent_name = %s", (intent,))
-                result = cursor.fetchone()
-                
-                if result and result['responses']:
-                    base_response = random.choice(result['responses'])
-                    
-                    # 時間に基づく応答の調整
-                    enhanced_response = self.enhance_response_with_context(
-                        base_response, intent, sentiment, user_message
-                    )
-                    
-                    return enhanced_response
-        except Exception as e:
-            print(f"インテント応答取得エラー: {e}")
+        responses = self.catalog.get().responses.get(intent)
+        if responses:
+            base_response = random.choice(responses)
+            
+            # 時間に基づく応答の調整
+            enhanced_response = self.enhance_response_with_context(
+                base_response, intent, sentiment, user_message
+            )
+            
+            return enhanced_response
         
         return None
     
@@ -397,108 +2866,95 @@ class ChatBot:
         return random.choice(fillers) if random.random() < 0.5 else ""
     
     def analyze_conversation_pattern(self, user_id):
-        """ユーザーの会話パターンを分析"""
-        try:
-            history = self.get_conversation_history(user_id, limit=20)
-            if not history:
-                return {}
-            
-            # 感情パターンの分析
-            sentiments = [conv['sentiment'] for conv in history if conv['sentiment']]
-            
-            # 頻出インテントの分析
-            intents = [conv['intent'] for conv in history if conv['intent']]
-            
-            # 会話時間帯の分析
-            timestamps = [conv['timestamp'] for conv in history]
-            hours = [ts.hour for ts in timestamps]
-            
-            pattern = {
-                'dominant_sentiment': max(set(sentiments), key=sentiments.count) if sentiments else 'neutral',
-                'frequent_intents': list(set(intents))[:3] if intents else [],
-                'active_hours': list(set(hours))[:3] if hours else [],
-                'conversation_count': len(history)
-            }
-            
-            return pattern
-            
-        except Exception as e:
-            print(f"会話パターン分析エラー: {e}")
-            return {}
+        """ユーザーの会話パターンを分析（直近の会話はプロフィールキャッシュで保持）"""
+        return self.profiles.get_pattern(user_id)
+    
+    def _load_recent_turns(self, user_id, limit):
+        """プロフィール作成用に直近の会話を古い順で取得（レプリカから読む）"""
+        def query(conn):
+            cursor = conn.cursor()
+            cursor.execute("""
+                SELECT sentiment, intent, timestamp
+                FROM conversations 
+                WHERE user_id = %s 
+                ORDER BY timestamp DESC 
+                LIMIT %s
+            """, (user_id, limit))
+            return cursor.fetchall()
+        
+        rows = self.router.read(query)
+        return [
+            (sentiment, intent, timestamp.hour if timestamp else None)
+            for sentiment, intent, timestamp in reversed(rows)
+        ]
     
     def get_response_by_keyword(self, keywords):
-        """キーワードに基づいて応答を取得"""
-        try:
-            with self.get_connection() as conn:
-                cursor = conn.cursor(cursor_factory=RealDictCursor)
-                
-                for keyword in keywords:
-                    cursor.execute("""
-                        SELECT response FROM knowledge_base 
-                        WHERE keyword ILIKE %s 
-                        ORDER BY confidence DESC 
-                        LIMIT 1
-                    """, (f'%{keyword}%',))
-                    
-                    result = cursor.fetchone()
-                    if result:
-                        return result['response']
-        except Exception as e:
-            print(f"キーワード応答取得エラー: {e}")
+        """キーワードに基づいて応答を取得（知識ベースのn-gramインデックスを使用）"""
+        row = self.catalog.get().knowledge_index.lookup(keywords)
+        if row:
+            return row['response']
         
         return None
     
     def get_response(self, user_message, user_id=None):
         """シンプルで正確な応答生成"""
-        # テキスト解析
-        keywords = self.analyzer.extract_keywords(user_message)
-        sentiment = self.analyzer.analyze_sentiment(user_message)
-        
-        # インテント分類
+        # テキスト解析・感情分析・インテント分類（同じ文面の結果はキャッシュから再利用）
         intents_data = self.get_intents_data()
-        intent = self.analyzer.classify_intent(user_message, intents_data)
+        keywords, sentiment, intent = self.analyzer.analyze_turn(user_message, intents_data)
         
-        print(f"分析結果 - メッセージ: '{user_message}', キーワード: {keywords}, 感情: {sentiment}, 意図: {intent}")
+        turn_log = turn_logger.isEnabledFor(logging.DEBUG) and {
+            'user_id': user_id, 'user_message': user_message, 'keywords': keywords,
+            'sentiment': sentiment, 'intent': intent
+        }
         
         # 応答生成の優先順位
         # 1. 明確にマッチしたインテントベースの応答
         if intent != 'unknown':
             response = self.get_simple_response_by_intent(intent)
             if response:
-                print(f"インテント応答: {response}")
+                self._log_turn(turn_log, 'intent', response)
                 return response, sentiment, intent
         
         # 2. キーワードベースの応答
         response = self.get_response_by_keyword(keywords)
         if response:
-            print(f"キーワード応答: {response}")
+            self._log_turn(turn_log, 'keyword', response)
             return response, sentiment, intent
         
-        # 3. 感情に基づくシンプルな応答
+        # 3. TF-IDF類似検索による応答（どのインテントにも当てはまらない場合）
+        if intent == 'unknown':
+            matches = self.analyzer.retrieve([user_message])[0]
+            if matches and matches[0]['score'] >= RETRIEVAL_MIN_SCORE:
+                response = random.choice(matches[0]['responses'])
+                self._log_turn(turn_log, 'retrieval', response, score=round(matches[0]['score'], 3))
+                return response, sentiment, intent
+        
+        # 4. 感情に基づくシンプルな応答
         if sentiment == 'positive':
             response = "それは素晴らしいですね！"
         elif sentiment == 'negative':
             response = "大変でしたね。お疲れさまです。"
         else:
-            # 4. デフォルト応答
+            # 5. デフォルト応答
             response = "なるほど、そうなんですね。もう少し詳しく教えてください。"
         
-        print(f"デフォルト応答: {response}")
+        self._log_turn(turn_log, 'sentiment' if sentiment != 'neutral' else 'default', response)
         return response, sentiment, intent
     
+    @staticmethod
+    def _log_turn(turn_log, source, response, **fields):
+        """応答生成の結果を1行のデバッグログに出力（DEBUGが無効なら何もしない）"""
+        if turn_log:
+            turn_logger.debug("応答生成: %s", source, extra={'fields': dict(
+                turn_log, source=source, response=response, **fields
+            )})
+    
     def get_simple_response_by_intent(self, intent):
         """インテントに基づくシンプルな応答"""
-        try:
-            with self.get_connection() as conn:
-                cursor = conn.cursor(cursor_factory=RealDictCursor)
-                cursor.execute("SELECT responses FROM intents WHERE intent_name = %s", (intent,))
-                result = cursor.fetchone()
-                
-                if result and result['responses']:
-                    # ランダムに1つ選択（コンテキスト強化なし）
-                    return random.choice(result['responses'])
-        except Exception as e:
-            print(f"インテント応答取得エラー: {e}")
+        responses = self.catalog.get().responses.get(intent)
+        if responses:
+            # ランダムに1つ選択（コンテキスト強化なし）
+            return random.choice(responses)
         
         return None
     
@@ -601,60 +3057,503 @@ class ChatBot:
         
         return response
     
-    def get_conversation_history(self, user_id, limit=10):
-        try:
-            with self.get_connection() as conn:
-                cursor = conn.cursor(cursor_factory=RealDictCursor)
+    def get_conversation_history(self, user_id, limit=10, before=None, since=None, min_turn_id=None):
+        """会話履歴を新しい順に取得（キーセット方式のページング、レプリカから読む）
+        
+        before: (timestamp, id) より古い会話を取得
+        since: (timestamp, id) より新しい会話を古い方から最大limit件取得
+        min_turn_id: この id の会話がまだ反映されていないレプリカは使わない
+        timestamp 単独の条件も付けて、対象外の月のパーティションを読まないようにする
+        """
+        def query(conn):
+            cursor = conn.cursor(cursor_factory=RealDictCursor)
+            if since is not None:
+                cursor.execute("""
+                    SELECT id, user_message, bot_response, timestamp, sentiment, intent
+                    FROM conversations 
+                    WHERE user_id = %s AND timestamp >= %s AND (timestamp, id) > (%s, %s)
+                    ORDER BY timestamp ASC, id ASC 
+                    LIMIT %s
+                """, (user_id, since[0], since[0], since[1], limit))
+                return list(reversed(cursor.fetchall()))
+            
+            if before is not None:
+                cursor.execute("""
+                    SELECT id, user_message, bot_response, timestamp, sentiment, intent
+                    FROM conversations 
+                    WHERE user_id = %s AND timestamp <= %s AND (timestamp, id) < (%s, %s)
+                    ORDER BY timestamp DESC, id DESC 
+                    LIMIT %s
+                """, (user_id, before[0], before[0], before[1], limit))
+            else:
                 cursor.execute("""
-                    SELECT user_message, bot_response, timestamp, sentiment, intent
+                    SELECT id, user_message, bot_response, timestamp, sentiment, intent
                     FROM conversations 
                     WHERE user_id = %s 
-                    ORDER BY timestamp DESC 
+                    ORDER BY timestamp DESC, id DESC 
                     LIMIT %s
                 """, (user_id, limit))
-                
-                return cursor.fetchall()
+            
+            return cursor.fetchall()
+        
+        try:
+            return self.router.read(query, user_id=user_id, min_turn_id=min_turn_id)
         except Exception as e:
-            print(f"履歴取得エラー: {e}")
+            logger.error("履歴取得エラー: %s", e)
             return []
     
-    def get_analytics(self, user_id):
-        """ユーザーの会話分析データを取得"""
+    def get_latest_turn(self, user_id, min_turn_id=None):
+        """ユーザーの最新の会話の (timestamp, id) を取得（履歴の変更検知用、レプリカから読む）"""
+        def query(conn):
+            cursor = conn.cursor()
+            cursor.execute("""
+                SELECT timestamp, id
+                FROM conversations 
+                WHERE user_id = %s 
+                ORDER BY timestamp DESC, id DESC 
+                LIMIT 1
+            """, (user_id,))
+            return cursor.fetchone()
+        
+        return self.router.read(query, user_id=user_id, min_turn_id=min_turn_id)
+    
+    def get_analytics(self, user_id, min_turn_id=None):
+        """ユーザーの会話分析データを取得（トリガーで更新される集計テーブルから、レプリカから読む）"""
+        def query(conn):
+            cursor = conn.cursor(cursor_factory=RealDictCursor)
+            cursor.execute("""
+                SELECT kind, label, count
+                FROM user_analytics
+                WHERE user_id = %s AND count > 0
+            """, (user_id,))
+            return cursor.fetchall()
+        
         try:
-            with self.get_connection() as conn:
-                cursor = conn.cursor(cursor_factory=RealDictCursor)
+            rows = self.router.read(query, user_id=user_id, min_turn_id=min_turn_id)
+            
+            # 感情分析
+            sentiment_data = [
+                {'sentiment': row['label'], 'count': row['count']}
+                for row in rows if row['kind'] == 'sentiment'
+            ]
+            
+            # インテント分析（上位5件）
+            intent_rows = sorted(
+                (row for row in rows if row['kind'] == 'intent'),
+                key=lambda row: row['count'], reverse=True
+            )
+            intent_data = [{'intent': row['label'], 'count': row['count']} for row in intent_rows[:5]]
+            
+            return {
+                'sentiment_analysis': sentiment_data,
+                'top_intents': intent_data
+            }
+        except Exception as e:
+            logger.error("分析データ取得エラー: %s", e)
+            return {'sentiment_analysis': [], 'top_intents': []}
+    
+    def backfill_analytics(self, user_id=None):
+        """会話履歴から集計テーブルを作り直す（user_id指定時はそのユーザーのみ）"""
+        user_filter = "AND user_id = %(user_id)s" if user_id else ""
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            # 集計中に会話が追加されて数がずれないよう、書き込みを一時的に止める
+            cursor.execute("LOCK TABLE conversations IN SHARE MODE")
+            if user_id:
+                cursor.execute("DELETE FROM user_analytics WHERE user_id = %(user_id)s", {'user_id': user_id})
+            else:
+                cursor.execute("TRUNCATE user_analytics")
+            cursor.execute(f"""
+                INSERT INTO user_analytics (user_id, kind, label, count)
+                SELECT user_id, 'sentiment', sentiment, COUNT(*)
+                FROM conversations
+                WHERE sentiment IS NOT NULL {user_filter}
+                GROUP BY user_id, sentiment
+                UNION ALL
+                SELECT user_id, 'intent', intent, COUNT(*)
+                FROM conversations
+                WHERE intent IS NOT NULL {user_filter}
+                GROUP BY user_id, intent
+            """, {'user_id': user_id})
+            return cursor.rowcount
+    
+    def reanalyze_conversations(self, job_name='default', batch_size=1000, workers=ANALYZE_BATCH_WORKERS,
+                                max_rows_per_sec=0, restart=False, dry_run=False, progress=None):
+        """保存済みの会話の sentiment / intent を現在の解析器で判定し直し、変わった行だけ更新する
+        
+        名前付き（サーバー側）カーソルで id 順に batch_size 行ずつ読み、プロセスプールで
+        判定して1回の UPDATE で書き戻す。書き戻しと同じトランザクションで処理済みの id を
+        reanalysis_checkpoints に記録するため、中断しても同じ job_name で続きから再開できる。
+        対象は最初に開始した時点の最大 id まで（それ以降の会話は応答時に判定済み）。
+        max_rows_per_sec を指定すると読み込みの速度をその値以下に抑える。
+        progress にはバッチごとに途中経過の辞書を渡す。
+        """
+        intents_data = self.get_intents_data()
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            if restart and not dry_run:
+                cursor.execute("DELETE FROM reanalysis_checkpoints WHERE job_name = %s", (job_name,))
+            cursor.execute("""
+                SELECT last_id, end_id FROM reanalysis_checkpoints WHERE job_name = %s
+            """, (job_name,))
+            checkpoint = None if restart else cursor.fetchone()
+            if checkpoint:
+                last_id, end_id = checkpoint
+            else:
+                cursor.execute("SELECT COALESCE(MAX(id), 0) FROM conversations")
+                last_id, end_id = 0, cursor.fetchone()[0]
+        
+        stats = {
+            'job_name': job_name,
+            'resumed_from': last_id,
+            'last_id': last_id,
+            'end_id': end_id,
+            'scanned': 0,
+            'updated': 0,
+            'elapsed': 0.0,
+        }
+        start = time.monotonic()
+        with self.get_connection() as read_conn:
+            batches = self._iter_conversation_batches(read_conn, last_id, end_id, batch_size)
+            for batch, changed in self.analyzer.reanalyze_batches(batches, intents_data, workers):
+                stats['scanned'] += len(batch)
+                stats['last_id'] = batch[-1][0]
+                if not dry_run:
+                    stats['updated'] += self._write_reanalysis(job_name, stats, len(batch), changed)
+                else:
+                    stats['updated'] += len(changed)
                 
-                # 感情分析
+                if max_rows_per_sec > 0:
+                    delay = start + stats['scanned'] / max_rows_per_sec - time.monotonic()
+                    if delay > 0:
+                        time.sleep(delay)
+                stats['elapsed'] = time.monotonic() - start
+                if progress:
+                    progress(dict(stats))
+        stats['elapsed'] = time.monotonic() - start
+        return stats
+    
+    def _iter_conversation_batches(self, conn, last_id, end_id, batch_size, batches_per_cursor=10):
+        """id が (last_id, end_id] の会話を id 順に batch_size 行ずつ名前付きカーソルで読む
+        
+        batches_per_cursor バッチごとにカーソルを閉じてコミットする。1つのスナップショットを
+        ジョブの間ずっと保持すると、更新で生じた古い行（トリガーで何度も更新される
+        user_analytics を含む）が回収されず、後半ほど UPDATE が遅くなるため。
+        """
+        segment_rows = batch_size * batches_per_cursor
+        while last_id < end_id:
+            rows = 0
+            with conn.cursor(name='reanalyze_conversations') as reader:
+                reader.itersize = batch_size
+                reader.execute("""
+                    SELECT id, timestamp, user_message, sentiment, intent
+                    FROM conversations
+                    WHERE id > %s AND id <= %s
+                    ORDER BY id
+                    LIMIT %s
+                """, (last_id, end_id, segment_rows))
+                for batch in iter(lambda: reader.fetchmany(batch_size), []):
+                    rows += len(batch)
+                    last_id = batch[-1][0]
+                    yield batch
+            conn.commit()
+            if rows < segment_rows:
+                return
+    
+    def _write_reanalysis(self, job_name, stats, scanned, changed):
+        """再判定の結果とチェックポイントを1トランザクションで書き込む（更新した行数を返す）"""
+        with self.get_connection() as conn:
+            with conn.cursor() as cursor:
+                updated = 0
+                if changed:
+                    # id と timestamp の範囲を定数で渡し、範囲外のパーティションを除外して主キーの索引で引く
+                    # （VALUES との結合だけでは全パーティションを順次走査する）
+                    timestamps = [row[1] for row in changed]
+                    query = sql.SQL("""
+                        UPDATE conversations AS c
+                        SET sentiment = v.sentiment, intent = v.intent
+                        FROM (VALUES %s) AS v (id, timestamp, sentiment, intent)
+                        WHERE c.id = v.id AND c.timestamp = v.timestamp
+                          AND c.id BETWEEN {} AND {}
+                          AND c.timestamp BETWEEN {} AND {}
+                          AND (c.sentiment IS DISTINCT FROM v.sentiment OR c.intent IS DISTINCT FROM v.intent)
+                    """).format(
+                        sql.Literal(changed[0][0]), sql.Literal(changed[-1][0]),
+                        sql.Literal(min(timestamps)), sql.Literal(max(timestamps))
+                    )
+                    execute_values(cursor, query.as_string(conn), changed, page_size=len(changed))
+                    updated = cursor.rowcount
                 cursor.execute("""
-                    SELECT sentiment, COUNT(*) as count
-                    FROM conversations 
-                    WHERE user_id = %s AND sentiment IS NOT NULL
-                    GROUP BY sentiment
-                """, (user_id,))
-                sentiment_data = cursor.fetchall()
-                
-                # インテント分析
+                    INSERT INTO reanalysis_checkpoints AS rc
+                        (job_name, last_id, end_id, rows_scanned, rows_updated, updated_at)
+                    VALUES (%(job_name)s, %(last_id)s, %(end_id)s, %(scanned)s, %(updated)s, CURRENT_TIMESTAMP)
+                    ON CONFLICT (job_name) DO UPDATE SET
+                        last_id = EXCLUDED.last_id,
+                        rows_scanned = rc.rows_scanned + EXCLUDED.rows_scanned,
+                        rows_updated = rc.rows_updated + EXCLUDED.rows_updated,
+                        updated_at = EXCLUDED.updated_at
+                """, {
+                    'job_name': job_name, 'last_id': stats['last_id'], 'end_id': stats['end_id'],
+                    'scanned': scanned, 'updated': updated,
+                })
+                return updated
+    
+    def ensure_partitions(self, months_ahead=CONVERSATION_PARTITION_MONTHS_AHEAD):
+        """今月から months_ahead か月先までの会話パーティションを作成（作成数を返す）"""
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT ensure_conversation_partitions(%s)", (months_ahead,))
+            return cursor.fetchone()[0]
+    
+    def start_partition_maintenance(self, interval=CONVERSATION_PARTITION_CHECK_INTERVAL):
+        """ワーカープロセスごとに、先の月のパーティションを定期的に作成するスレッドを起動
+        
+        長時間動くワーカーでも常に CONVERSATION_PARTITION_MONTHS_AHEAD か月先までのパーティションがあり、
+        新しい会話が conversations_default に溜まらないようにする（関数内のロックで他のワーカーとは直列化）。
+        """
+        if interval <= 0 or self._partition_pid == os.getpid():
+            return
+        with self._partition_lock:
+            if self._partition_pid == os.getpid():
+                return
+            self._partition_pid = os.getpid()
+            thread = threading.Thread(target=self._partition_loop, args=(interval,),
+                                      name='partition-maintenance', daemon=True)
+            thread.start()
+    
+    def _partition_loop(self, interval):
+        while True:
+            time.sleep(interval)
+            try:
+                created = self.ensure_partitions()
+                if created:
+                    logger.info("会話パーティションを %d 件作成しました", created)
+            except Exception as e:
+                logger.warning("会話パーティションの作成に失敗しました: %s", e)
+    
+    def list_partitions(self):
+        """月別パーティションを (テーブル名, 月初日) の古い順で取得（既定パーティションは除く）"""
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("""
+                SELECT c.relname
+                FROM pg_inherits i
+                JOIN pg_class c ON c.oid = i.inhrelid
+                WHERE i.inhparent = 'conversations'::regclass
+                  AND c.relname ~ '^conversations_[0-9]{4}_[0-9]{2}$'
+                ORDER BY c.relname
+            """)
+            return [
+                (name, datetime.strptime(name[len('conversations_'):], '%Y_%m').date())
+                for name, in cursor.fetchall()
+            ]
+    
+    def iter_conversations(self, start=None, end=None, user_ids=None, chunk_rows=EXPORT_CHUNK_ROWS):
+        """条件に合う会話を id 順に chunk_rows 行ずつ名前付き（サーバー側）カーソルで読む
+        
+        start 以上 end 未満の timestamp（範囲外の月のパーティションは読まない）で、
+        user_ids が指定されていればそのいずれかのユーザーの会話。読み取り用レプリカがあれば
+        レプリカで読む。1つのスナップショットで読むため、読み始めた後に追加された会話は含まない。
+        """
+        conditions = []
+        params = {}
+        if start is not None:
+            conditions.append("timestamp >= %(start)s")
+            params['start'] = start
+        if end is not None:
+            conditions.append("timestamp < %(end)s")
+            params['end'] = end
+        if user_ids:
+            conditions.append("user_id = ANY(%(user_ids)s)")
+            params['user_ids'] = list(user_ids)
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+        
+        with self.router.connection() as conn:
+            with conn.cursor(name='export_conversations') as reader:
+                reader.itersize = chunk_rows
+                reader.execute(f"""
+                    SELECT {', '.join(EXPORT_COLUMNS)}
+                    FROM conversations
+                    {where}
+                    ORDER BY id, timestamp
+                """, params)
+                yield from iter(lambda: reader.fetchmany(chunk_rows), [])
+    
+    def export_conversations(self, output_dir, fmt='csv', start=None, end=None, user_ids=None,
+                             chunk_rows=EXPORT_CHUNK_ROWS, file_rows=EXPORT_FILE_ROWS, progress=None):
+        """条件に合う会話を output_dir に CSV / Parquet で書き出す（file_rows 行ごとに別のファイル）
+        
+        ファイル名は conversations-00000.csv のような連番。書き出し中のファイルには .tmp を付け、
+        書き終えてから名前を変える（該当する会話がなくても空のファイルを1つ作る）。
+        progress にはチャンクごとに途中経過の辞書を渡す。
+        """
+        ConversationEncoder(fmt)  # 読み始める前に形式を検証
+        file_rows = max(1, file_rows)
+        os.makedirs(output_dir, exist_ok=True)
+        stats = {'rows': 0, 'bytes': 0, 'files': [], 'elapsed': 0.0}
+        current = {}
+        
+        def write(data):
+            current['file'].write(data)
+            stats['bytes'] += len(data)
+        
+        def open_file():
+            current['encoder'] = encoder = ConversationEncoder(fmt)
+            current['path'] = os.path.join(output_dir, f"conversations-{len(stats['files']):05d}{encoder.extension}")
+            current['file'] = open(f"{current['path']}.tmp", 'wb')
+            current['rows'] = 0
+            write(encoder.begin())
+        
+        def close_file():
+            write(current['encoder'].finish())
+            current.pop('file').close()
+            os.replace(f"{current['path']}.tmp", current['path'])
+            stats['files'].append(current['path'])
+        
+        started = time.monotonic()
+        try:
+            for rows in self.iter_conversations(start, end, user_ids, chunk_rows):
+                while rows:
+                    if 'file' not in current:
+                        open_file()
+                    part = rows[:file_rows - current['rows']]
+                    rows = rows[len(part):]
+                    write(current['encoder'].write(part))
+                    current['rows'] += len(part)
+                    stats['rows'] += len(part)
+                    if current['rows'] >= file_rows:
+                        close_file()
+                stats['elapsed'] = time.monotonic() - started
+                if progress:
+                    progress(dict(stats))
+            if 'file' not in current and not stats['files']:
+                open_file()
+            if 'file' in current:
+                close_file()
+        finally:
+            # 途中で失敗したファイルは残さない
+            if 'file' in current:
+                current.pop('file').close()
+                os.remove(f"{current['path']}.tmp")
+        stats['elapsed'] = time.monotonic() - started
+        return stats
+    
+    def archive_partition(self, name, drop=False, export_path=None):
+        """パーティションを切り離して archive スキーマへ移す（drop=True なら削除）
+        
+        export_path を指定すると、切り離す前に CSV で書き出す。
+        user_analytics の集計は切り離した会話の分も含めたまま残る。
+        """
+        table = sql.Identifier(name)
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(sql.SQL("SELECT COUNT(*) FROM {}").format(table))
+            rows = cursor.fetchone()[0]
+            if export_path:
+                with open(export_path, 'w', encoding='utf-8', newline='') as f:
+                    cursor.copy_expert(
+                        sql.SQL("COPY (SELECT * FROM {} ORDER BY timestamp, id) TO STDOUT WITH CSV HEADER").format(table), f
+                    )
+            cursor.execute(sql.SQL("ALTER TABLE conversations DETACH PARTITION {}").format(table))
+            if drop:
+                cursor.execute(sql.SQL("DROP TABLE {}").format(table))
+            else:
+                cursor.execute("CREATE SCHEMA IF NOT EXISTS archive")
+                cursor.execute(sql.SQL("ALTER TABLE {} SET SCHEMA archive").format(table))
+        return rows
+    
+    def load_catalog(self, intents_path=None, knowledge_path=None, replace=False, dry_run=False):
+        """CSV/JSONLからインテント・知識ベースを1トランザクションで一括読み込み
+        
+        検証済みの行をCOPYで一時テーブルに流し込んでから本テーブルへ反映する。
+        不正な行が1件でもあれば何も反映せずに CatalogValidationError を送出する。
+        intents は intent_name ごとに上書き（ファイル内で重複した場合は後の行）、
+        knowledge_base はファイルに含まれるキーワードの行を入れ替える。
+        replace=True ならファイルに含まれない行を削除する。
+        コミット時に通知トリガーが発火し、各ワーカーがマッチャーと索引を作り直す。
+        """
+        start = time.monotonic()
+        result = {'intents': 0, 'knowledge': 0}
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            if intents_path:
                 cursor.execute("""
-                    SELECT intent, COUNT(*) as count
-                    FROM conversations 
-                    WHERE user_id = %s AND intent IS NOT NULL
-                    GROUP BY intent
-                    ORDER BY count DESC
-                    LIMIT 5
-                """, (user_id,))
-                intent_data = cursor.fetchall()
-                
-                return {
-                    'sentiment_analysis': sentiment_data,
-                    'top_intents': intent_data
-                }
-        except Exception as e:
-            print(f"分析データ取得エラー: {e}")
-            return {'sentiment_analysis': [], 'top_intents': []}
+                    CREATE TEMP TABLE intents_staging (
+                        line_no INTEGER, intent_name TEXT, patterns JSONB, responses JSONB
+                    ) ON COMMIT DROP
+                """)
+                stream = _CopyStream(_iter_catalog_file(intents_path), _validate_intent_row)
+                cursor.copy_expert("COPY intents_staging FROM STDIN", stream)
+                if stream.error_count:
+                    raise CatalogValidationError(stream.errors, stream.error_count)
+                if replace:
+                    cursor.execute("""
+                        DELETE FROM intents
+                        WHERE intent_name NOT IN (SELECT intent_name FROM intents_staging)
+                    """)
+                cursor.execute("""
+                    INSERT INTO intents (intent_name, patterns, responses)
+                    SELECT DISTINCT ON (intent_name) intent_name,
+                           ARRAY(SELECT jsonb_array_elements_text(patterns)),
+                           ARRAY(SELECT jsonb_array_elements_text(responses))
+                    FROM intents_staging
+                    ORDER BY intent_name, line_no DESC
+                    ON CONFLICT (intent_name) DO UPDATE SET
+                        patterns = EXCLUDED.patterns,
+                        responses = EXCLUDED.responses
+                """)
+                result['intents'] = stream.rows
+            if knowledge_path:
+                cursor.execute("""
+                    CREATE TEMP TABLE knowledge_staging (
+                        line_no INTEGER, keyword TEXT, response TEXT, confidence REAL, category TEXT
+                    ) ON COMMIT DROP
+                """)
+                stream = _CopyStream(_iter_catalog_file(knowledge_path), _validate_knowledge_row)
+                cursor.copy_expert("COPY knowledge_staging FROM STDIN", stream)
+                if stream.error_count:
+                    raise CatalogValidationError(stream.errors, stream.error_count)
+                if replace:
+                    cursor.execute("DELETE FROM knowledge_base")
+                else:
+                    cursor.execute("""
+                        DELETE FROM knowledge_base
+                        WHERE keyword IN (SELECT keyword FROM knowledge_staging)
+                    """)
+                cursor.execute("""
+                    INSERT INTO knowledge_base (keyword, response, confidence, category)
+                    SELECT keyword, response, confidence, category
+                    FROM knowledge_staging
+                    ORDER BY line_no
+                """)
+                result['knowledge'] = stream.rows
+            if dry_run:
+                conn.rollback()
+        result['elapsed'] = time.monotonic() - start
+        return result
 
 # チャットボットインスタンス
 chatbot = ChatBot()
 
+def warm_up():
+    """初回リクエストで発生する重い初期化を事前に実行（辞書・感情辞書・カタログ・マッチャー・TF-IDFモデル）"""
+    start = time.monotonic()
+    get_tokenizer()
+    chatbot.analyzer.vectorizer
+    chatbot.analyzer.compile_sentiment_lexicon()
+    chatbot.catalog.get()
+    try:
+        created = chatbot.ensure_partitions()
+        if created:
+            logger.info("会話パーティションを %d 件作成しました", created)
+    except Exception as e:
+        logger.warning("会話パーティションの作成に失敗しました: %s", e)
+    chatbot.start_partition_maintenance()
+    # 辞書やモデルなど起動時に作った長寿命のオブジェクトをGCの走査対象から外す
+    # （カタログ差し替え時の世代別GCで全オブジェクトを走査して応答が止まるのを防ぐ）
+    gc.freeze()
+    logger.info("ウォームアップ完了（%.2f秒）", time.monotonic() - start)
+
 @app.route('/')
 def index():
     # セッションIDを生成
@@ -665,7 +3564,69 @@ def index():
     
     return render_template('chat.html')
 
+admission_limiters = {
+    name: AdmissionLimiter(name, concurrency, queue, ADMISSION_QUEUE_TIMEOUT, ADMISSION_RETRY_AFTER)
+    for name, concurrency, queue in (
+        ('chat', ADMISSION_CHAT_CONCURRENCY, ADMISSION_CHAT_QUEUE),
+        ('history', ADMISSION_HISTORY_CONCURRENCY, ADMISSION_HISTORY_QUEUE),
+        ('analytics', ADMISSION_ANALYTICS_CONCURRENCY, ADMISSION_ANALYTICS_QUEUE),
+        ('export', ADMISSION_EXPORT_CONCURRENCY, ADMISSION_EXPORT_QUEUE),
+        ('batch', ADMISSION_BATCH_CONCURRENCY, ADMISSION_BATCH_QUEUE),
+    )
+}
+
+def overloaded_response(error):
+    """混雑時の応答（503 と Retry-After）"""
+    response = jsonify({
+        'error': '混雑しています。しばらくしてから再度お試しください',
+        'retry_after': error.retry_after
+    })
+    response.status_code = 503
+    response.headers['Retry-After'] = str(error.retry_after)
+    return response
+
+def admission_control(name):
+    """ビューを admission_limiters[name] の実行枠の中で実行し、受け付けられなければ503を返す"""
+    limiter = admission_limiters[name]
+    
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            try:
+                limiter.acquire()
+            except OverloadedError as e:
+                return overloaded_response(e)
+            try:
+                return view(*args, **kwargs)
+            finally:
+                limiter.release()
+        return wrapper
+    return decorator
+
+def handle_chat_turn(user_id, session_id, user_message):
+    """1往復分のチャット処理（応答生成と保存）。/chat と /chat/ws で共通
+    
+    (応答のJSON, 保存した会話のid) を返す（非同期保存ではidはNone）
+    """
+    # AI分析とボットの応答を取得（ユーザーIDを含む）
+    bot_response, sentiment, intent = chatbot.get_response(user_message, user_id)
+    
+    # 会話を保存
+    turn_id = chatbot.save_conversation(user_id, user_message, bot_response, session_id, sentiment, intent)
+    
+    return {
+        'response': bot_response,
+        'sentiment': sentiment,
+        'intent': intent,
+        'timestamp': datetime.now().isoformat()
+    }, turn_id
+
+def tracks_own_writes():
+    """自分の書き込みを読む保証が必要か（レプリカを使う場合のみ）"""
+    return DB_READ_YOUR_WRITES and bool(chatbot.router.replicas)
+
 @app.route('/chat', methods=['POST'])
+@admission_control('chat')
 def chat():
     try:
         data = request.get_json()
@@ -678,68 +3639,521 @@ def chat():
         user_id = session.get('user_id', 'anonymous_user')
         session_id = session.get('session_id', 'default_session')
         
-        # AI分析とボットの応答を取得（ユーザーIDを含む）
-        bot_response, sentiment, intent = chatbot.get_response(user_message, user_id)
-        
-        print(f"保存データ: user_id={user_id}, message='{user_message}', response='{bot_response}', sentiment={sentiment}, intent={intent}")
-        
-        # 会話を保存
-        chatbot.save_conversation(user_id, user_message, bot_response, session_id, sentiment, intent)
-        
-        return jsonify({
-            'response': bot_response,
-            'sentiment': sentiment,
-            'intent': intent,
-            'timestamp': datetime.now().isoformat()
-        })
+        result, turn_id = handle_chat_turn(user_id, session_id, user_message)
+        if turn_id and tracks_own_writes():
+            # どのワーカーで履歴・分析を読んでも、この会話が反映されていないレプリカを使わない
+            session['last_turn_id'] = turn_id
+        return jsonify(result)
         
     except Exception as e:
-        print(f"チャットエラー: {e}")
+        logger.exception("チャットエラー: %s", e)
         return jsonify({'error': 'サーバーエラーが発生しました'}), 500
 
+class ChatStreamStats:
+    """WebSocket接続の統計（ワーカー単位）"""
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.open = 0
+        self.opened = 0
+        self.messages = 0
+        self.errors = 0
+    
+    def connected(self):
+        with self._lock:
+            self.open += 1
+            self.opened += 1
+    
+    def disconnected(self):
+        with self._lock:
+            self.open -= 1
+    
+    def count(self, name):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + 1)
+    
+    def get_stats(self):
+        with self._lock:
+            return {
+                'open_connections': self.open,
+                'opened': self.opened,
+                'messages': self.messages,
+                'errors': self.errors
+            }
+
+chat_stream_stats = ChatStreamStats()
+
+def _ws_send(ws, event_type, **payload):
+    """イベントをJSONの1フレームとして送信"""
+    ws.send(json.dumps(dict(payload, type=event_type), ensure_ascii=False))
+
+def _ws_send_history(ws, user_id, since_token, min_turn_id=None):
+    """since カーソル以降の会話（履歴の差分）を送信"""
+    since = decode_history_cursor(since_token) if since_token else (datetime.min, 0)
+    conversations = chatbot.get_conversation_history(
+        user_id, HISTORY_MAX_PAGE_SIZE, since=since, min_turn_id=min_turn_id
+    )
+    if not conversations and since_token:
+        return
+    _ws_send(
+        ws, 'history',
+        conversations=[serialize_conversation(conv) for conv in conversations],
+        latest=encode_history_cursor(conversations[0]['timestamp'], conversations[0]['id'])
+        if conversations else None,
+        has_more_newer=len(conversations) == HISTORY_MAX_PAGE_SIZE
+    )
+
+@sock.route('/chat/ws')
+def chat_ws(ws):
+    """常時接続のチャット（応答・分析・履歴の差分を同じ接続で送信）
+    
+    クライアント → サーバー:
+      {"type": "message", "message": "...", "since": "<履歴カーソル>"}
+      {"type": "sync", "since": "<履歴カーソル>"}
+      {"type": "analytics"}
+    サーバー → クライアント:
+      ready / response / history / analytics / error
+    """
+    # セッションCookieは接続時に1回だけ読む
+    user_id = session.get('user_id', 'anonymous_user')
+    session_id = session.get('session_id', 'default_session')
+    # 接続はワーカーに固定されるため、自分の最新の会話の id は接続内で覚えておく
+    last_turn_id = session.get('last_turn_id') if tracks_own_writes() else None
+    chat_stream_stats.connected()
+    try:
+        _ws_send(ws, 'ready', user_id=user_id)
+        while True:
+            raw = ws.receive()
+            try:
+                try:
+                    event = json.loads(raw)
+                except ValueError:
+                    event = None
+                if not isinstance(event, dict):
+                    raise ValueError('イベントはJSONオブジェクトで送信してください')
+                event_type = event.get('type')
+                if event_type == 'message':
+                    user_message = str(event.get('message', '')).strip()
+                    if not user_message:
+                        raise ValueError('メッセージが空です')
+                    chat_stream_stats.count('messages')
+                    with admission_limiters['chat'].slot():
+                        result, turn_id = handle_chat_turn(user_id, session_id, user_message)
+                    if turn_id and tracks_own_writes():
+                        last_turn_id = turn_id
+                    _ws_send(ws, 'response', **result)
+                    if 'since' in event:
+                        with admission_limiters['history'].slot():
+                            _ws_send_history(ws, user_id, event['since'], last_turn_id)
+                elif event_type == 'sync':
+                    with admission_limiters['history'].slot():
+                        _ws_send_history(ws, user_id, event.get('since'), last_turn_id)
+                elif event_type == 'analytics':
+                    with admission_limiters['analytics'].slot():
+                        result = chatbot.get_analytics(user_id, min_turn_id=last_turn_id)
+                    _ws_send(ws, 'analytics', **result)
+                else:
+                    raise ValueError(f"不明なイベントです: {event_type}")
+            except OverloadedError as e:
+                _ws_send(ws, 'error', error='混雑しています。しばらくしてから再度お試しください',
+                         retry_after=e.retry_after)
+            except ValueError as e:
+                _ws_send(ws, 'error', error=str(e))
+            except ConnectionClosed:
+                raise
+            except Exception as e:
+                logger.exception("チャット接続エラー: %s", e)
+                chat_stream_stats.count('errors')
+                _ws_send(ws, 'error', error='サーバーエラーが発生しました')
+    except ConnectionClosed:
+        pass
+    finally:
+        chat_stream_stats.disconnected()
+
+def serialize_conversation(conv):
+    """履歴の1件をJSON用の辞書に変換"""
+    return {
+        'user_message': conv['user_message'],
+        'bot_response': conv['bot_response'],
+        'sentiment': conv['sentiment'],
+        'intent': conv['intent'],
+        'timestamp': conv['timestamp'].isoformat()
+    }
+
+def encode_history_cursor(timestamp, conversation_id):
+    """会話の位置 (timestamp, id) をURLで使えるカーソル文字列に変換"""
+    raw = f"{timestamp.isoformat()}|{conversation_id}".encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+def decode_history_cursor(token):
+    """カーソル文字列を (timestamp, id) に戻す（不正な場合はValueError）"""
+    try:
+        raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4)).decode('utf-8')
+        timestamp, conversation_id = raw.split('|')
+        return datetime.fromisoformat(timestamp), int(conversation_id)
+    except Exception:
+        raise ValueError(f"不正なカーソルです: {token}")
+
 @app.route('/history')
+@admission_control('history')
 def history():
+    """会話履歴（before / since カーソルによるページング、ETag / Last-Modified で未変更なら304）"""
     try:
         user_id = session.get('user_id')
-        conversations = chatbot.get_conversation_history(user_id)
+        try:
+            limit = min(max(int(request.args.get('limit', HISTORY_PAGE_SIZE)), 1), HISTORY_MAX_PAGE_SIZE)
+            before = request.args.get('before')
+            since = request.args.get('since')
+            before = decode_history_cursor(before) if before else None
+            since = decode_history_cursor(since) if since else None
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        if before and since:
+            return jsonify({'error': 'before と since は同時に指定できません'}), 400
         
-        return jsonify({
-            'conversations': [
-                {
-                    'user_message': conv['user_message'],
-                    'bot_response': conv['bot_response'],
-                    'sentiment': conv['sentiment'],
-                    'intent': conv['intent'],
-                    'timestamp': conv['timestamp'].isoformat()
-                } for conv in conversations
-            ]
-        })
+        # 最新の会話が変わっていなければページの内容も変わらない
+        min_turn_id = session.get('last_turn_id') if tracks_own_writes() else None
+        latest = chatbot.get_latest_turn(user_id, min_turn_id=min_turn_id)
+        latest_token = encode_history_cursor(*latest) if latest else ''
+        etag = hashlib.sha1(
+            f"{user_id}|{latest_token}|{request.args.get('before', '')}|{request.args.get('since', '')}|{limit}".encode('utf-8')
+        ).hexdigest()
+        if request.if_none_match:
+            not_modified = request.if_none_match.contains(etag)
+        else:
+            # If-None-Match が無い場合は日時で再検証する（HTTPの日時は秒単位のため、秒未満を切り捨てて比較）
+            not_modified = bool(
+                latest and request.if_modified_since
+                and latest[0].replace(microsecond=0, tzinfo=timezone.utc) <= request.if_modified_since
+            )
+        if not_modified:
+            response = Response(status=304)
+        else:
+            conversations = chatbot.get_conversation_history(
+                user_id, limit, before=before, since=since, min_turn_id=min_turn_id
+            )
+            oldest = conversations[-1] if conversations else None
+            response = jsonify({
+                'conversations': [serialize_conversation(conv) for conv in conversations],
+                # 古い会話を続けて読む場合は before に、新しい会話だけ取得する場合は since に指定
+                'next_before': (
+                    encode_history_cursor(oldest['timestamp'], oldest['id'])
+                    if oldest and len(conversations) == limit and since is None else None
+                ),
+                'latest': encode_history_cursor(conversations[0]['timestamp'], conversations[0]['id'])
+                if conversations else request.args.get('since') or None,
+                'has_more_newer': since is not None and len(conversations) == limit
+            })
+        
+        response.set_etag(etag)
+        if latest:
+            response.last_modified = latest[0]
+        response.headers['Cache-Control'] = 'private, no-cache'
+        return response
         
     except Exception as e:
-        print(f"履歴取得エラー: {e}")
+        logger.error("履歴取得エラー: %s", e)
         return jsonify({'error': '履歴の取得に失敗しました'}), 500
 
 @app.route('/analytics')
+@admission_control('analytics')
 def analytics():
     try:
         user_id = session.get('user_id')
-        analytics_data = chatbot.get_analytics(user_id)
+        min_turn_id = session.get('last_turn_id') if tracks_own_writes() else None
+        analytics_data = chatbot.get_analytics(user_id, min_turn_id=min_turn_id)
         
         return jsonify(analytics_data)
         
     except Exception as e:
-        print(f"分析データ取得エラー: {e}")
+        logger.error("分析データ取得エラー: %s", e)
         return jsonify({'error': '分析データの取得に失敗しました'}), 500
 
+def _iter_ndjson_texts(stream):
+    """NDJSONの各行からテキストを取り出す（文字列または {"text": ...}）"""
+    for line in stream:
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            item = json.loads(line)
+        except ValueError:
+            yield None
+            continue
+        if isinstance(item, dict):
+            item = item.get('text')
+        yield item
+
+@app.route('/analyze/batch', methods=['POST'])
+def analyze_batch():
+    """メッセージの一括解析（JSON配列またはNDJSONを受け取り、NDJSONで順番に返す）"""
+    if request.mimetype in ('application/x-ndjson', 'application/ndjson', 'application/jsonl'):
+        texts = _iter_ndjson_texts(request.stream)
+    else:
+        data = request.get_json(silent=True)
+        if isinstance(data, dict):
+            data = data.get('texts')
+        if not isinstance(data, list):
+            return jsonify({'error': 'texts（文字列の配列）を指定してください'}), 400
+        texts = data
+    
+    intents_data = chatbot.get_intents_data()
+    
+    # プロセスプールを占有するため同時実行数を絞る。レスポンスを返し終えるまで実行枠を保持する
+    limiter = admission_limiters['batch']
+    try:
+        limiter.acquire()
+    except OverloadedError as e:
+        return overloaded_response(e)
+    
+    def generate():
+        for index, result in enumerate(chatbot.analyzer.analyze_batch(texts, intents_data)):
+            result['index'] = index
+            yield json.dumps(result, ensure_ascii=False) + '\n'
+    
+    response = Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+    response.call_on_close(limiter.release)
+    return response
+
+def _parse_export_time(value):
+    """エクスポートの期間指定（YYYY-MM-DD または ISO 8601 の日時）を datetime に変換"""
+    if not value:
+        return None
+    try:
+        return datetime.fromisoformat(value)
+    except ValueError:
+        raise ValueError(f"日時の形式が正しくありません: {value}（YYYY-MM-DD または ISO 8601）") from None
+
+@app.route('/export/conversations')
+def export_conversations():
+    """会話を CSV / Parquet でストリーミング出力（分析用。Authorization: Bearer EXPORT_TOKEN が必要）"""
+    if not EXPORT_TOKEN:
+        return jsonify({'error': 'エクスポートは無効です（EXPORT_TOKEN が未設定）'}), 404
+    authorization = request.headers.get('Authorization', '')
+    if not hmac.compare_digest(authorization.encode(), f"Bearer {EXPORT_TOKEN}".encode()):
+        return jsonify({'error': '認証に失敗しました'}), 403
+    try:
+        encoder = ConversationEncoder(request.args.get('format', 'csv'))
+        start = _parse_export_time(request.args.get('start'))
+        end = _parse_export_time(request.args.get('end'))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    user_ids = request.args.getlist('user_id')
+    
+    # レスポンスを返し終えるまで実行枠を保持する（ビューから戻った後もストリーミングが続くため）
+    limiter = admission_limiters['export']
+    try:
+        limiter.acquire()
+    except OverloadedError as e:
+        return overloaded_response(e)
+    
+    def generate():
+        rows = size = 0
+        started = time.monotonic()
+        data = encoder.begin()
+        size += len(data)
+        yield data
+        # クライアントが途中で切断した場合もすぐにカーソルを閉じて接続を返す
+        with closing(chatbot.iter_conversations(start, end, user_ids)) as chunks:
+            for chunk in chunks:
+                data = encoder.write(chunk)
+                rows += len(chunk)
+                size += len(data)
+                yield data
+        data = encoder.finish()
+        size += len(data)
+        yield data
+        elapsed = time.monotonic() - started
+        logger.info(
+            "会話をエクスポートしました: %d 行、%.1f MB（%s、%.2f秒、%.0f 行/秒）",
+            rows, size / 1e6, encoder.format, elapsed, rows / elapsed if elapsed else 0
+        )
+    
+    response = Response(stream_with_context(generate()), mimetype=encoder.mimetype)
+    response.headers['Content-Disposition'] = f'attachment; filename="conversations{encoder.extension}"'
+    response.call_on_close(limiter.release)
+    return response
+
 @app.route('/health')
 def health():
     try:
         with chatbot.get_connection() as conn:
             cursor = conn.cursor()
             cursor.execute("SELECT 1")
-            return jsonify({'status': 'healthy', 'database': 'connected'})
+        return jsonify({
+            'status': 'healthy', 'database': 'connected', 'pool': chatbot.pool.get_stats(),
+            'read_router': chatbot.router.get_stats()
+        })
     except Exception as e:
-        return jsonify({'status': 'unhealthy', 'error': str(e)}), 500
+        return jsonify({
+            'status': 'unhealthy', 'error': str(e), 'pool': chatbot.pool.get_stats(),
+            'read_router': chatbot.router.get_stats()
+        }), 500
+
+@app.route('/metrics')
+def metrics():
+    """ワーカー単位の内部統計"""
+    return jsonify({
+        'db_pool': chatbot.pool.get_stats(),
+        'read_router': chatbot.router.get_stats(),
+        'catalog': chatbot.catalog.get_stats(),
+        'conversation_writer': dict(chatbot.writer.get_stats(), mode=chatbot.write_mode),
+        'tokenizer': get_tokenizer_stats(),
+        'profiles': chatbot.profiles.get_stats(),
+        'analysis_cache': chatbot.analyzer.analysis_cache.get_stats(),
+        'chat_stream': chat_stream_stats.get_stats(),
+        'admission': {name: limiter.get_stats() for name, limiter in admission_limiters.items()},
+        'logging': get_logging_stats()
+    })
+
+@app.cli.command('backfill-analytics')
+@click.option('--user', 'user_id', default=None, help='対象ユーザーID（省略時は全ユーザー）')
+def backfill_analytics(user_id):
+    """既存の会話履歴からユーザー別集計テーブルを作成"""
+    start = time.monotonic()
+    rows = chatbot.backfill_analytics(user_id)
+    click.echo(f"✅ 集計行 {rows} 件を作成しました（{time.monotonic() - start:.2f}秒）")
+
+@app.cli.command('reanalyze-conversations')
+@click.option('--job', 'job_name', default='default', show_default=True,
+              help='ジョブ名（同じ名前で実行すると前回の続きから再開）')
+@click.option('--batch-size', default=1000, show_default=True, help='1回の読み込み・UPDATEで扱う行数')
+@click.option('--workers', default=ANALYZE_BATCH_WORKERS, show_default=True,
+              help='解析に使うワーカープロセス数（1でプロセス内処理）')
+@click.option('--max-rows-per-sec', default=0, show_default=True,
+              help='読み込み速度の上限（0で無制限）。稼働中のDBへの負荷を抑える場合に指定')
+@click.option('--restart', is_flag=True, help='チェックポイントを破棄して最初からやり直す')
+@click.option('--dry-run', is_flag=True, help='変わる行数を数えるだけで更新しない')
+def reanalyze_conversations(job_name, batch_size, workers, max_rows_per_sec, restart, dry_run):
+    """保存済みの会話の感情・意図を現在の解析器で判定し直す（中断しても再開可能）"""
+    last_report = [None]
+    
+    def report(stats):
+        now = time.monotonic()
+        if last_report[0] is None:
+            last_report[0] = now
+            if stats['resumed_from']:
+                click.echo(f"id {stats['resumed_from']} の次から再開します")
+        if now - last_report[0] < 5:
+            return
+        last_report[0] = now
+        done = stats['last_id'] - stats['resumed_from']
+        total = stats['end_id'] - stats['resumed_from']
+        click.echo(
+            f"  id {stats['last_id']} / {stats['end_id']}（{done / total if total else 1:.1%}）: "
+            f"{stats['scanned']:,} 行、更新 {stats['updated']:,} 行、"
+            f"{stats['scanned'] / stats['elapsed'] if stats['elapsed'] else 0:,.0f} 行/秒"
+        )
+    
+    stats = chatbot.reanalyze_conversations(
+        job_name, batch_size=max(1, batch_size), workers=workers, max_rows_per_sec=max_rows_per_sec,
+        restart=restart, dry_run=dry_run, progress=report
+    )
+    elapsed = stats['elapsed']
+    click.echo(
+        f"{'🔍 dry-run' if dry_run else '✅ 完了'}: {stats['scanned']:,} 行を判定、"
+        f"{stats['updated']:,} 行{'が変わります' if dry_run else 'を更新'}"
+        f"（{elapsed:.2f}秒、{stats['scanned'] / elapsed if elapsed else 0:,.0f} 行/秒）"
+    )
+
+@app.cli.command('ensure-partitions')
+@click.option('--months-ahead', default=CONVERSATION_PARTITION_MONTHS_AHEAD, show_default=True,
+              help='今月から何か月先までパーティションを作成するか')
+def ensure_partitions(months_ahead):
+    """会話履歴の月別パーティションを作成（定期実行用、既存のものはそのまま）"""
+    created = chatbot.ensure_partitions(months_ahead)
+    click.echo(f"✅ パーティションを {created} 件作成しました")
+    for name, month in chatbot.list_partitions():
+        click.echo(f"  {name}")
+
+@app.cli.command('archive-conversations')
+@click.option('--keep-months', default=CONVERSATION_RETENTION_MONTHS, show_default=True,
+              help='今月を含めて残す月数（これより古い月のパーティションが対象）')
+@click.option('--drop', is_flag=True, help='archive スキーマへ移さずに削除する')
+@click.option('--export-dir', default=None, help='切り離す前にパーティションを CSV で書き出すディレクトリ')
+@click.option('--dry-run', is_flag=True, help='対象のパーティションを表示するだけで変更しない')
+def archive_conversations(keep_months, drop, export_dir, dry_run):
+    """保存期間を過ぎた会話パーティションを切り離す（または削除する）"""
+    today = datetime.now().date().replace(day=1)
+    month_index = today.year * 12 + today.month - 1 - max(keep_months - 1, 0)
+    cutoff = today.replace(year=month_index // 12, month=month_index % 12 + 1)
+    targets = [name for name, month in chatbot.list_partitions() if month < cutoff]
+    if not targets:
+        click.echo(f"対象のパーティションはありません（{cutoff} より前）")
+        return
+    if export_dir:
+        os.makedirs(export_dir, exist_ok=True)
+    for name in targets:
+        if dry_run:
+            click.echo(f"  {name}（dry-run）")
+            continue
+        export_path = os.path.join(export_dir, f"{name}.csv") if export_dir else None
+        rows = chatbot.archive_partition(name, drop=drop, export_path=export_path)
+        action = '削除' if drop else 'archive スキーマへ移動'
+        click.echo(f"  {name}: {rows} 件を{action}" + (f"（{export_path}）" if export_path else ''))
+
+@app.cli.command('export-conversations')
+@click.option('--output', 'output_dir', required=True, help='書き出し先のディレクトリ')
+@click.option('--format', 'fmt', type=click.Choice(EXPORT_FORMATS), default='csv', show_default=True, help='ファイル形式')
+@click.option('--start', type=click.DateTime(), default=None, help='この日時以降の会話（YYYY-MM-DD など）')
+@click.option('--end', type=click.DateTime(), default=None, help='この日時より前の会話（この日時は含まない）')
+@click.option('--user', 'user_ids', multiple=True, help='対象ユーザーID（複数指定可、省略時は全ユーザー）')
+@click.option('--chunk-rows', default=EXPORT_CHUNK_ROWS, show_default=True, help='1回に読む行数')
+@click.option('--file-rows', default=EXPORT_FILE_ROWS, show_default=True, help='1ファイルあたりの行数')
+def export_conversations_files(output_dir, fmt, start, end, user_ids, chunk_rows, file_rows):
+    """会話を CSV / Parquet のファイルに書き出す（分析用の抽出。行数にかかわらずメモリ使用量は一定）"""
+    last_report = [time.monotonic()]
+    
+    def report(stats):
+        now = time.monotonic()
+        if now - last_report[0] < 5:
+            return
+        last_report[0] = now
+        click.echo(
+            f"  {stats['rows']:,} 行、{stats['bytes'] / 1e6:,.1f} MB、"
+            f"{stats['rows'] / stats['elapsed'] if stats['elapsed'] else 0:,.0f} 行/秒"
+        )
+    
+    try:
+        stats = chatbot.export_conversations(
+            output_dir, fmt, start=start, end=end, user_ids=list(user_ids) or None,
+            chunk_rows=max(1, chunk_rows), file_rows=file_rows, progress=report
+        )
+    except ValueError as e:
+        raise click.UsageError(str(e))
+    elapsed = stats['elapsed']
+    click.echo(
+        f"✅ {stats['rows']:,} 行を {len(stats['files'])} ファイルに書き出しました"
+        f"（{stats['bytes'] / 1e6:,.1f} MB、{elapsed:.2f}秒、{stats['rows'] / elapsed if elapsed else 0:,.0f} 行/秒）"
+    )
+    for path in stats['files']:
+        click.echo(f"  {path}")
+
+@app.cli.command('load-catalog')
+@click.option('--intents', 'intents_path', default=None, help='インテントのCSV/JSONL（intent_name, patterns, responses）')
+@click.option('--knowledge', 'knowledge_path', default=None,
+              help='知識ベースのCSV/JSONL（keyword, response, confidence, category）')
+@click.option('--replace', is_flag=True, help='ファイルに含まれない既存の行を削除する')
+@click.option('--dry-run', is_flag=True, help='検証と読み込みだけ行い、反映しない')
+def load_catalog(intents_path, knowledge_path, replace, dry_run):
+    """インテント・知識ベースを一括読み込み（稼働中のワーカーは再起動なしで反映）"""
+    if not intents_path and not knowledge_path:
+        raise click.UsageError('--intents または --knowledge を指定してください')
+    try:
+        result = chatbot.load_catalog(intents_path, knowledge_path, replace=replace, dry_run=dry_run)
+    except CatalogValidationError as e:
+        click.echo(f"❌ {e}。何も反映していません", err=True)
+        for message in e.errors:
+            click.echo(f"  {message}", err=True)
+        raise SystemExit(1)
+    rows = result['intents'] + result['knowledge']
+    elapsed = result['elapsed']
+    click.echo(
+        f"{'🔍 検証のみ' if dry_run else '✅ 反映しました'}: インテント {result['intents']} 行、"
+        f"知識ベース {result['knowledge']} 行（{elapsed:.2f}秒、{rows / elapsed if elapsed else 0:,.0f} 行/秒）"
+    )
 
 if __name__ == '__main__':
+    if os.environ.get('WARM_UP_ON_START', '0') == '1':
+        warm_up()
     app.run(host='0.0.0.0', port=5000, debug=True)
@@ -0,0 +1,92 @@
+"""AIMessageAnalyzer の各処理のメッセージあたりのコストを計測
+
+    python benchmarks/bench_analyzer.py --messages 2000 --output benchmarks/results/analyzer.json
+
+- preprocess_text
+- extract_keywords（形態素解析キャッシュなし / あり）
+- analyze_sentiment
+- classify_intent
+- analyze_message（感情・意図を1回の走査で判定）
+- analyze_turn（/chat で使う解析。解析結果キャッシュなし / あり）
+
+インテントは init.sql の初期データを使うため、DB接続は不要。
+"""
+import argparse
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app  # noqa: E402
+from benchmarks.common import per_message_us, save_results  # noqa: E402
+from benchmarks.corpus import generate_messages  # noqa: E402
+from benchmarks.fake_db import load_seed_data  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description='テキスト解析のコスト計測')
+    parser.add_argument('--messages', type=int, default=2000, help='メッセージ数')
+    parser.add_argument('--seed', type=int, default=42, help='コーパスの乱数シード')
+    parser.add_argument('--repeat', type=int, default=3, help='繰り返し回数（最小値を採用）')
+    parser.add_argument('--output', help='結果を保存するJSONファイル')
+    parser.add_argument('--json', action='store_true', help='結果をJSONで出力')
+    args = parser.parse_args()
+
+    messages = generate_messages(args.messages, seed=args.seed)
+    intents_data, _ = load_seed_data()
+    analyzer = app.AIMessageAnalyzer()
+    # マッチャーの構築と辞書の読み込みは計測に含めない
+    analyzer.get_matcher(intents_data)
+    app.get_tokenizer()
+
+    def extract_keywords_uncached(message):
+        app.tokenize.cache_clear()
+        return analyzer.extract_keywords(message)
+
+    def analyze_turn_uncached(message):
+        app.tokenize.cache_clear()
+        analyzer.analysis_cache.clear()
+        return analyzer.analyze_turn(message, intents_data)
+
+    for message in messages:
+        analyzer.extract_keywords(message)
+        analyzer.analyze_turn(message, intents_data)
+
+    results = {
+        'messages': len(messages),
+        'unique_messages': len(set(messages)),
+        'tokenizer_backend': 'janome' if app.get_tokenizer() is not None else 'whitespace',
+        'per_message_us': {
+            'preprocess_text': per_message_us(analyzer.preprocess_text, messages, args.repeat),
+            'extract_keywords_uncached': per_message_us(extract_keywords_uncached, messages, 1),
+            'extract_keywords_cached': per_message_us(analyzer.extract_keywords, messages, args.repeat),
+            'analyze_sentiment': per_message_us(analyzer.analyze_sentiment, messages, args.repeat),
+            'classify_intent': per_message_us(
+                lambda message: analyzer.classify_intent(message, intents_data), messages, args.repeat
+            ),
+            'analyze_message': per_message_us(
+                lambda message: analyzer.analyze_message(message, intents_data), messages, args.repeat
+            ),
+            'analyze_turn_uncached': per_message_us(analyze_turn_uncached, messages, 1),
+            'analyze_turn_cached': per_message_us(
+                lambda message: analyzer.analyze_turn(message, intents_data), messages, args.repeat
+            ),
+        },
+        'analysis_cache': analyzer.analysis_cache.get_stats(),
+    }
+
+    if args.output:
+        save_results(args.output, 'analyzer', results, args)
+    if args.json:
+        print(json.dumps(results, ensure_ascii=False, indent=2))
+        return
+
+    print(f"メッセージ数: {results['messages']}（ユニーク {results['unique_messages']}、"
+          f"形態素解析: {results['tokenizer_backend']}）")
+    for name, value in results['per_message_us'].items():
+        print(f"  {name:<28}: {value:>10} µs/件")
+
+
+if __name__ == '__main__':
+    main()
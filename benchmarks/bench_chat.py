@@ -0,0 +1,167 @@
+"""/chat のエンドツーエンド負荷試験（同時接続数を段階的に増やす）
+
+    # インプロセス（Flaskのテストクライアント + メモリ上のDB層）
+    python benchmarks/bench_chat.py --concurrency 1,4,16 --requests 500
+
+    # インプロセス（app の設定どおり PostgreSQL に接続。使い捨てのDBで実行すること）
+    python benchmarks/bench_chat.py --db real
+
+    # 起動中のサーバーに HTTP で送信
+    python benchmarks/bench_chat.py --url http://localhost --output benchmarks/results/chat.json
+
+同時接続数ごとにスループット（req/s）とレイテンシ（p50 / p95 / p99）を出力する。
+仮想ユーザーごとにセッションCookieを持ち、会話履歴・プロフィールもユーザー単位で増える。
+"""
+import argparse
+import http.cookiejar
+import itertools
+import json
+import os
+import sys
+import threading
+import time
+import urllib.request
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.common import percentile, save_results  # noqa: E402
+from benchmarks.corpus import generate_messages  # noqa: E402
+
+
+class InProcessClient:
+    """Flaskのテストクライアントで /chat を呼ぶ仮想ユーザー"""
+
+    def __init__(self, flask_app):
+        self.client = flask_app.test_client()
+        self.client.get('/')
+
+    def chat(self, message):
+        response = self.client.post('/chat', json={'message': message})
+        return response.status_code
+
+
+class HttpClient:
+    """起動中のサーバーに HTTP で /chat を送る仮想ユーザー"""
+
+    def __init__(self, base_url, timeout):
+        self.base_url = base_url.rstrip('/')
+        self.timeout = timeout
+        self.opener = urllib.request.build_opener(
+            urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar())
+        )
+        self.opener.open(self.base_url + '/', timeout=timeout).read()
+
+    def chat(self, message):
+        request = urllib.request.Request(
+            self.base_url + '/chat',
+            data=json.dumps({'message': message}).encode('utf-8'),
+            headers={'Content-Type': 'application/json'},
+        )
+        try:
+            with self.opener.open(request, timeout=self.timeout) as response:
+                response.read()
+                return response.status
+        except urllib.error.HTTPError as e:
+            return e.code
+
+
+def run_level(clients, messages, total_requests):
+    """同時接続数 len(clients) で total_requests 件を送信して計測"""
+    counter = itertools.count()
+    latencies = []
+    errors = []
+    lock = threading.Lock()
+
+    def worker(client):
+        local_latencies = []
+        local_errors = 0
+        while True:
+            i = next(counter)
+            if i >= total_requests:
+                break
+            start = time.perf_counter()
+            try:
+                ok = client.chat(messages[i % len(messages)]) == 200
+            except Exception:
+                ok = False
+            local_latencies.append(time.perf_counter() - start)
+            local_errors += not ok
+        with lock:
+            latencies.extend(local_latencies)
+            errors.append(local_errors)
+
+    threads = [threading.Thread(target=worker, args=(client,)) for client in clients]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    return {
+        'concurrency': len(clients),
+        'requests': len(latencies),
+        'errors': sum(errors),
+        'elapsed_s': round(elapsed, 3),
+        'throughput_rps': round(len(latencies) / elapsed, 1),
+        'latency_ms': {
+            name: round(percentile(latencies, pct) * 1000, 2)
+            for name, pct in (('p50', 50), ('p95', 95), ('p99', 99), ('max', 100))
+        },
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='/chat の負荷試験')
+    parser.add_argument('--url', help='起動中のサーバーのURL（省略時はインプロセスで実行）')
+    parser.add_argument('--db', choices=['fake', 'real'], default='fake',
+                        help='インプロセス実行時のDB層（fake: メモリ上 / real: PostgreSQL）')
+    parser.add_argument('--concurrency', default='1,2,4,8,16,32', help='同時接続数（カンマ区切り）')
+    parser.add_argument('--requests', type=int, default=500, help='同時接続数ごとのリクエスト数')
+    parser.add_argument('--warmup', type=int, default=50, help='計測前に送るリクエスト数')
+    parser.add_argument('--messages', type=int, default=2000, help='コーパスのメッセージ数')
+    parser.add_argument('--seed', type=int, default=42, help='コーパスの乱数シード')
+    parser.add_argument('--timeout', type=float, default=30.0, help='HTTPのタイムアウト（秒）')
+    parser.add_argument('--output', help='結果を保存するJSONファイル')
+    parser.add_argument('--json', action='store_true', help='結果をJSONで出力')
+    args = parser.parse_args()
+
+    levels = [int(value) for value in args.concurrency.split(',')]
+    messages = generate_messages(args.messages, seed=args.seed)
+
+    if args.url:
+        target = args.url
+        make_client = lambda: HttpClient(args.url, args.timeout)  # noqa: E731
+    else:
+        import app
+        if args.db == 'fake':
+            from benchmarks.fake_db import install
+            install(app.chatbot)
+        app.warm_up()
+        target = f"in-process ({args.db} db)"
+        make_client = lambda: InProcessClient(app.app)  # noqa: E731
+
+    warmup_client = make_client()
+    for message in messages[:args.warmup]:
+        warmup_client.chat(message)
+
+    results = {'target': target, 'levels': []}
+    for concurrency in levels:
+        clients = [make_client() for _ in range(concurrency)]
+        level = run_level(clients, messages, args.requests)
+        results['levels'].append(level)
+        if not args.json:
+            latency = level['latency_ms']
+            print(f"同時接続 {concurrency:>4}: {level['throughput_rps']:>8} req/s  "
+                  f"p50 {latency['p50']:>8} ms  p95 {latency['p95']:>8} ms  "
+                  f"p99 {latency['p99']:>8} ms  エラー {level['errors']}")
+
+    if args.output:
+        save_results(args.output, 'chat', results, args)
+    if args.json:
+        print(json.dumps(results, ensure_ascii=False, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,143 @@
+"""ワーカーあたりのメモリ使用量（RSS / PSS / USS）を計測
+
+    python benchmarks/bench_memory.py --workers 4 --intents 2000 --knowledge 20000
+
+gunicorn（preload なし）と同じく、app を読み込んでいない親プロセスから
+ワーカーを fork し、各ワーカーで `import app` と warm_up() を実行してから
+/proc/<pid>/smaps_rollup を読む。DB層は fake_db に差し替え、カタログは
+初期データに合成した行を足して指定の件数にする。
+
+- RSS: ワーカーが使っている物理メモリ（共有ページを含む）
+- PSS: 共有ページをワーカー数で按分した量（ノード全体の使用量は PSS の合計）
+- USS: そのワーカーだけが使っているページ（ワーカーを1つ増やすごとに増える量）
+
+保存済みモデルを読み込む定常状態（再起動時）を測るため、先に1ワーカーだけ
+起動してモデルを保存してから本計測のワーカーを起動する。Linux専用。
+"""
+import argparse
+import os
+import random
+import shutil
+import signal
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.common import ROOT, save_results  # noqa: E402
+from benchmarks.fake_db import load_seed_data  # noqa: E402
+
+KANA = [chr(code) for code in range(0x3041, 0x3094)]
+KANJI = [chr(code) for code in range(0x4E00, 0x4E00 + 800)]
+
+
+def _word(rng):
+    return ''.join(rng.choice(KANJI if rng.random() < 0.5 else KANA) for _ in range(rng.randint(2, 5)))
+
+
+def build_catalog(n_intents, n_knowledge, seed=42):
+    """初期データに合成したインテント・知識ベースを足して指定の件数にする"""
+    rng = random.Random(seed)
+    intents, knowledge = load_seed_data()
+    for i in range(len(intents), n_intents):
+        intents.append({
+            'intent_name': f'intent_{i}',
+            'patterns': [_word(rng) for _ in range(rng.randint(2, 6))],
+            'responses': [f'{_word(rng)}です' for _ in range(rng.randint(1, 3))],
+        })
+    for i in range(len(knowledge), n_knowledge):
+        knowledge.append({
+            'id': i + 1,
+            'keyword': _word(rng),
+            'response': ''.join(_word(rng) for _ in range(rng.randint(3, 8))),
+            'confidence': round(rng.random(), 3),
+            'category': None,
+        })
+    knowledge.sort(key=lambda row: (-row['confidence'], row['id']))
+    return intents, knowledge
+
+
+def read_memory(pid):
+    """smaps_rollup から Rss / Pss / USS（Private_*）をMB単位で読む"""
+    values = {}
+    with open(f'/proc/{pid}/smaps_rollup') as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) >= 2 and parts[0].endswith(':'):
+                values[parts[0][:-1]] = int(parts[1])
+    return {
+        'rss_mb': round(values['Rss'] / 1024, 1),
+        'pss_mb': round(values['Pss'] / 1024, 1),
+        'uss_mb': round((values['Private_Clean'] + values['Private_Dirty']) / 1024, 1),
+    }
+
+
+def spawn_worker(catalog):
+    """ワーカーを fork し、warm_up() の完了を待って pid を返す"""
+    read_fd, write_fd = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        os.close(read_fd)
+        try:
+            sys.path.insert(0, ROOT)
+            import app
+            from benchmarks import fake_db
+            database = fake_db.install(app.chatbot)
+            database.intents, database.knowledge = catalog
+            app.warm_up()
+            os.write(write_fd, b'1')
+            signal.pause()
+        finally:
+            os._exit(0)
+    os.close(write_fd)
+    with os.fdopen(read_fd, 'rb') as f:
+        if f.read(1) != b'1':
+            raise RuntimeError(f'ワーカー {pid} の起動に失敗しました')
+    return pid
+
+
+def stop_workers(pids):
+    for pid in pids:
+        os.kill(pid, signal.SIGTERM)
+    for pid in pids:
+        os.waitpid(pid, 0)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='ワーカーあたりのメモリ使用量の計測')
+    parser.add_argument('--workers', type=int, default=4, help='起動するワーカー数')
+    parser.add_argument('--intents', type=int, default=2000, help='インテントの件数')
+    parser.add_argument('--knowledge', type=int, default=20000, help='知識ベースの件数')
+    parser.add_argument('--output', help='結果を保存するJSONファイル（compare.py で比較できる）')
+    args = parser.parse_args()
+
+    catalog = build_catalog(args.intents, args.knowledge)
+    model_dir = tempfile.mkdtemp(prefix='bench-memory-')
+    os.environ['RETRIEVAL_MODEL_PATH'] = os.path.join(model_dir, 'retrieval.joblib')
+    os.environ['ARTIFACT_DIR'] = model_dir
+    os.environ.setdefault('LOG_LEVEL', 'WARNING')
+    try:
+        stop_workers([spawn_worker(catalog)])
+        pids = [spawn_worker(catalog) for _ in range(args.workers)]
+        try:
+            samples = [read_memory(pid) for pid in pids]
+        finally:
+            stop_workers(pids)
+    finally:
+        shutil.rmtree(model_dir, ignore_errors=True)
+
+    results = {
+        key: round(sum(sample[key] for sample in samples) / len(samples), 1)
+        for key in ('rss_mb', 'pss_mb', 'uss_mb')
+    }
+    results['total_pss_mb'] = round(sum(sample['pss_mb'] for sample in samples), 1)
+
+    print(f"ワーカー {args.workers}、インテント {len(catalog[0])} 件、知識ベース {len(catalog[1])} 件（1ワーカーの平均）")
+    print(f"  RSS {results['rss_mb']:>7} MB  PSS {results['pss_mb']:>7} MB  USS {results['uss_mb']:>7} MB")
+    print(f"  PSSの合計（ノード全体）: {results['total_pss_mb']} MB")
+    if args.output:
+        save_results(args.output, 'memory', results, args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,153 @@
+"""感情分析のスループットを辞書の大きさごとに計測
+
+    python benchmarks/bench_sentiment.py --messages 2000 --sizes 0,1000,5000,20000 --output benchmarks/results/sentiment.json
+
+組み込みの辞書に合成した見出し語を足して、辞書の大きさを変えながら次の方式を比べる。
+
+- reference_scan: 単語ごとに `in` で走査する従来の参照実装（辞書の大きさに比例）
+- keyword_matcher: SENTIMENT_ENGINE=keyword（オートマトンで走査し、ヒットを単語リストと照合）
+- lexicon_single: SENTIMENT_ENGINE=lexicon で1件ずつ判定（/chat と同じ呼び出し方）
+- lexicon_batch: SENTIMENT_ENGINE=lexicon でまとめて判定（一括解析・再解析と同じ呼び出し方）
+
+lexicon 方式は形態素解析の結果を使う。/chat ではキーワード抽出と同じ解析結果を
+キャッシュから使うため、キャッシュあり（_cached）を基本とし、キャッシュなし（_uncached）も計測する。
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app  # noqa: E402
+from benchmarks.common import per_message_us, save_results  # noqa: E402
+from benchmarks.corpus import generate_messages  # noqa: E402
+
+KANA = [chr(code) for code in range(0x3041, 0x3094)]
+KANJI = [chr(code) for code in range(0x4E00, 0x4E00 + 800)]
+
+
+def synthetic_words(count, seed=42):
+    """辞書を大きくするための合成した見出し語"""
+    rng = random.Random(seed)
+    words = set()
+    while len(words) < count:
+        words.add(''.join(rng.choice(KANJI if rng.random() < 0.5 else KANA) for _ in range(rng.randint(2, 4))))
+    return sorted(words)
+
+
+def reference_scan(analyzer):
+    """単語ごとに `in` で走査する従来の判定（置き換え前の実装）"""
+    def scan(text):
+        text_lower = text.lower()
+        positive_score = sum(1 for word in analyzer.positive_words if word in text_lower)
+        negative_score = sum(1 for word in analyzer.negative_words if word in text_lower)
+        if positive_score > negative_score:
+            return 'positive'
+        elif negative_score > positive_score:
+            return 'negative'
+        return 'neutral'
+    return scan
+
+
+def batch_us(func, messages, repeat=3):
+    """まとめて判定したときの1メッセージあたりの処理時間（マイクロ秒、repeat回の最小値）"""
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(messages)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return round(best / len(messages) * 1e6, 2)
+
+
+def measure(messages, size, repeat):
+    """合成語を size 件足した辞書で各方式を計測"""
+    words = synthetic_words(size)
+    half = len(words) // 2
+
+    keyword = app.AIMessageAnalyzer('keyword')
+    keyword.update_lexicon(
+        positive_words=keyword.positive_words + words[:half],
+        negative_words=keyword.negative_words + words[half:]
+    )
+
+    lexicon = app.AIMessageAnalyzer('lexicon')
+    weights = dict(lexicon.sentiment_weights)
+    weights.update((word, 1.0 if i < half else -1.0) for i, word in enumerate(words))
+    lexicon.update_lexicon(weights=weights)
+    start = time.perf_counter()
+    lexicon.compile_sentiment_lexicon()
+    compile_ms = round((time.perf_counter() - start) * 1000, 1)
+
+    def uncached(func):
+        def run(value):
+            app.tokenize.cache_clear()
+            return func(value)
+        return run
+
+    def batch_uncached(texts):
+        app.tokenize.cache_clear()
+        return lexicon.analyze_sentiments(texts)
+
+    timings = {
+        'reference_scan': per_message_us(reference_scan(keyword), messages, repeat),
+        'keyword_matcher': per_message_us(keyword.analyze_sentiment, messages, repeat),
+        'lexicon_single_uncached': per_message_us(uncached(lexicon.analyze_sentiment), messages, 1),
+        'lexicon_batch_uncached': batch_us(batch_uncached, messages, 1),
+    }
+    app.tokenize.cache_clear()
+    lexicon.analyze_sentiments(messages)
+    timings['lexicon_single_cached'] = per_message_us(lexicon.analyze_sentiment, messages, repeat)
+    timings['lexicon_batch_cached'] = batch_us(lexicon.analyze_sentiments, messages, repeat)
+
+    labels = lexicon.analyze_sentiments(messages)
+    return {
+        'lexicon_terms': len(weights),
+        'compile_ms': compile_ms,
+        'per_message_us': timings,
+        'throughput_rps': {name: round(1e6 / value) for name, value in timings.items() if value},
+        'labels': {label: labels.count(label) for label in ('positive', 'negative', 'neutral')},
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='感情分析のスループット計測')
+    parser.add_argument('--messages', type=int, default=2000, help='メッセージ数')
+    parser.add_argument('--sizes', default='0,1000,5000,20000', help='組み込みの辞書に足す合成語の件数（カンマ区切り）')
+    parser.add_argument('--seed', type=int, default=42, help='コーパスの乱数シード')
+    parser.add_argument('--repeat', type=int, default=3, help='繰り返し回数（最小値を採用）')
+    parser.add_argument('--output', help='結果を保存するJSONファイル')
+    parser.add_argument('--json', action='store_true', help='結果をJSONで出力')
+    args = parser.parse_args()
+
+    messages = generate_messages(args.messages, seed=args.seed)
+    app.get_tokenizer()
+    results = {
+        'messages': len(messages),
+        'unique_messages': len(set(messages)),
+        'tokenizer_backend': 'janome' if app.get_tokenizer() is not None else 'whitespace',
+        'sizes': {
+            f"extra_{size}": measure(messages, size, args.repeat)
+            for size in (int(value) for value in args.sizes.split(','))
+        },
+    }
+
+    if args.output:
+        save_results(args.output, 'sentiment', results, args)
+    if args.json:
+        print(json.dumps(results, ensure_ascii=False, indent=2))
+        return
+
+    print(f"メッセージ数: {results['messages']}（ユニーク {results['unique_messages']}、"
+          f"形態素解析: {results['tokenizer_backend']}）")
+    for name, result in results['sizes'].items():
+        print(f"\n評価語 {result['lexicon_terms']} 件（コンパイル {result['compile_ms']} ms）")
+        for method, value in result['per_message_us'].items():
+            print(f"  {method:<26}: {value:>10} µs/件  {result['throughput_rps'][method]:>10} 件/秒")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,91 @@
+"""ワーカー起動時のコスト（import時間・RSS）を計測
+
+    python benchmarks/bench_startup.py --runs 5
+
+毎回新しいPythonプロセスで `import app` を実行し、次を計測する。
+
+- import にかかる時間（コールドスタート）
+- import 直後の最大RSS
+- warm_up() にかかる時間と、その後の最大RSS
+- import 時点で読み込まれている重量級ライブラリ
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+HEAVY_MODULES = ('sklearn', 'numpy', 'scipy', 'pandas', 'nltk', 'textblob', 'janome', 'joblib')
+
+PROBE = r"""
+import json, resource, sys, time
+sys.path.insert(0, {root!r})
+start = time.perf_counter()
+import app
+import_s = time.perf_counter() - start
+import_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+heavy = sorted({{name.split('.')[0] for name in sys.modules}} & set({heavy!r}))
+result = {{'import_s': import_s, 'import_rss_kb': import_rss, 'heavy_modules_after_import': heavy}}
+if {warm!r}:
+    start = time.perf_counter()
+    app.warm_up()
+    result['warm_up_s'] = time.perf_counter() - start
+    result['warm_rss_kb'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+print('@@' + json.dumps(result))
+"""
+
+
+def run_probe(warm):
+    """新しいプロセスで計測スクリプトを1回実行"""
+    code = PROBE.format(root=ROOT, heavy=HEAVY_MODULES, warm=warm)
+    output = subprocess.run(
+        [sys.executable, '-c', code], capture_output=True, text=True, check=True, cwd=ROOT
+    ).stdout
+    line = next(line for line in output.splitlines() if line.startswith('@@'))
+    return json.loads(line[2:])
+
+
+def summarize(values, scale=1.0, digits=1):
+    values = [value * scale for value in values]
+    return {
+        'median': round(statistics.median(values), digits),
+        'min': round(min(values), digits),
+        'max': round(max(values), digits),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='ワーカー起動コストの計測')
+    parser.add_argument('--runs', type=int, default=5, help='計測回数（毎回新しいプロセス）')
+    parser.add_argument('--no-warm-up', action='store_true', help='warm_up() を計測しない')
+    parser.add_argument('--json', action='store_true', help='結果をJSONで出力')
+    args = parser.parse_args()
+
+    samples = [run_probe(not args.no_warm_up) for _ in range(args.runs)]
+    results = {
+        'runs': args.runs,
+        'import_ms': summarize([s['import_s'] for s in samples], 1000),
+        'import_rss_mb': summarize([s['import_rss_kb'] for s in samples], 1 / 1024),
+        'heavy_modules_after_import': samples[-1]['heavy_modules_after_import'],
+    }
+    if not args.no_warm_up:
+        results['warm_up_ms'] = summarize([s['warm_up_s'] for s in samples], 1000)
+        results['warm_rss_mb'] = summarize([s['warm_rss_kb'] for s in samples], 1 / 1024)
+
+    if args.json:
+        print(json.dumps(results, ensure_ascii=False, indent=2))
+        return
+
+    print(f"計測回数: {results['runs']}（毎回新しいプロセス、中央値）")
+    print(f"  import app     : {results['import_ms']['median']:>8} ms  RSS {results['import_rss_mb']['median']:>7} MB")
+    if 'warm_up_ms' in results:
+        print(f"  warm_up()      : {results['warm_up_ms']['median']:>8} ms  RSS {results['warm_rss_mb']['median']:>7} MB")
+    heavy = ', '.join(results['heavy_modules_after_import']) or 'なし'
+    print(f"  import直後の重量級ライブラリ: {heavy}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,70 @@
+"""形態素解析（Janome）のメッセージあたりのコストを計測
+
+    python benchmarks/bench_tokenizer.py --messages 2000
+
+- 辞書の読み込み時間（プロセスで1回だけ）
+- キャッシュなしの形態素解析
+- キャッシュヒット時の形態素解析
+- 従来の空白区切り
+- extract_keywords 全体
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app  # noqa: E402
+from benchmarks.common import per_message_us  # noqa: E402
+from benchmarks.corpus import generate_messages  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description='形態素解析のコスト計測')
+    parser.add_argument('--messages', type=int, default=2000, help='メッセージ数')
+    parser.add_argument('--json', action='store_true', help='結果をJSONで出力')
+    args = parser.parse_args()
+
+    messages = generate_messages(args.messages)
+    analyzer = app.AIMessageAnalyzer()
+    normalized = [analyzer.normalize_text(message) for message in messages]
+
+    start = time.perf_counter()
+    tokenizer = app.get_tokenizer()
+    load_ms = round((time.perf_counter() - start) * 1000, 1)
+
+    results = {
+        'backend': 'janome' if tokenizer is not None else 'whitespace',
+        'messages': len(messages),
+        'unique_messages': len(set(messages)),
+        'tokenizer_load_ms': load_ms,
+        'whitespace_split_us': per_message_us(str.split, normalized),
+        'tokenize_uncached_us': per_message_us(app.tokenize.__wrapped__, normalized),
+    }
+
+    app.tokenize.cache_clear()
+    for text in normalized:
+        app.tokenize(text)
+    results['tokenize_cached_us'] = per_message_us(app.tokenize, normalized)
+
+    app.tokenize.cache_clear()
+    results['extract_keywords_us'] = per_message_us(analyzer.extract_keywords, messages, repeat=1)
+    results['cache'] = app.get_tokenizer_stats()
+
+    if args.json:
+        print(json.dumps(results, ensure_ascii=False, indent=2))
+        return
+
+    print(f"バックエンド: {results['backend']}（辞書読み込み {load_ms} ms）")
+    print(f"メッセージ数: {results['messages']}（ユニーク {results['unique_messages']}）")
+    print(f"  空白区切り（従来）      : {results['whitespace_split_us']:>10} µs/件")
+    print(f"  形態素解析（キャッシュなし）: {results['tokenize_uncached_us']:>10} µs/件")
+    print(f"  形態素解析（キャッシュヒット）: {results['tokenize_cached_us']:>10} µs/件")
+    print(f"  extract_keywords（初回から）: {results['extract_keywords_us']:>10} µs/件")
+    print(f"  キャッシュヒット率: {results['cache']['hit_ratio']}")
+
+
+if __name__ == '__main__':
+    main()
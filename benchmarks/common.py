@@ -0,0 +1,65 @@
+"""ベンチマーク共通の計測・保存処理"""
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+from datetime import datetime
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def per_message_us(func, messages, repeat=3):
+    """1メッセージあたりの処理時間（マイクロ秒、repeat回の最小値）"""
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for message in messages:
+            func(message)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return round(best / len(messages) * 1e6, 2)
+
+
+def percentile(sorted_values, pct):
+    """ソート済みの値から百分位数を求める（線形補間）"""
+    if not sorted_values:
+        return None
+    position = (len(sorted_values) - 1) * pct / 100
+    lower = int(position)
+    upper = min(lower + 1, len(sorted_values) - 1)
+    return sorted_values[lower] + (sorted_values[upper] - sorted_values[lower]) * (position - lower)
+
+
+def environment():
+    """結果と一緒に保存する実行環境の情報"""
+    try:
+        commit = subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, cwd=ROOT
+        ).stdout.strip() or None
+    except OSError:
+        commit = None
+    return {
+        'timestamp': datetime.now().isoformat(timespec='seconds'),
+        'git_commit': commit,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+    }
+
+
+def save_results(path, benchmark, results, args=None):
+    """結果をJSONで保存（compare.py で比較できる形式）"""
+    document = {
+        'benchmark': benchmark,
+        'environment': environment(),
+        'args': vars(args) if args is not None else {},
+        'results': results,
+    }
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(document, f, ensure_ascii=False, indent=2)
+    print(f"結果を保存しました: {path}", file=sys.stderr)
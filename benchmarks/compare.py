@@ -0,0 +1,82 @@
+"""保存したベンチマーク結果（JSON）を比較して性能低下を検出
+
+    python benchmarks/compare.py benchmarks/results/before.json benchmarks/results/after.json
+
+時間（µs / ms）とメモリ（MB）は小さいほど、スループット（rps）は大きいほど良いとみなし、
+--threshold（%）を超えて悪化した項目があれば終了コード 1 を返す。
+"""
+import argparse
+import json
+import sys
+
+# 比較対象にする値（パスの一部）と、大きいほど良いかどうか
+METRICS = (
+    ('per_message_us', False),
+    ('latency_ms', False),
+    ('_ms', False),
+    ('_mb', False),
+    ('throughput_rps', True),
+)
+
+
+def flatten(value, prefix=''):
+    """結果を {パス: 数値} に平坦化（levels は同時接続数をキーにする）"""
+    if isinstance(value, dict):
+        items = {}
+        for key, child in value.items():
+            items.update(flatten(child, f"{prefix}{key}."))
+        return items
+    if isinstance(value, list):
+        items = {}
+        for i, child in enumerate(value):
+            key = f"c{child['concurrency']}" if isinstance(child, dict) and 'concurrency' in child else str(i)
+            items.update(flatten(child, f"{prefix}{key}."))
+        return items
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return {prefix[:-1]: value}
+    return {}
+
+
+def direction(path):
+    """比較対象なら「大きいほど良いか」を、対象外なら None を返す"""
+    for marker, higher_is_better in METRICS:
+        if marker in path:
+            return higher_is_better
+    return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description='ベンチマーク結果の比較')
+    parser.add_argument('before', help='基準となる結果ファイル')
+    parser.add_argument('after', help='比較する結果ファイル')
+    parser.add_argument('--threshold', type=float, default=10.0, help='悪化とみなす変化率（%%）')
+    args = parser.parse_args()
+
+    with open(args.before, encoding='utf-8') as f:
+        before = json.load(f)
+    with open(args.after, encoding='utf-8') as f:
+        after = json.load(f)
+    if before.get('benchmark') != after.get('benchmark'):
+        sys.exit(f"種類の異なる結果は比較できません: {before.get('benchmark')} / {after.get('benchmark')}")
+
+    old, new = flatten(before['results']), flatten(after['results'])
+    regressions = 0
+    print(f"{before['environment'].get('git_commit')} → {after['environment'].get('git_commit')}"
+          f"（{before['benchmark']}、しきい値 {args.threshold}%）")
+    for path in sorted(old.keys() & new.keys()):
+        higher_is_better = direction(path)
+        if higher_is_better is None or not old[path]:
+            continue
+        change = (new[path] - old[path]) / old[path] * 100
+        worse = -change if higher_is_better else change
+        mark = '❌' if worse > args.threshold else ('✅' if worse < -args.threshold else '  ')
+        regressions += worse > args.threshold
+        print(f"{mark} {path:<40} {old[path]:>12} → {new[path]:>12}  ({change:+.1f}%)")
+
+    if regressions:
+        print(f"{regressions} 項目が悪化しました")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,46 @@
+"""ベンチマーク用の日本語メッセージコーパス
+
+チャットで実際に送られてくるような短文をテンプレートから組み立てる。
+乱数シードを固定しているので、同じ引数なら毎回同じコーパスになる。
+"""
+import random
+
+# よく送られてくる定型メッセージ（同じ文面が繰り返し届く）
+FREQUENT_MESSAGES = [
+    'こんにちは', 'ありがとう', 'バイバイ', 'おはよう', 'こんばんは',
+    'はじめまして', 'さようなら', 'またね', 'お疲れ様', 'どうも',
+    'あなたの名前は？', '今何時？', '好きな食べ物は？', '疲れた', '嬉しい',
+]
+
+SUBJECTS = [
+    '今日', '昨日', '明日', '週末', '仕事', '学校', '家族', '友達', '会社', '電車',
+    '天気', '雨', 'ランチ', '映画', '音楽', 'ゲーム', '読書', 'カフェ', '料理', '旅行',
+]
+
+PREDICATES = [
+    'はとても楽しかったです', 'は大変でした', 'が最高でした', 'について教えてください',
+    'はどう思いますか？', 'が心配です', 'で困っています', 'は素晴らしいですね',
+    'が好きです', 'は嫌いです', 'のことで悩んでいます', 'を楽しみにしています',
+    'は晴れるかな', 'で疲れた', 'が不安です', 'に感謝しています',
+]
+
+CONNECTORS = ['、', 'けど、', 'し、', '。それから', '。でも']
+
+
+def generate_messages(count=1000, seed=42, frequent_ratio=0.3):
+    """コーパスを生成（frequent_ratioの割合で定型メッセージを混ぜる）"""
+    rng = random.Random(seed)
+    messages = []
+    for _ in range(count):
+        if rng.random() < frequent_ratio:
+            messages.append(rng.choice(FREQUENT_MESSAGES))
+            continue
+        clauses = [
+            f"{rng.choice(SUBJECTS)}{rng.choice(PREDICATES)}"
+            for _ in range(rng.randint(1, 3))
+        ]
+        message = clauses[0]
+        for clause in clauses[1:]:
+            message += rng.choice(CONNECTORS) + clause
+        messages.append(message)
+    return messages
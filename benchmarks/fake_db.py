@@ -0,0 +1,155 @@
+"""ChatBot のDB層のインプロセス版（PostgreSQLなしでベンチマークするため）
+
+init.sql の初期データ（intents / knowledge_base）を読み込み、/chat の処理で
+発行されるSQLだけをメモリ上で処理する。想定外のSQLは NotImplementedError にして、
+アプリ側のクエリが変わったことに気付けるようにする。
+
+    from benchmarks.fake_db import install
+    install(app.chatbot)
+"""
+import ast
+import os
+import re
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+
+from benchmarks.common import ROOT
+
+INIT_SQL = os.path.join(ROOT, 'init.sql')
+
+
+def _parse_values(sql, table):
+    """INSERT INTO <table> (...) VALUES ... の行をPythonのタプルに変換"""
+    match = re.search(
+        rf"INSERT INTO {table} \(([^)]*)\) VALUES(.*?)(?:ON CONFLICT[^;]*)?;", sql, re.S
+    )
+    columns = [column.strip() for column in match.group(1).split(',')]
+    values = match.group(2).replace('ARRAY[', '[')
+    rows = ast.literal_eval('[' + values + ']')
+    return [dict(zip(columns, row)) for row in rows]
+
+
+def load_seed_data(path=INIT_SQL):
+    """init.sql から intents と knowledge_base の初期データを読み込む"""
+    with open(path, encoding='utf-8') as f:
+        sql = f.read()
+    intents = _parse_values(sql, 'intents')
+    knowledge = [
+        dict(row, id=i, confidence=row.get('confidence', 1.0))
+        for i, row in enumerate(_parse_values(sql, 'knowledge_base'), start=1)
+    ]
+    knowledge.sort(key=lambda row: (-row['confidence'], row['id']))
+    return intents, knowledge
+
+
+class FakeDatabase:
+    """会話を保持するメモリ上のテーブル"""
+
+    def __init__(self, intents, knowledge):
+        self.intents = intents
+        self.knowledge = knowledge
+        self.conversations = []
+        self.lock = threading.Lock()
+
+    def execute(self, sql, params):
+        """SQLを実行して (列名, 行) を返す"""
+        statement = ' '.join(sql.split())
+        if statement.startswith('SELECT intent_name, patterns, responses FROM intents'):
+            columns = ['intent_name', 'patterns', 'responses']
+            return columns, [tuple(row[c] for c in columns) for row in self.intents]
+        if statement.startswith('SELECT id, keyword, response, confidence, category FROM knowledge_base'):
+            columns = ['id', 'keyword', 'response', 'confidence', 'category']
+            return columns, [tuple(row[c] for c in columns) for row in self.knowledge]
+        if statement.startswith('SELECT record_conversation('):
+            with self.lock:
+                conversation_id = len(self.conversations) + 1
+                self.conversations.append((conversation_id, datetime.now()) + tuple(params))
+            return ['record_conversation'], [(conversation_id,)]
+        if statement.startswith('SELECT sentiment, intent, timestamp FROM conversations WHERE user_id = %s'):
+            user_id, limit = params
+            with self.lock:
+                rows = [row for row in self.conversations if row[2] == user_id]
+            # (id, timestamp, user_id, user_message, bot_response, session_id, sentiment, intent)
+            rows = [(row[6], row[7], row[1]) for row in reversed(rows[-limit:])]
+            return ['sentiment', 'intent', 'timestamp'], rows
+        if statement.startswith('SELECT ensure_conversation_partitions('):
+            return ['ensure_conversation_partitions'], [(0,)]
+        raise NotImplementedError(f"fake_db は次のSQLに対応していません: {statement[:80]}")
+
+
+class FakeCursor:
+    def __init__(self, database, as_dict):
+        self.database = database
+        self.as_dict = as_dict
+        self.rows = []
+
+    def execute(self, sql, params=None):
+        columns, rows = self.database.execute(sql, params)
+        self.rows = [dict(zip(columns, row)) for row in rows] if self.as_dict else rows
+
+    def fetchone(self):
+        return self.rows[0] if self.rows else None
+
+    def fetchall(self):
+        return list(self.rows)
+
+    def close(self):
+        pass
+
+
+class FakeConnection:
+    def __init__(self, database):
+        self.database = database
+
+    def cursor(self, cursor_factory=None):
+        return FakeCursor(self.database, as_dict=cursor_factory is not None)
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+class FakePool:
+    """ConnectionPool と同じインターフェースのプール"""
+
+    def __init__(self, database):
+        self.connection_obj = FakeConnection(database)
+
+    @contextmanager
+    def connection(self, autocommit=False):
+        yield self.connection_obj
+
+    def getconn(self):
+        return self.connection_obj
+
+    def putconn(self, conn, discard=False):
+        pass
+
+    def closeall(self):
+        pass
+
+    def get_stats(self):
+        return {'fake': True}
+
+
+def install(chatbot, path=INIT_SQL):
+    """ChatBot のDBアクセスをメモリ上のデータベースに差し替える"""
+    database = FakeDatabase(*load_seed_data(path))
+    pool = FakePool(database)
+    chatbot.pool = pool
+    chatbot.writer.pool = pool
+    chatbot.router.primary = pool
+    # LISTEN用の専用接続と非同期書き込み（execute_values）は使わない
+    chatbot.catalog.listen = False
+    chatbot.write_mode = 'sync'
+    chatbot.catalog.invalidate()
+    return database
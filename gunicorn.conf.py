@@ -0,0 +1,35 @@
+"""Gunicorn設定
+
+gevent ワーカーで動かし、WebSocket（/chat/ws）の待機中の接続はOSスレッドではなく
+グリーンレットで保持する。psycopg2 は psycogreen でノンブロッキングにする。
+
+    gunicorn -c gunicorn.conf.py app:app
+"""
+import multiprocessing
+import os
+
+bind = os.environ.get('GUNICORN_BIND', '0.0.0.0:5000')
+worker_class = os.environ.get('GUNICORN_WORKER_CLASS', 'gevent')
+workers = int(os.environ.get('GUNICORN_WORKERS', str(min(multiprocessing.cpu_count(), 4))))
+# 1ワーカーあたりの同時接続数（WebSocketの常時接続を含む）
+worker_connections = int(os.environ.get('GUNICORN_WORKER_CONNECTIONS', '1000'))
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', '30'))
+graceful_timeout = int(os.environ.get('GUNICORN_GRACEFUL_TIMEOUT', '30'))
+keepalive = int(os.environ.get('GUNICORN_KEEPALIVE', '5'))
+# アクセスログはリクエストごとの同期書き込みになるため既定では出力しない（'-' で標準出力）
+accesslog = os.environ.get('GUNICORN_ACCESS_LOG') or None
+loglevel = os.environ.get('LOG_LEVEL', 'info').lower()
+
+
+def post_fork(server, worker):
+    """DB待ちの間に他の接続を処理できるよう psycopg2 を gevent に対応させる"""
+    if worker_class == 'gevent':
+        from psycogreen.gevent import patch_psycopg
+        patch_psycopg()
+
+
+def post_worker_init(worker):
+    """受付開始前に辞書・カタログ・モデルを読み込む"""
+    if os.environ.get('WARM_UP_ON_START', '1') == '1':
+        import app
+        app.warm_up()
@@ -1,15 +1,145 @@
 -- データベース初期化スクリプト
 
--- 会話履歴テーブル
+-- 会話履歴テーブル（timestamp で月別にパーティション分割）
 CREATE TABLE IF NOT EXISTS conversations (
-    id SERIAL PRIMARY KEY,
+    id SERIAL,
     user_id VARCHAR(255) NOT NULL,
     user_message TEXT NOT NULL,
     bot_response TEXT NOT NULL,
-    timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    timestamp TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
     session_id VARCHAR(255),
     sentiment VARCHAR(20),
-    intent VARCHAR(100)
+    intent VARCHAR(100),
+    PRIMARY KEY (id, timestamp)
+) PARTITION BY RANGE (timestamp);
+
+-- どの月にも該当しない行の受け皿（月別パーティションの作成時に移動する）
+CREATE TABLE IF NOT EXISTS conversations_default PARTITION OF conversations DEFAULT;
+
+-- 月別パーティションを作成（from_date の月から今月+months_ahead か月先まで、既存はそのまま）
+-- 既定パーティションに該当月の行が入っていれば、新しいパーティションへ移してから追加する
+CREATE OR REPLACE FUNCTION ensure_conversation_partitions(
+    months_ahead integer DEFAULT 3,
+    from_date date DEFAULT CURRENT_DATE
+) RETURNS integer AS $$
+DECLARE
+    part_start date := date_trunc('month', from_date)::date;
+    last_start date := (date_trunc('month', CURRENT_DATE) + make_interval(months => months_ahead))::date;
+    part_end date;
+    part_name text;
+    created integer := 0;
+BEGIN
+    -- 複数のワーカーが同時に実行しても同じパーティションを二重に作らない
+    PERFORM pg_advisory_xact_lock(hashtext('ensure_conversation_partitions'));
+    WHILE part_start <= last_start LOOP
+        part_end := (part_start + interval '1 month')::date;
+        part_name := format('conversations_%s', to_char(part_start, 'YYYY_MM'));
+        IF to_regclass(part_name) IS NULL THEN
+            IF EXISTS (SELECT 1 FROM conversations_default WHERE timestamp >= part_start AND timestamp < part_end) THEN
+                EXECUTE format('CREATE TABLE %I (LIKE conversations INCLUDING DEFAULTS INCLUDING CONSTRAINTS)', part_name);
+                EXECUTE format(
+                    'WITH moved AS (DELETE FROM conversations_default WHERE timestamp >= %L AND timestamp < %L RETURNING *) '
+                    'INSERT INTO %I SELECT * FROM moved', part_start, part_end, part_name);
+                EXECUTE format('ALTER TABLE conversations ATTACH PARTITION %I FOR VALUES FROM (%L) TO (%L)',
+                               part_name, part_start, part_end);
+            ELSE
+                EXECUTE format('CREATE TABLE %I PARTITION OF conversations FOR VALUES FROM (%L) TO (%L)',
+                               part_name, part_start, part_end);
+            END IF;
+            created := created + 1;
+        END IF;
+        part_start := part_end;
+    END LOOP;
+    RETURN created;
+END;
+$$ LANGUAGE plpgsql;
+
+SELECT ensure_conversation_partitions();
+
+-- 会話を1件保存して id を返す（/chat の1ターンの書き込みを1回の呼び出しで済ませる）
+-- 関数内の INSERT は接続ごとに実行計画がキャッシュされ、毎回の解析・計画が不要になる
+CREATE OR REPLACE FUNCTION record_conversation(
+    p_user_id varchar,
+    p_user_message text,
+    p_bot_response text,
+    p_session_id varchar,
+    p_sentiment varchar,
+    p_intent varchar
+) RETURNS integer AS $$
+DECLARE
+    new_id integer;
+BEGIN
+    INSERT INTO conversations (user_id, user_message, bot_response, session_id, sentiment, intent)
+    VALUES (p_user_id, p_user_message, p_bot_response, p_session_id, p_sentiment, p_intent)
+    RETURNING id INTO new_id;
+    RETURN new_id;
+END;
+$$ LANGUAGE plpgsql;
+
+-- ユーザー別の会話集計テーブル（/analytics 用、conversations のトリガーで更新）
+CREATE TABLE IF NOT EXISTS user_analytics (
+    user_id VARCHAR(255) NOT NULL,
+    kind VARCHAR(20) NOT NULL,     -- 'sentiment' または 'intent'
+    label VARCHAR(100) NOT NULL,   -- 感情名またはインテント名
+    count BIGINT NOT NULL DEFAULT 0,
+    PRIMARY KEY (user_id, kind, label)
+);
+
+-- 文ごとに変更行をまとめて集計し、差分だけを加算する
+CREATE OR REPLACE FUNCTION update_user_analytics() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        INSERT INTO user_analytics AS ua (user_id, kind, label, count)
+        SELECT user_id, kind, label, -SUM(n) FROM (
+            SELECT user_id, 'sentiment' AS kind, sentiment AS label, 1 AS n FROM old_rows WHERE sentiment IS NOT NULL
+            UNION ALL
+            SELECT user_id, 'intent', intent, 1 FROM old_rows WHERE intent IS NOT NULL
+        ) deltas
+        GROUP BY user_id, kind, label
+        ORDER BY user_id, kind, label  -- 同時更新時のデッドロックを避けるため行ロックの順序を固定
+        ON CONFLICT (user_id, kind, label) DO UPDATE SET count = ua.count + EXCLUDED.count;
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        INSERT INTO user_analytics AS ua (user_id, kind, label, count)
+        SELECT user_id, kind, label, SUM(n) FROM (
+            SELECT user_id, 'sentiment' AS kind, sentiment AS label, 1 AS n FROM new_rows WHERE sentiment IS NOT NULL
+            UNION ALL
+            SELECT user_id, 'intent', intent, 1 FROM new_rows WHERE intent IS NOT NULL
+        ) deltas
+        GROUP BY user_id, kind, label
+        ORDER BY user_id, kind, label
+        ON CONFLICT (user_id, kind, label) DO UPDATE SET count = ua.count + EXCLUDED.count;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_conversations_analytics_insert ON conversations;
+CREATE TRIGGER trg_conversations_analytics_insert
+    AFTER INSERT ON conversations
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION update_user_analytics();
+
+DROP TRIGGER IF EXISTS trg_conversations_analytics_update ON conversations;
+CREATE TRIGGER trg_conversations_analytics_update
+    AFTER UPDATE ON conversations
+    REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION update_user_analytics();
+
+DROP TRIGGER IF EXISTS trg_conversations_analytics_delete ON conversations;
+CREATE TRIGGER trg_conversations_analytics_delete
+    AFTER DELETE ON conversations
+    REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION update_user_analytics();
+
+-- 会話の再解析ジョブ（reanalyze-conversations）の進捗。処理済みの最大 id を記録し、中断後はその次から再開する
+CREATE TABLE IF NOT EXISTS reanalysis_checkpoints (
+    job_name VARCHAR(100) PRIMARY KEY,
+    last_id BIGINT NOT NULL,          -- 処理済みの最大 id
+    end_id BIGINT NOT NULL,           -- 開始時点の最大 id（これ以降の会話は対象外）
+    rows_scanned BIGINT NOT NULL DEFAULT 0,
+    rows_updated BIGINT NOT NULL DEFAULT 0,
+    updated_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
 );
 
 -- 知識ベーステーブル
@@ -34,17 +164,37 @@ CREATE TABLE IF NOT EXISTS users (
 -- インテントテーブル（意図分類用）
 CREATE TABLE IF NOT EXISTS intents (
     id SERIAL PRIMARY KEY,
-    intent_name VARCHAR(100) NOT NULL,
+    -- 一括読み込みやシードの ON CONFLICT (intent_name) で上書きするため一意にする
+    intent_name VARCHAR(100) NOT NULL UNIQUE,
     patterns TEXT[] NOT NULL,
     responses TEXT[] NOT NULL,
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
 );
 
 -- インデックス作成
-CREATE INDEX IF NOT EXISTS idx_conversations_user_id ON conversations(user_id);
-CREATE INDEX IF NOT EXISTS idx_conversations_timestamp ON conversations(timestamp);
+-- 履歴のキーセットページング用（user_id単独の検索もこのインデックスで賄う）
+CREATE INDEX IF NOT EXISTS idx_conversations_user_timestamp ON conversations(user_id, timestamp DESC, id DESC);
+-- 挿入順と時刻がほぼ一致するため、時刻の範囲検索は小さなBRINで足りる
+CREATE INDEX IF NOT EXISTS idx_conversations_timestamp_brin ON conversations USING brin (timestamp);
 CREATE INDEX IF NOT EXISTS idx_knowledge_keyword ON knowledge_base(keyword);
-CREATE INDEX IF NOT EXISTS idx_intents_name ON intents(intent_name);
+
+-- カタログ変更通知（アプリのインテント・知識ベースキャッシュを更新させる）
+CREATE OR REPLACE FUNCTION notify_catalog_change() RETURNS trigger AS $$
+BEGIN
+    PERFORM pg_notify('catalog_changed', TG_TABLE_NAME);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_intents_catalog_change ON intents;
+CREATE TRIGGER trg_intents_catalog_change
+    AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON intents
+    FOR EACH STATEMENT EXECUTE FUNCTION notify_catalog_change();
+
+DROP TRIGGER IF EXISTS trg_knowledge_catalog_change ON knowledge_base;
+CREATE TRIGGER trg_knowledge_catalog_change
+    AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON knowledge_base
+    FOR EACH STATEMENT EXECUTE FUNCTION notify_catalog_change();
 
 -- 初期データ挿入
 INSERT INTO knowledge_base (keyword, response, category) VALUES
@@ -0,0 +1,58 @@
+-- 既存データベース向け: ユーザー別の会話集計テーブルとトリガーを追加
+-- 適用後に `make db-backfill-analytics` で既存の会話を集計すること
+
+-- ユーザー別の会話集計テーブル（/analytics 用、conversations のトリガーで更新）
+CREATE TABLE IF NOT EXISTS user_analytics (
+    user_id VARCHAR(255) NOT NULL,
+    kind VARCHAR(20) NOT NULL,     -- 'sentiment' または 'intent'
+    label VARCHAR(100) NOT NULL,   -- 感情名またはインテント名
+    count BIGINT NOT NULL DEFAULT 0,
+    PRIMARY KEY (user_id, kind, label)
+);
+
+-- 文ごとに変更行をまとめて集計し、差分だけを加算する
+CREATE OR REPLACE FUNCTION update_user_analytics() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        INSERT INTO user_analytics AS ua (user_id, kind, label, count)
+        SELECT user_id, kind, label, -SUM(n) FROM (
+            SELECT user_id, 'sentiment' AS kind, sentiment AS label, 1 AS n FROM old_rows WHERE sentiment IS NOT NULL
+            UNION ALL
+            SELECT user_id, 'intent', intent, 1 FROM old_rows WHERE intent IS NOT NULL
+        ) deltas
+        GROUP BY user_id, kind, label
+        ORDER BY user_id, kind, label  -- 同時更新時のデッドロックを避けるため行ロックの順序を固定
+        ON CONFLICT (user_id, kind, label) DO UPDATE SET count = ua.count + EXCLUDED.count;
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        INSERT INTO user_analytics AS ua (user_id, kind, label, count)
+        SELECT user_id, kind, label, SUM(n) FROM (
+            SELECT user_id, 'sentiment' AS kind, sentiment AS label, 1 AS n FROM new_rows WHERE sentiment IS NOT NULL
+            UNION ALL
+            SELECT user_id, 'intent', intent, 1 FROM new_rows WHERE intent IS NOT NULL
+        ) deltas
+        GROUP BY user_id, kind, label
+        ORDER BY user_id, kind, label
+        ON CONFLICT (user_id, kind, label) DO UPDATE SET count = ua.count + EXCLUDED.count;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_conversations_analytics_insert ON conversations;
+CREATE TRIGGER trg_conversations_analytics_insert
+    AFTER INSERT ON conversations
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION update_user_analytics();
+
+DROP TRIGGER IF EXISTS trg_conversations_analytics_update ON conversations;
+CREATE TRIGGER trg_conversations_analytics_update
+    AFTER UPDATE ON conversations
+    REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION update_user_analytics();
+
+DROP TRIGGER IF EXISTS trg_conversations_analytics_delete ON conversations;
+CREATE TRIGGER trg_conversations_analytics_delete
+    AFTER DELETE ON conversations
+    REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION update_user_analytics();
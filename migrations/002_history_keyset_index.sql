@@ -0,0 +1,5 @@
+-- 既存データベース向け: 会話履歴のキーセットページング用の複合インデックス
+-- user_id 単独のインデックスは複合インデックスの先頭列で代替できるため削除する
+
+CREATE INDEX IF NOT EXISTS idx_conversations_user_timestamp ON conversations(user_id, timestamp DESC, id DESC);
+DROP INDEX IF EXISTS idx_conversations_user_id;
@@ -0,0 +1,107 @@
+-- 既存データベース向け: conversations を月別パーティションのテーブルに移行する
+-- 移行中は conversations への読み書きが止まる（件数に比例して時間がかかるため、メンテナンス時間に実行すること）
+-- 既にパーティション化されている場合はパーティションの追加だけを行う
+
+BEGIN;
+
+-- 月別パーティションを作成（from_date の月から今月+months_ahead か月先まで、既存はそのまま）
+-- 既定パーティションに該当月の行が入っていれば、新しいパーティションへ移してから追加する
+CREATE OR REPLACE FUNCTION ensure_conversation_partitions(
+    months_ahead integer DEFAULT 3,
+    from_date date DEFAULT CURRENT_DATE
+) RETURNS integer AS $$
+DECLARE
+    part_start date := date_trunc('month', from_date)::date;
+    last_start date := (date_trunc('month', CURRENT_DATE) + make_interval(months => months_ahead))::date;
+    part_end date;
+    part_name text;
+    created integer := 0;
+BEGIN
+    -- 複数のワーカーが同時に実行しても同じパーティションを二重に作らない
+    PERFORM pg_advisory_xact_lock(hashtext('ensure_conversation_partitions'));
+    WHILE part_start <= last_start LOOP
+        part_end := (part_start + interval '1 month')::date;
+        part_name := format('conversations_%s', to_char(part_start, 'YYYY_MM'));
+        IF to_regclass(part_name) IS NULL THEN
+            IF EXISTS (SELECT 1 FROM conversations_default WHERE timestamp >= part_start AND timestamp < part_end) THEN
+                EXECUTE format('CREATE TABLE %I (LIKE conversations INCLUDING DEFAULTS INCLUDING CONSTRAINTS)', part_name);
+                EXECUTE format(
+                    'WITH moved AS (DELETE FROM conversations_default WHERE timestamp >= %L AND timestamp < %L RETURNING *) '
+                    'INSERT INTO %I SELECT * FROM moved', part_start, part_end, part_name);
+                EXECUTE format('ALTER TABLE conversations ATTACH PARTITION %I FOR VALUES FROM (%L) TO (%L)',
+                               part_name, part_start, part_end);
+            ELSE
+                EXECUTE format('CREATE TABLE %I PARTITION OF conversations FOR VALUES FROM (%L) TO (%L)',
+                               part_name, part_start, part_end);
+            END IF;
+            created := created + 1;
+        END IF;
+        part_start := part_end;
+    END LOOP;
+    RETURN created;
+END;
+$$ LANGUAGE plpgsql;
+
+DO $$
+DECLARE
+    oldest date;
+BEGIN
+    IF (SELECT relkind FROM pg_class WHERE oid = 'conversations'::regclass) = 'p' THEN
+        RETURN;
+    END IF;
+
+    LOCK TABLE conversations IN ACCESS EXCLUSIVE MODE;
+    ALTER TABLE conversations RENAME TO conversations_unpartitioned;
+    ALTER TABLE conversations_unpartitioned RENAME CONSTRAINT conversations_pkey TO conversations_unpartitioned_pkey;
+    -- IDの採番は既存のシーケンスを引き継ぐ
+    ALTER SEQUENCE conversations_id_seq OWNED BY NONE;
+
+    CREATE TABLE conversations (
+        id INTEGER NOT NULL DEFAULT nextval('conversations_id_seq'),
+        user_id VARCHAR(255) NOT NULL,
+        user_message TEXT NOT NULL,
+        bot_response TEXT NOT NULL,
+        timestamp TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+        session_id VARCHAR(255),
+        sentiment VARCHAR(20),
+        intent VARCHAR(100),
+        PRIMARY KEY (id, timestamp)
+    ) PARTITION BY RANGE (timestamp);
+    ALTER SEQUENCE conversations_id_seq OWNED BY conversations.id;
+    CREATE TABLE conversations_default PARTITION OF conversations DEFAULT;
+
+    SELECT COALESCE(MIN(timestamp), CURRENT_TIMESTAMP)::date INTO oldest FROM conversations_unpartitioned;
+    PERFORM ensure_conversation_partitions(3, oldest);
+
+    -- 集計トリガーはコピー後に作成する（user_analytics は既存の値をそのまま使う）
+    INSERT INTO conversations (id, user_id, user_message, bot_response, timestamp, session_id, sentiment, intent)
+    SELECT id, user_id, user_message, bot_response, COALESCE(timestamp, CURRENT_TIMESTAMP), session_id, sentiment, intent
+    FROM conversations_unpartitioned;
+
+    DROP TABLE conversations_unpartitioned;
+END $$;
+
+CREATE INDEX IF NOT EXISTS idx_conversations_user_timestamp ON conversations(user_id, timestamp DESC, id DESC);
+CREATE INDEX IF NOT EXISTS idx_conversations_timestamp_brin ON conversations USING brin (timestamp);
+
+DROP TRIGGER IF EXISTS trg_conversations_analytics_insert ON conversations;
+CREATE TRIGGER trg_conversations_analytics_insert
+    AFTER INSERT ON conversations
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION update_user_analytics();
+
+DROP TRIGGER IF EXISTS trg_conversations_analytics_update ON conversations;
+CREATE TRIGGER trg_conversations_analytics_update
+    AFTER UPDATE ON conversations
+    REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION update_user_analytics();
+
+DROP TRIGGER IF EXISTS trg_conversations_analytics_delete ON conversations;
+CREATE TRIGGER trg_conversations_analytics_delete
+    AFTER DELETE ON conversations
+    REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION update_user_analytics();
+
+SELECT ensure_conversation_partitions();
+
+COMMIT;
@@ -0,0 +1,23 @@
+-- 既存データベース向け: intent_name を一意にする
+-- init.sql のシードや一括読み込みは ON CONFLICT (intent_name) で上書きするため、一意制約が必要
+-- 重複している場合は最後に登録された行（id が最大）を残す
+
+DELETE FROM intents a
+USING intents b
+WHERE a.intent_name = b.intent_name
+  AND a.id < b.id;
+
+DO $$
+BEGIN
+    IF NOT EXISTS (
+        SELECT 1 FROM pg_constraint
+        WHERE conrelid = 'intents'::regclass AND contype = 'u'
+          AND conname = 'intents_intent_name_key'
+    ) THEN
+        ALTER TABLE intents ADD CONSTRAINT intents_intent_name_key UNIQUE (intent_name);
+    END IF;
+END
+$$;
+
+-- 一意制約のインデックスで検索できるため、重複するインデックスは削除する
+DROP INDEX IF EXISTS idx_intents_name;
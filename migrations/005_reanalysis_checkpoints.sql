@@ -0,0 +1,10 @@
+-- 既存データベース向け: 会話の再解析ジョブ（reanalyze-conversations）の進捗テーブル
+
+CREATE TABLE IF NOT EXISTS reanalysis_checkpoints (
+    job_name VARCHAR(100) PRIMARY KEY,
+    last_id BIGINT NOT NULL,          -- 処理済みの最大 id
+    end_id BIGINT NOT NULL,           -- 開始時点の最大 id（これ以降の会話は対象外）
+    rows_scanned BIGINT NOT NULL DEFAULT 0,
+    rows_updated BIGINT NOT NULL DEFAULT 0,
+    updated_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
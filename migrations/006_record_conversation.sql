@@ -0,0 +1,21 @@
+-- 既存データベース向け: 会話を1回の呼び出しで保存する関数（/chat の書き込みで使用）
+
+-- 会話を1件保存して id を返す（/chat の1ターンの書き込みを1回の呼び出しで済ませる）
+-- 関数内の INSERT は接続ごとに実行計画がキャッシュされ、毎回の解析・計画が不要になる
+CREATE OR REPLACE FUNCTION record_conversation(
+    p_user_id varchar,
+    p_user_message text,
+    p_bot_response text,
+    p_session_id varchar,
+    p_sentiment varchar,
+    p_intent varchar
+) RETURNS integer AS $$
+DECLARE
+    new_id integer;
+BEGIN
+    INSERT INTO conversations (user_id, user_message, bot_response, session_id, sentiment, intent)
+    VALUES (p_user_id, p_user_message, p_bot_response, p_session_id, p_sentiment, p_intent)
+    RETURNING id INTO new_id;
+    RETURN new_id;
+END;
+$$ LANGUAGE plpgsql;
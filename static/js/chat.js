@@ -17,8 +17,103 @@ document.addEventListener("DOMContentLoaded", function () {
 
   // 初期状態でステータスインジケーターを更新
   updateStatusIndicators("neutral", "unknown");
+
+  // 常時接続のチャットチャネルを開く
+  connectChatSocket();
 });
 
+// 常時接続のチャット（WebSocket）。使えない場合は /chat へのPOSTで送信する
+const chatSocket = {
+  ws: null,
+  ready: false,
+  retryDelay: 1000,
+};
+
+function connectChatSocket() {
+  if (!("WebSocket" in window)) return;
+
+  const protocol = window.location.protocol === "https:" ? "wss:" : "ws:";
+  const ws = new WebSocket(protocol + "//" + window.location.host + "/chat/ws");
+  chatSocket.ws = ws;
+
+  ws.onmessage = function (event) {
+    handleChatEvent(JSON.parse(event.data));
+  };
+
+  ws.onclose = function () {
+    const wasWaiting = chatSocket.ready && isWaitingForResponse();
+    chatSocket.ready = false;
+    if (wasWaiting) {
+      finishSending();
+      addMessage(
+        "bot",
+        "接続が切断されました。しばらく待ってから再試行してください。"
+      );
+    }
+    // 再接続（間隔は最大30秒まで倍々に延ばす）
+    setTimeout(connectChatSocket, chatSocket.retryDelay);
+    chatSocket.retryDelay = Math.min(chatSocket.retryDelay * 2, 30000);
+  };
+}
+
+function handleChatEvent(data) {
+  switch (data.type) {
+    case "ready":
+      chatSocket.ready = true;
+      chatSocket.retryDelay = 1000;
+      break;
+    case "response":
+      showBotResponse(data);
+      finishSending();
+      break;
+    case "history":
+      // 読み込み済みの履歴に差分を追加
+      if (historyState.latest !== null) {
+        historyState.conversations.push(...data.conversations.reverse());
+        if (data.latest) {
+          historyState.latest = data.latest;
+        }
+      }
+      break;
+    case "analytics":
+      showLoading(false);
+      displayAnalytics(data);
+      break;
+    case "error":
+      showLoading(false);
+      if (isWaitingForResponse()) {
+        addMessage("bot", "エラーが発生しました: " + data.error);
+        finishSending();
+      }
+      break;
+  }
+}
+
+function isWaitingForResponse() {
+  return document.getElementById("sendButton").disabled;
+}
+
+function showBotResponse(data) {
+  // ボットの応答を表示（分析情報付き）
+  addMessage("bot", data.response, {
+    sentiment: data.sentiment,
+    intent: data.intent,
+  });
+
+  // ステータスインジケーターを更新
+  updateStatusIndicators(data.sentiment, data.intent);
+}
+
+function finishSending() {
+  // ローディング非表示
+  showLoading(false);
+
+  // 送信ボタンを有効化
+  const sendButton = document.getElementById("sendButton");
+  sendButton.disabled = false;
+  document.getElementById("messageInput").focus();
+}
+
 async function sendMessage() {
   const messageInput = document.getElementById("messageInput");
   const message = messageInput.value.trim();
@@ -36,6 +131,16 @@ async function sendMessage() {
   // ローディング表示
   showLoading(true);
 
+  if (chatSocket.ready) {
+    // 応答と履歴の差分は handleChatEvent で受け取る
+    const event = { type: "message", message: message };
+    if (historyState.latest !== null) {
+      event.since = historyState.latest;
+    }
+    chatSocket.ws.send(JSON.stringify(event));
+    return;
+  }
+
   try {
     const response = await fetch("/chat", {
       method: "POST",
@@ -48,14 +153,7 @@ async function sendMessage() {
     const data = await response.json();
 
     if (response.ok) {
-      // ボットの応答を表示（分析情報付き）
-      addMessage("bot", data.response, {
-        sentiment: data.sentiment,
-        intent: data.intent,
-      });
-
-      // ステータスインジケーターを更新
-      updateStatusIndicators(data.sentiment, data.intent);
+      showBotResponse(data);
     } else {
       addMessage(
         "bot",
@@ -70,12 +168,7 @@ async function sendMessage() {
     );
   }
 
-  // ローディング非表示
-  showLoading(false);
-
-  // 送信ボタンを有効化
-  sendButton.disabled = false;
-  messageInput.focus();
+  finishSending();
 }
 
 function addMessage(sender, text, analysis = null) {
@@ -177,31 +270,92 @@ function clearChat() {
   updateStatusIndicators("neutral", "unknown");
 }
 
+// 読み込み済みの履歴（新しい会話だけを since カーソルで追加取得する）
+const historyState = {
+  conversations: [], // 古い順
+  latest: null,
+  nextBefore: null,
+};
+
+async function fetchHistory(params) {
+  const query = new URLSearchParams(params).toString();
+  const response = await fetch("/history" + (query ? "?" + query : ""));
+  if (response.status === 304) {
+    return { conversations: [], latest: null, next_before: undefined };
+  }
+  const data = await response.json();
+  if (!response.ok) {
+    throw new Error(data.error || "履歴の取得に失敗しました");
+  }
+  return data;
+}
+
+function renderHistory() {
+  const chatMessages = document.getElementById("chatMessages");
+  chatMessages.innerHTML = "";
+
+  if (historyState.nextBefore) {
+    const olderButton = document.createElement("button");
+    olderButton.className = "action-button history-button";
+    olderButton.textContent = "さらに古い履歴を読み込む";
+    olderButton.onclick = loadOlderHistory;
+    chatMessages.appendChild(olderButton);
+  }
+
+  if (historyState.conversations.length === 0) {
+    addMessage("bot", "履歴がありません。新しい会話を始めましょう！");
+    return;
+  }
+  historyState.conversations.forEach((conv) => {
+    addMessage("user", conv.user_message);
+    addMessage("bot", conv.bot_response, {
+      sentiment: conv.sentiment,
+      intent: conv.intent,
+    });
+  });
+}
+
 async function loadHistory() {
   showLoading(true);
 
   try {
-    const response = await fetch("/history");
-    const data = await response.json();
-
-    if (response.ok) {
-      const chatMessages = document.getElementById("chatMessages");
-      chatMessages.innerHTML = "";
-
-      if (data.conversations.length === 0) {
-        addMessage("bot", "履歴がありません。新しい会話を始めましょう！");
-      } else {
-        data.conversations.reverse().forEach((conv) => {
-          addMessage("user", conv.user_message);
-          addMessage("bot", conv.bot_response, {
-            sentiment: conv.sentiment,
-            intent: conv.intent,
-          });
-        });
-      }
+    if (historyState.latest === null) {
+      // 初回は最新のページを取得
+      const data = await fetchHistory({});
+      historyState.conversations = data.conversations.reverse();
+      historyState.latest = data.latest;
+      historyState.nextBefore = data.next_before;
     } else {
-      addMessage("bot", "履歴の読み込みに失敗しました。");
+      // 2回目以降は前回以降の新しい会話だけを取得
+      let data;
+      do {
+        data = await fetchHistory({ since: historyState.latest });
+        historyState.conversations.push(...data.conversations.reverse());
+        if (data.latest) {
+          historyState.latest = data.latest;
+        }
+      } while (data.has_more_newer);
+    }
+    renderHistory();
+  } catch (error) {
+    console.error("Error loading history:", error);
+    addMessage("bot", "履歴の読み込み中にエラーが発生しました。");
+  }
+
+  showLoading(false);
+}
+
+async function loadOlderHistory() {
+  if (!historyState.nextBefore) return;
+  showLoading(true);
+
+  try {
+    const data = await fetchHistory({ before: historyState.nextBefore });
+    historyState.conversations.unshift(...data.conversations.reverse());
+    if (data.next_before !== undefined) {
+      historyState.nextBefore = data.next_before;
     }
+    renderHistory();
   } catch (error) {
     console.error("Error loading history:", error);
     addMessage("bot", "履歴の読み込み中にエラーが発生しました。");
@@ -213,6 +367,12 @@ async function loadHistory() {
 async function showAnalytics() {
   showLoading(true);
 
+  if (chatSocket.ready) {
+    // 結果は handleChatEvent で受け取る
+    chatSocket.ws.send(JSON.stringify({ type: "analytics" }));
+    return;
+  }
+
   try {
     const response = await fetch("/analytics");
     const data = await response.json();
@@ -0,0 +1,180 @@
+"""コンパイル済みマッチャー・感情辞書と、従来の判定方法（参照実装）の判定結果が一致するかの検証
+
+    python -m pytest tests
+
+init.sql の初期データのインテントと、語彙を組み合わせて生成したメッセージで照合する（DB不要）。
+参照実装は置き換え前の走査をそのまま残したもので、アプリからは呼ばれない。
+"""
+import os
+import random
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app  # noqa: E402
+from benchmarks.fake_db import load_seed_data  # noqa: E402
+
+SAMPLES = 2000
+SEED = 0
+FILLERS = ['', 'です', 'ね', '！', '？', '今日は', 'とても', 'BOT', 'Thx', ' ', 'あなたは誰？']
+NEGATION_FILLERS = ['ない', 'じゃない', 'ません', 'なかった', 'んです']
+
+
+def reference_keyword_sentiment(analyzer, text):
+    """keyword 方式の参照実装（単語ごとに部分一致を数える）"""
+    text_lower = text.lower()
+    positive_score = sum(1 for word in analyzer.positive_words if word in text_lower)
+    negative_score = sum(1 for word in analyzer.negative_words if word in text_lower)
+
+    if positive_score > negative_score:
+        return 'positive'
+    elif negative_score > positive_score:
+        return 'negative'
+    else:
+        return 'neutral'
+
+
+def reference_lexicon_score(lexicon, lemmas):
+    """lexicon 方式のスコアの参照実装（トークンごとの走査）"""
+    ids = [lexicon.index.get(lemma, 0) for lemma in lemmas]
+    score = 0.0
+    for position, key in enumerate(ids):
+        weight = float(lexicon.polarity[key])
+        if not weight:
+            continue
+        for distance in range(1, lexicon.INTENSIFIER_WINDOW + 1):
+            if position >= distance:
+                weight *= float(lexicon.multiplier[ids[position - distance]])
+        following = ids[position + 1:position + 1 + lexicon.negation_window]
+        if sum(bool(lexicon.negator[other]) for other in following) % 2:
+            weight = -weight
+        score += weight
+    return score
+
+
+def reference_lexicon_sentiment(analyzer, text):
+    score = reference_lexicon_score(analyzer.sentiment_lexicon, analyzer.lemmatize(text))
+    if score > app.SentimentLexicon.NEUTRAL_EPSILON:
+        return 'positive'
+    elif score < -app.SentimentLexicon.NEUTRAL_EPSILON:
+        return 'negative'
+    else:
+        return 'neutral'
+
+
+def is_question_about(analyzer, text, intent_name):
+    for name, indicators in analyzer.QUESTION_INDICATORS:
+        if name == intent_name:
+            return any(indicator in text for indicator in indicators)
+    return False
+
+
+def reference_classify_intent(analyzer, text, intents_data):
+    """意図分類の参照実装（インテントごと・パターンごとの走査）"""
+    if not intents_data:
+        return 'unknown'
+
+    text_lower = text.lower()
+    best_intent = 'unknown'
+    highest_score = 0
+
+    for intent_data in intents_data:
+        intent_name = intent_data['intent_name']
+        patterns = intent_data['patterns']
+
+        score = 0
+
+        # 完全一致
+        for pattern in patterns:
+            if pattern.lower() in text_lower:
+                score += 10
+
+        # 部分一致
+        for pattern in patterns:
+            for word in pattern.lower().split():
+                if word in text_lower:
+                    score += 2
+
+        # 特定の質問パターン
+        specific = analyzer.SPECIFIC_PATTERNS.get(intent_name)
+        if specific and any(pattern in text_lower for pattern in specific):
+            score += 15
+
+        if score > highest_score:
+            highest_score = score
+            best_intent = intent_name
+
+    # 明確な質問パターンを優先
+    for intent_name in ('food', 'name', 'weather', 'time'):
+        if is_question_about(analyzer, text_lower, intent_name):
+            return intent_name
+
+    return best_intent if highest_score > 0 else 'unknown'
+
+
+REFERENCE_SENTIMENT = {
+    'keyword': reference_keyword_sentiment,
+    'lexicon': reference_lexicon_sentiment,
+}
+
+
+@pytest.fixture(scope='module')
+def intents_data():
+    return load_seed_data()[0]
+
+
+@pytest.fixture(scope='module')
+def messages(intents_data):
+    """両方の方式の語彙・インテントのパターン・質問パターンを組み合わせたメッセージ"""
+    keyword = app.AIMessageAnalyzer('keyword')
+    lexicon = app.AIMessageAnalyzer('lexicon')
+
+    vocabulary = set(keyword.positive_words) | set(keyword.negative_words)
+    vocabulary.update(lexicon.sentiment_weights)
+    vocabulary.update(lexicon.sentiment_intensifiers)
+    vocabulary.update(NEGATION_FILLERS)
+    for intent_data in intents_data:
+        for pattern in intent_data['patterns']:
+            vocabulary.add(pattern)
+            vocabulary.update(pattern.split())
+    for patterns in keyword.SPECIFIC_PATTERNS.values():
+        vocabulary.update(patterns)
+    for _, indicators in keyword.QUESTION_INDICATORS:
+        vocabulary.update(indicators)
+    vocabulary = sorted(vocabulary)
+
+    rng = random.Random(SEED)
+    result = list(vocabulary)
+    result += [f"{rng.choice(FILLERS)}{word}{rng.choice(FILLERS)}" for word in vocabulary]
+    for _ in range(SAMPLES):
+        words = rng.sample(vocabulary, k=min(len(vocabulary), rng.randint(1, 4)))
+        result.append(rng.choice(FILLERS).join(words))
+    result += ['', 'こんにちは、好きな食べ物は？', '今日は雨で悲しいけど、ありがとう', 'あなたの名前は何ですか']
+    return result
+
+
+def test_seed_intents_loaded(intents_data):
+    # インテントが空だと意図分類の照合が素通りになる
+    assert intents_data
+
+
+@pytest.mark.parametrize('engine', app.SENTIMENT_ENGINES)
+def test_matcher_matches_reference(engine, intents_data, messages):
+    analyzer = app.AIMessageAnalyzer(engine)
+    reference_sentiment = REFERENCE_SENTIMENT[engine]
+
+    mismatches = []
+    # 感情はメッセージ全体をまとめて判定した結果も照合する
+    batch_sentiments = analyzer.analyze_sentiments(messages)
+    for message, batch_sentiment in zip(messages, batch_sentiments):
+        expected = (
+            reference_sentiment(analyzer, message),
+            reference_classify_intent(analyzer, message, intents_data)
+        )
+        actual = analyzer.analyze_message(message, intents_data)
+        if expected != actual or batch_sentiment != expected[0]:
+            mismatches.append(f"'{message}': 参照={expected} マッチャー={actual} まとめ判定={batch_sentiment}")
+
+    assert not mismatches, f"{len(messages)} 件中 {len(mismatches)} 件が不一致:\n" + '\n'.join(mismatches[:20])